@@ -1,410 +1,277 @@
-import streamlit as st
-import pandas as pd
-import requests
 from datetime import datetime, date
-from typing import List, Dict, Any, Optional
-from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterator, Callable
+import sqlite3
+import time
 import json
-import os
+import sys
+
+import streamlit as st
+import altair as alt
+import pandas as pd
+import numpy as np
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from itm_cc.client import (
+    CONFIG_PATH, POLYGON_BASE_URL, RunStats, check_polygon_plan_capabilities, detect_chain_source, detect_env_api_key,
+    get_capability_registry, get_disk_cache, get_metrics, get_polygon_client, get_single_flight, in_market_session,
+    quick_api_key_validation, quote_ttl, resolve_price_source, track_run,
+)
+from itm_cc.engine import (
+    AUTH_ABORT_MESSAGE, DEFAULT_DTE_WINDOW, DEFAULT_MAX_WORKERS, RESULTS_PAGE_ROWS, RISK_FREE_RATE, SORT_METRICS,
+    SWEEP_DTE_WINDOWS, SWEEP_METRICS, SWEEP_MIN_OI, SWEEP_MONEYNESS_BANDS, ScreenOutcome, TopKRanker,
+    add_analytics_columns, build_results_frame, filter_results_frame, format_age, get_chain_store, get_quote_store,
+    invalidate_ticker_data, iter_screen_tickers, iter_with_analytics, parse_dte_windows, parse_ranges, parse_values,
+    results_column_config, results_page, results_to_frame, scenario_grid, scenario_rows, screen_tickers, sweep_summary,
+    widest_window,
+)
+from itm_cc.live import LIVE_MAX_CONTRACTS, LIVE_REFRESH_SECONDS, apply_live_quotes, get_live_feed, ws_connect
+from itm_cc.prewarm import get_prewarm_scheduler, get_view_log, prewarm_status_frame
+
 
 # -----------------------------
-# Helper / API Functions
+# Streamlit App UI
 # -----------------------------
 
-@st.cache_data(show_spinner=False, ttl=300)
-def fetch_last_trade_with_fallback(ticker: str, api_key: str) -> tuple[Optional[float], Optional[str]]:
-    """Try multiple Polygon endpoints to obtain a last trade price (realtime if entitled).
-    Chain: last trade -> snapshot -> previous close. Returns (price, error_message).
-    """
-    headers = {"User-Agent": "ITM-Covered-Call-Screener/1.0"}
-    primary_url = f"https://api.polygon.io/v2/last/trade/{ticker.upper()}"
-    params = {"apiKey": api_key}
-
-    # 1. Primary endpoint
-    try:
-        resp = requests.get(primary_url, params=params, headers=headers, timeout=10)
-        if resp.status_code == 200:
-            data = resp.json()
-            last = data.get("last", {})
-            price = last.get("price") or last.get("p")
-            if price is not None:
-                return float(price), None
-            # fall through to fallback if structure unexpected
-        else:
-            # For common 403 provide clearer message
-            if resp.status_code in (401, 403):
-                try:
-                    j = resp.json()
-                    err_msg = j.get("error") or j.get("message") or (
-                        "Unauthorized (401)" if resp.status_code == 401 else "Forbidden (403)"
-                    )
-                except Exception:
-                    err_msg = (
-                        "Unauthorized (401) - check API key" if resp.status_code == 401 else "Forbidden (403)"
-                    )
-                prefix = "401" if resp.status_code == 401 else "403"
-                guidance = (
-                    "(Invalid / missing API key?)" if resp.status_code == 401 else "(Plan may not include realtime data)"
-                )
-                return None, f"{prefix} fetching last trade ({ticker}): {err_msg} {guidance}".strip()
-            # Other status codes capture
-            return None, f"HTTP {resp.status_code} fetching last trade ({ticker})."
-    except requests.RequestException as e:
-        # network-level issue - continue to fallback
-        pass
-
-    # 2. Snapshot fallback
-    snapshot_url = f"https://api.polygon.io/v2/snapshot/locale/us/markets/stocks/tickers/{ticker.upper()}"
-    try:
-        resp2 = requests.get(snapshot_url, params=params, headers=headers, timeout=10)
-        if resp2.status_code == 200:
-            data2 = resp2.json()
-            # Typical structure: {"ticker": {"lastTrade": {"p": 123.45, ...}, ...}}
-            tnode = data2.get("ticker") or {}
-            last_trade = tnode.get("lastTrade") or {}
-            price = last_trade.get("price") or last_trade.get("p")
-            if price is not None:
-                return float(price), None
-            return None, f"Snapshot endpoint returned no price for {ticker}."
-        else:
-            if resp2.status_code in (401, 403):
-                try:
-                    j2 = resp2.json()
-                    err_msg2 = j2.get("error") or j2.get("message") or (
-                        "Unauthorized (401)" if resp2.status_code == 401 else "Forbidden (403)"
-                    )
-                except Exception:
-                    err_msg2 = (
-                        "Unauthorized (401)" if resp2.status_code == 401 else "Forbidden (403)"
-                    )
-                prefix = "401" if resp2.status_code == 401 else "403"
-                return None, f"{prefix} snapshot ({ticker}): {err_msg2}"
-            return None, f"HTTP {resp2.status_code} snapshot for {ticker}."
-    except requests.RequestException:
-        return None, f"Network error retrieving price for {ticker}."
-
-    # 3. Previous close fallback
-    prev_price, prev_err = fetch_previous_close_price(ticker, api_key)
-    if prev_price is not None:
-        return prev_price, None
-
-    return None, prev_err or f"Price not found for {ticker} after all endpoints."
-
-
-@st.cache_data(show_spinner=False, ttl=600)
-def fetch_previous_close_price(ticker: str, api_key: str) -> tuple[Optional[float], Optional[str]]:
-    """Fetch previous close price for ticker using the Polygon prev aggregate endpoint."""
-    url = f"https://api.polygon.io/v2/aggs/ticker/{ticker.upper()}/prev"
-    params = {"apiKey": api_key}
-    try:
-        resp = requests.get(url, params=params, timeout=10)
-        if resp.status_code == 200:
-            data = resp.json()
-            results = data.get("results") or []
-            if results:
-                close_price = results[0].get("c")
-                if close_price is not None:
-                    return float(close_price), None
-            return None, f"Previous close not found for {ticker}."
-        else:
-            if resp.status_code in (401, 403):
-                try:
-                    j = resp.json(); msg = j.get("error") or j.get("message") or (
-                        "Unauthorized (401)" if resp.status_code == 401 else "Forbidden (403)"
-                    )
-                except Exception:
-                    msg = (
-                        "Unauthorized (401)" if resp.status_code == 401 else "Forbidden (403)"
-                    )
-                prefix = "401" if resp.status_code == 401 else "403"
-                return None, f"{prefix} previous close ({ticker}): {msg}"
-            return None, f"HTTP {resp.status_code} previous close ({ticker})."
-    except requests.RequestException:
-        return None, f"Network error previous close ({ticker})."
-def detect_env_api_key() -> Optional[str]:
-    """Return API key from environment if available."""
-    return os.environ.get("POLYGON_API_KEY")
-
-@st.cache_data(show_spinner=False, ttl=120)
-def quick_api_key_validation(api_key: str) -> tuple[bool, str]:
-    """Ping a lightweight endpoint to validate key (using previous close for SPY)."""
-    if not api_key:
-        return False, "Empty API key."
-    url = "https://api.polygon.io/v2/aggs/ticker/SPY/prev"
-    try:
-        resp = requests.get(url, params={"apiKey": api_key}, timeout=8)
-        if resp.status_code == 200:
-            return True, "Key valid (prev data accessible)."
-        if resp.status_code in (401, 403):
-            try:
-                j = resp.json(); msg = j.get("error") or j.get("message") or resp.reason
-            except Exception:
-                msg = resp.reason
-            return False, f"{resp.status_code} {msg}".strip()
-        return False, f"HTTP {resp.status_code} {resp.reason}"
-    except requests.RequestException as e:
-        return False, f"Network error: {e}"
-
-
-@st.cache_data(show_spinner=False, ttl=300)
-def check_polygon_plan_capabilities(api_key: str) -> dict:
-    """Test which Polygon endpoints are accessible with this API key."""
-    if not api_key:
-        return {"error": "No API key provided"}
-    
-    results = {}
-    test_ticker = "AAPL"
-    
-    # Test endpoints in order of importance
-    endpoints = [
-        ("Previous Close", f"https://api.polygon.io/v2/aggs/ticker/{test_ticker}/prev"),
-        ("Last Trade", f"https://api.polygon.io/v2/last/trade/{test_ticker}"),
-        ("Snapshot", f"https://api.polygon.io/v2/snapshot/locale/us/markets/stocks/tickers/{test_ticker}"),
-        ("Options Contracts", f"https://api.polygon.io/v3/reference/options/contracts?underlying_ticker={test_ticker}&contract_type=call&expired=false&limit=10"),
-    ]
-    
-    for name, url in endpoints:
-        try:
-            resp = requests.get(url, params={"apiKey": api_key}, timeout=10)
-            if resp.status_code == 200:
-                data = resp.json()
-                # Check if we got actual data
-                if name == "Options Contracts":
-                    contracts = data.get("results", [])
-                    if contracts:
-                        # Check if we have bid/ask data
-                        first_contract = contracts[0]
-                        has_quotes = bool(first_contract.get("last_quote"))
-                        results[name] = f"✅ Available ({len(contracts)} contracts, quotes: {'Yes' if has_quotes else 'No'})"
-                    else:
-                        results[name] = "⚠️ Endpoint works but no data returned"
-                elif name == "Previous Close":
-                    prev_results = data.get("results", [])
-                    if prev_results:
-                        results[name] = f"✅ Available (price: ${prev_results[0].get('c', 'N/A')})"
-                    else:
-                        results[name] = "⚠️ Endpoint works but no data"
-                elif name in ["Last Trade", "Snapshot"]:
-                    results[name] = "✅ Available"
-                else:
-                    results[name] = "✅ Available"
-            elif resp.status_code == 403:
-                try:
-                    error_msg = resp.json().get("error", "Forbidden")
-                except:
-                    error_msg = "Forbidden - plan restriction"
-                results[name] = f"❌ {error_msg}"
-            elif resp.status_code == 401:
-                results[name] = "❌ Unauthorized - check API key"
-            else:
-                results[name] = f"❌ HTTP {resp.status_code}"
-        except Exception as e:
-            results[name] = f"❌ Error: {str(e)[:50]}"
-    
-    return results
+DTE_SLIDER_RANGE = (1, 180)
 
 
-@st.cache_data(show_spinner=False, ttl=300)
-def fetch_options_chain(ticker: str, api_key: str) -> List[Dict[str, Any]]:
-    """Fetch up to 1000 call option contracts for the underlying ticker (non-expired)."""
-    url = (
-        f"https://api.polygon.io/v3/reference/options/contracts?"
-        f"underlying_ticker={ticker.upper()}&contract_type=call&expired=false&limit=1000"
-    )
-    params = {"apiKey": api_key}
+def sweep_fetch_window() -> Optional[tuple]:
+    """DTE envelope of the scenario grid while the sweep is enabled (from the widgets' last values), so a screen
+    fetches every grid window once; None when the sweep is off or its windows do not parse.
+    """
+    if not st.session_state.get("sweep_enabled"):
+        return None
     try:
-        resp = requests.get(url, params=params, timeout=20)
-        resp.raise_for_status()
-        data = resp.json()
-        results = data.get("results", [])
-        return results if isinstance(results, list) else []
-    except Exception:
-        return []
-
-
-# -----------------------------
-# Processing Logic
-# -----------------------------
-
-def extract_bid(contract: Dict[str, Any]) -> Optional[float]:
-    """Attempt to extract the bid price from various plausible locations in the contract payload.
-    Returns None if not available.
+        return widest_window(*parse_dte_windows(st.session_state.get("sweep_dte", SWEEP_DTE_WINDOWS)))
+    except ValueError:
+        return None
+
+LIVE_TABLE_ROWS = 1000  # rows shown while a screen streams in when "Show top" is unlimited
+
+
+def stream_screen_results(
+    outcomes: Iterator[ScreenOutcome],
+    total: int,
+    sort_choice: str,
+    show_formatted: bool,
+    refresh_seconds: float = 0.5,
+    row_filter: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+    top_k: int = 0,
+    per_ticker: int = 0,
+) -> tuple[List[Dict[str, Any]], List[str]]:
+    """Consume screening outcomes as tickers complete: progress bar, per-ticker status log (errors inline)
+    and a live table of the best rows so far (top_k, or LIVE_TABLE_ROWS when unlimited), redrawn at most
+    every refresh_seconds. The live table is ranked incrementally (TopKRanker), so redraws cost O(top_k).
+    row_filter narrows the live table only; returns all (results, errors) in input ticker order, like screen_tickers.
     """
-    # Potential key paths observed/anticipated
-    candidates = []
-    last_quote = contract.get("last_quote") or contract.get("last_quote_detail") or {}
-    if isinstance(last_quote, dict):
-        candidates.extend([
-            last_quote.get("bid"),
-            last_quote.get("bid_price"),
-            last_quote.get("p_bid"),  # arbitrary fallback
-        ])
-    # Some Polygon structures might nest deeper or use short keys; extend here if needed.
-    for val in candidates:
-        if val is not None:
-            try:
-                v = float(val)
-                if v > 0:
-                    return v
-            except (TypeError, ValueError):
-                continue
-    return None
-
-
-def process_ticker(
-    ticker: str,
-    api_key: str,
-    dte_min: int,
-    dte_max: int,
-    min_oi: int,
-    today: date,
-    min_premium: float = 0.0,
-    min_annualized_roi: float = 0.0,
-    price_source_mode: str = "auto",
-) -> List[Dict[str, Any]]:
-    """Process one ticker and return list of opportunity dicts."""
-    opportunities: List[Dict[str, Any]] = []
-
-    # Get stock price
-    if price_source_mode == "previous_close":
-        stock_price, price_err = fetch_previous_close_price(ticker, api_key)
-    else:  # auto
-        stock_price, price_err = fetch_last_trade_with_fallback(ticker, api_key)
-    if stock_price is None or stock_price <= 0:
-        raise ValueError(price_err or f"Could not get valid last trade price for {ticker}.")
-
-    # Get options chain
-    contracts = fetch_options_chain(ticker, api_key)
-    if not contracts:
-        raise ValueError(f"No option contracts retrieved for {ticker}.")
-
-    for contract in contracts:
-        try:
-            strike = contract.get("strike_price") or contract.get("strike")
-            expiration = contract.get("expiration_date") or contract.get("expiration")
-            open_interest = contract.get("open_interest") or contract.get("oi")
-
-            if strike is None or expiration is None or open_interest is None:
-                continue  # missing critical fields
-
-            # Normalize
-            strike = float(strike)
-            open_interest = int(open_interest)
-
-            # Parse expiration date (Polygon uses YYYY-MM-DD)
-            try:
-                exp_dt = datetime.strptime(expiration[:10], "%Y-%m-%d").date()
-            except Exception:
-                continue
-
-            dte = (exp_dt - today).days
-            if dte < 0:
-                continue  # already expired (shouldn't happen with expired=false)
-
-            # DTE filter
-            if not (dte_min <= dte <= dte_max):
-                continue
-
-            # ITM filter: strike below current stock price
-            if strike >= stock_price:
-                continue
-
-            # Liquidity filter
-            if open_interest < min_oi:
-                continue
-
-            bid = extract_bid(contract)
-            if bid is None or bid <= 0:
-                continue  # skip if no usable premium
-
-            premium = bid  # premium per share
-
-            breakeven = stock_price - premium
-            downside_protection_pct = (stock_price - breakeven) / stock_price * 100.0  # simplifies to premium/price
-
-            # Profit if assigned at expiration (per 100 shares)
-            profit_assigned = (strike * 100) - (stock_price * 100) + (premium * 100)
-            return_if_assigned_pct = (profit_assigned / (stock_price * 100)) * 100.0
-            if dte == 0:
-                # Avoid divide by zero; treat as extremely short-term; skip
-                continue
-            annualized_roi_pct = return_if_assigned_pct * (365.0 / dte)
-
-            # Additional threshold filters applied after computation
-            if premium < min_premium:
-                continue
-            if annualized_roi_pct < min_annualized_roi:
-                continue
-
-            opportunities.append(
-                {
-                    "Ticker": ticker.upper(),
-                    "Stock Price": stock_price,
-                    "Strike": strike,
-                    "Expiration": exp_dt.isoformat(),
-                    "DTE": dte,
-                    "Premium": premium,
-                    "Return if Assigned %": return_if_assigned_pct,
-                    "Breakeven": breakeven,
-                    "Downside Protection %": downside_protection_pct,
-                    "Annualized ROI %": annualized_roi_pct,
-                    "Open Interest": open_interest,
-                }
+    progress = st.progress(0.0, text=f"Screening {total} tickers...")
+    status = st.status(f"Per-ticker status (0/{total})", expanded=False)
+    table_slot = st.empty()
+
+    opps_by_index: Dict[int, List[Dict[str, Any]]] = {}
+    errors_by_index: Dict[int, str] = {}
+    live = TopKRanker(top_k or LIVE_TABLE_ROWS, per_ticker)
+    live_changed = False
+    aborted = False
+    done = 0
+    last_draw = 0.0
+
+    for outcome in outcomes:
+        done += 1
+        if outcome.error:
+            errors_by_index[outcome.index] = outcome.error
+            status.write(f"❌ {outcome.error}")
+            if len(errors_by_index) == 1:
+                status.update(expanded=True)
+        else:
+            opps_by_index[outcome.index] = outcome.opportunities
+            passing = outcome.opportunities
+            if row_filter is not None and passing:
+                passing = row_filter(results_to_frame(passing)).to_dict("records")
+            live.add(passing)
+            live_changed = live_changed or bool(passing)
+            status.write(f"✅ {outcome.ticker}: {len(outcome.opportunities)} opportunities")
+        if outcome.aborted:
+            aborted = True
+            status.write(f"⛔ {AUTH_ABORT_MESSAGE}")
+        progress.progress(
+            done / total if total else 1.0,
+            text=f"{done}/{total} tickers screened, {live.seen} matching contracts so far (last: {outcome.ticker})",
+        )
+        status.update(label=f"Per-ticker status ({done}/{total})")
+        now = time.monotonic()
+        if live_changed and now - last_draw >= refresh_seconds:
+            table_slot.dataframe(
+                results_to_frame(live.top(sort_choice)),
+                use_container_width=True,
+                column_config=results_column_config(show_formatted),
             )
-        except Exception:
-            # Skip contract-level errors silently to keep flow smooth
-            continue
-
-    return opportunities
+            live_changed = False
+            last_draw = now
 
+    status.update(
+        label=f"Per-ticker status ({done}/{total}, {len(errors_by_index)} errors)",
+        state="error" if aborted else "complete",
+    )
+    progress.empty()
+    table_slot.empty()  # the caller renders the final table
+
+    results: List[Dict[str, Any]] = []
+    errors: List[str] = []
+    for i in range(total):
+        results.extend(opps_by_index.get(i, []))
+        if i in errors_by_index:
+            errors.append(errors_by_index[i])
+    if aborted:
+        errors.append(AUTH_ABORT_MESSAGE)
+    return results, errors
+
+
+def render_results_table(df: pd.DataFrame, formatted: bool, key: str = "results") -> None:
+    """Show a sorted result frame with numeric columns and column_config formats. Beyond RESULTS_PAGE_ROWS rows
+    only the selected page is sent to the browser; pages follow the server-side sort, so header clicks
+    reorder the current page only.
+    """
+    pages = max(1, -(-len(df) // RESULTS_PAGE_ROWS))
+    page = 1
+    if pages > 1:
+        page_key = f"{key}_page"
+        if st.session_state.get(page_key, 1) > pages:  # fewer rows since the page was picked
+            st.session_state[page_key] = pages
+        page = int(st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, key=page_key))
+        start = (page - 1) * RESULTS_PAGE_ROWS
+        st.caption(f"Rows {start + 1:,}-{min(start + RESULTS_PAGE_ROWS, len(df)):,} of {len(df):,}.")
+    st.dataframe(
+        results_page(df, page), use_container_width=True, column_config=results_column_config(formatted)
+    )
 
-# -----------------------------
-# Formatting Helpers
-# -----------------------------
 
-def format_dataframe(df: pd.DataFrame) -> pd.DataFrame:
-    """Return a copy of df with formatted string columns for display."""
-    df_disp = df.copy()
-
-    # Currency formatting
-    currency_cols = ["Stock Price", "Strike", "Premium", "Breakeven"]
-    for col in currency_cols:
-        if col in df_disp.columns:
-            df_disp[col] = df_disp[col].map(lambda x: f"${x:,.2f}")
-
-    # Percentage formatting
-    pct_cols = [
-        "Return if Assigned %",
-        "Downside Protection %",
-        "Annualized ROI %",
+def render_scenario_sweep(
+    df: pd.DataFrame, sort_choice: str, formatted: bool, cache_key: Any, fetched_window: tuple
+) -> None:
+    """Scenario grid over the stored (already fetched) frame: heatmap of one metric, the full summary and the
+    rows behind any scenario. The summary is kept in session state until the data or the grid changes.
+    Windows reaching outside fetched_window are flagged rather than shown as if they had no contracts.
+    """
+    col_dte, col_band, col_oi = st.columns(3)
+    dte_text = col_dte.text_input("DTE windows", SWEEP_DTE_WINDOWS, key="sweep_dte")
+    band_text = col_band.text_input(
+        "Moneyness bands (strike / price)", SWEEP_MONEYNESS_BANDS, key="sweep_bands",
+        help="Upper bound exclusive; ITM calls are below 1.0.",
+    )
+    oi_text = col_oi.text_input("Min open interest", SWEEP_MIN_OI, key="sweep_oi")
+    try:
+        grid = scenario_grid(parse_dte_windows(dte_text), parse_ranges(band_text), parse_values(oi_text))
+    except ValueError as e:
+        st.error(f"Scenario grid: {e}")
+        return
+    outside = [
+        f"{lo}-{hi}" for lo, hi in parse_dte_windows(dte_text) if lo < fetched_window[0] or hi > fetched_window[1]
     ]
-    for col in pct_cols:
-        if col in df_disp.columns:
-            df_disp[col] = df_disp[col].map(lambda x: f"{x:,.2f}%")
-
-    return df_disp
-
+    if outside:
+        st.warning(
+            f"DTE windows {', '.join(outside)} reach outside the fetched {fetched_window[0]}-{fetched_window[1]} "
+            "days, so their cells are incomplete; they are fetched with the next screen."
+        )
+    key = (cache_key, dte_text, band_text, oi_text)
+    cached = st.session_state.get("sweep_summary")
+    if cached is None or cached[0] != key:
+        cached = (key, sweep_summary(df, grid))
+        st.session_state["sweep_summary"] = cached
+    summary = cached[1]
+
+    col_metric, col_floor = st.columns(2)
+    metric = col_metric.selectbox("Heatmap metric", SWEEP_METRICS[2:] + SWEEP_METRICS[:2], key="sweep_metric")
+    floor = col_floor.selectbox("Open interest floor", sorted(summary["Min OI"].unique()), key="sweep_floor")
+    cells = summary[summary["Min OI"] == floor].rename(columns={metric: "value"})
+    heatmap = alt.Chart(cells).encode(
+        x=alt.X("DTE Window:O", sort=list(dict.fromkeys(grid["DTE Window"]))),
+        y=alt.Y("Moneyness:O", sort=list(dict.fromkeys(grid["Moneyness"]))),
+        tooltip=["Scenario", alt.Tooltip("value:Q", title=metric, format=",.2f"), "Contracts", "Tickers"],
+    )
+    st.altair_chart(
+        heatmap.mark_rect().encode(color=alt.Color("value:Q", title=metric))
+        + heatmap.mark_text(baseline="middle").encode(text=alt.Text("value:Q", format=",.1f")),
+        use_container_width=True,
+    )
+    st.dataframe(summary, use_container_width=True, hide_index=True, column_config={
+        name: st.column_config.NumberColumn(format="%.2f%%") for name in SWEEP_METRICS if name.endswith("%")
+    })
+    choice = st.selectbox("Show the contracts behind scenario", summary["Scenario"], key="sweep_drill")
+    rows = scenario_rows(df, grid, int(np.flatnonzero(summary["Scenario"].to_numpy() == choice)[0]))
+    if rows.empty:
+        st.info("No contracts in this scenario.")
+    else:
+        render_results_table(build_results_frame(rows, sort_choice), formatted, key="sweep_rows")
+
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def render_live_results(
+    stored: Dict[str, Any], api_key: str, rate: float, session_id: str, show_results: Callable[[], pd.DataFrame]
+) -> None:
+    """Live mode: on every redraw (at most every LIVE_REFRESH_SECONDS, this fragment only) fold the trades and
+    quotes that arrived since the last one into the stored frame, show the results and subscribe to exactly
+    the underlyings and contracts on screen.
+    """
+    feed = get_live_feed(api_key)
+    cursor, prices, bids = feed.updates_since(stored.get("live_cursor", 0))
+    if prices or bids:
+        stored["df"], repriced = apply_live_quotes(stored["df"], prices, bids, rate)
+        stored["live_repriced"] = stored.get("live_repriced", 0) + repriced
+        stored["live_at"] = datetime.now()
+    stored["live_cursor"] = cursor
+    stored["live_api_key"] = api_key
+    df = show_results()
+    watched = df.head(LIVE_MAX_CONTRACTS)
+    feed.subscribe(session_id, watched["Ticker"].unique(), watched["Contract"].dropna().unique())
+    stats = feed.stats()
+    last = ""
+    if "live_at" in stored:
+        last = f", last {format_age((datetime.now() - stored['live_at']).total_seconds())} ago"
+    st.caption(
+        f"Live: stocks feed {stats['stocks']}, options feed {stats['options']}; "
+        f"{stored.get('live_repriced', 0):,} row updates applied{last}."
+    )
 
-def sort_dataframe(df: pd.DataFrame, sort_choice: str) -> pd.DataFrame:
-    mapping = {
-        "Return if Assigned %": "Return if Assigned %",
-        "Downside Protection %": "Downside Protection %",
-        "Annualized ROI %": "Annualized ROI %",
-    }
-    sort_col = mapping.get(sort_choice, "Return if Assigned %")
-    return df.sort_values(by=sort_col, ascending=False)
 
+def render_run_diagnostics(container, summary: Optional[Dict[str, Any]]) -> None:
+    """Show the last run's request / stage / cache instrumentation with JSON and Prometheus exports."""
+    with container:
+        st.markdown("**Last run timings**")
+        if not summary:
+            st.caption("Run a screen to collect request, stage and cache statistics.")
+            return
+        st.caption(
+            f"{summary['label']} at {summary['started_at']}: {summary['requests']} requests, "
+            f"{summary['bytes'] / 1024:,.0f} KB, latency p50 {summary['latency_p50_ms']} ms / "
+            f"p95 {summary['latency_p95_ms']} ms, wall {summary['wall_seconds'] or 0:.2f} s"
+        )
+        if summary["endpoints"]:
+            endpoints = pd.DataFrame.from_dict(summary["endpoints"], orient="index")
+            endpoints["statuses"] = endpoints["statuses"].map(
+                lambda d: ", ".join(f"{k}: {v}" for k, v in sorted(d.items()))
+            )
+            st.dataframe(endpoints, use_container_width=True)
+        if summary["stages"]:
+            st.dataframe(pd.DataFrame.from_dict(summary["stages"], orient="index"), use_container_width=True)
+        if summary["cache"]:
+            st.dataframe(pd.DataFrame.from_dict(summary["cache"], orient="index"), use_container_width=True)
+        st.download_button(
+            "Export run JSON", json.dumps(summary, indent=2), file_name="itm_cc_run_metrics.json",
+            mime="application/json", use_container_width=True,
+        )
+        st.download_button(
+            "Export Prometheus metrics", get_metrics().prometheus_text(), file_name="itm_cc_metrics.prom",
+            mime="text/plain", use_container_width=True,
+        )
 
-# -----------------------------
-# Streamlit App UI
-# -----------------------------
 
 def main():
     st.set_page_config(page_title="ITM Covered Call Screener", layout="wide")
     st.title("ITM Covered Call Screener")
 
     # Config persistence - load early to populate widgets
-    config_path = Path(__file__).parent / ".itm_cc_config.json"
+    config_path = CONFIG_PATH
     
     # Initialize session state for config loading
     if 'config_loaded' not in st.session_state:
@@ -481,7 +348,7 @@ def main():
                         if "401" in msg:
                             st.error("🔍 Debugging info:")
                             st.code(f"Raw key: '{api_key}'")
-                            st.code(f"Test URL used: https://api.polygon.io/v2/aggs/ticker/SPY/prev?apiKey={api_key[:8]}...")
+                            st.code(f"Test URL used: {POLYGON_BASE_URL}/v2/aggs/ticker/SPY/prev?apiKey={api_key[:8]}...")
                             st.info("💡 Try testing this URL directly in your browser or with curl")
                 else:
                     st.error("No API key to test")
@@ -500,16 +367,52 @@ def main():
         with col3:
             if st.button("Copy Test URL", use_container_width=True):
                 if api_key:
-                    test_url = f"https://api.polygon.io/v2/aggs/ticker/SPY/prev?apiKey={api_key}"
+                    test_url = f"{POLYGON_BASE_URL}/v2/aggs/ticker/SPY/prev?apiKey={api_key}"
                     st.code(test_url)
                     st.info("Copy this URL to test in browser/curl")
                 else:
                     st.error("Need API key")
+
+        disk_cache = get_disk_cache()
+        if disk_cache is not None:
+            cache_stats = disk_cache.stats()
+            st.caption(
+                f"Disk cache: {cache_stats['fresh_entries']}/{cache_stats['entries']} fresh entries, "
+                f"{cache_stats['bytes'] / 1024 / 1024:.1f} of {cache_stats['max_bytes'] / 1024 / 1024:.0f} MB"
+            )
+            if st.button("Clear Disk Cache", use_container_width=True):
+                disk_cache.clear()
+                st.cache_data.clear()
+                get_chain_store().clear()
+                get_quote_store().clear()
+                get_single_flight().clear()
+                st.success("Disk cache cleared.")
+        else:
+            st.caption("Disk cache unavailable (cache file could not be opened).")
+
+        store_stats = get_chain_store().stats()
+        quote_stats = get_quote_store().stats()
+        session = "open" if in_market_session() else "closed"
+        st.caption(
+            f"Chain store: {store_stats['entries']} tickers, {store_stats['contracts']:,} listed contracts "
+            f"(until the next trading day); {quote_stats['contracts']:,} quoted contracts (market {session}: "
+            f"quotes kept {format_age(quote_ttl())})"
+        )
+        flight_stats = get_single_flight().stats()
+        st.caption(
+            f"Shared fetches (all sessions): {flight_stats.get('upstream', 0)} upstream, "
+            f"{flight_stats.get('coalesced', 0)} coalesced onto in-flight requests, "
+            f"{flight_stats.get('hits', 0)} shared-cache hits, {flight_stats['in_flight']} in flight now"
+        )
+        st.caption(f"Requests skipped on known 401 / 403 endpoints: {get_capability_registry().skipped}")
+
+        # Filled at the end of the script so a run's numbers show up on the same rerun
+        run_diagnostics = st.container()
     dte_range = st.sidebar.slider(
         "Desired DTE Range (Days)",
-        min_value=1,
-        max_value=180,
-        value=(25, 45),
+        min_value=DTE_SLIDER_RANGE[0],
+        max_value=DTE_SLIDER_RANGE[1],
+        value=DEFAULT_DTE_WINDOW,
         step=1,
     )
     min_oi = st.sidebar.number_input(
@@ -524,15 +427,77 @@ def main():
         "Minimum Annualized ROI %", min_value=0.0, value=0.0, step=1.0,
         help="Exclude contracts whose annualized ROI % is below this threshold."
     )
-    sort_choice = st.sidebar.selectbox(
-        "Sort by", ["Return if Assigned %", "Downside Protection %", "Annualized ROI %"],
+    sort_choice = st.sidebar.selectbox("Sort by", SORT_METRICS)
+    top_k = st.sidebar.number_input(
+        "Show top N rows", min_value=0, value=0, step=100,
+        help="Only rank and display the best N rows for the sort metric (0 = all). Keeps large screens responsive."
+    )
+    per_ticker = st.sidebar.number_input(
+        "Best N contracts per ticker", min_value=0, value=0, step=1,
+        help="Keep only each underlying's best N contracts for the sort metric (0 = no cap)."
     )
+    risk_free_pct = st.sidebar.number_input(
+        "Risk-free Rate %", min_value=0.0, max_value=20.0, value=RISK_FREE_RATE * 100.0, step=0.25,
+        help="Annual rate used for implied volatility, delta, assignment probability and expected return. "
+             "Changing it recomputes those columns without refetching."
+    )
+    risk_free_rate = float(risk_free_pct) / 100.0
     price_source_mode = st.sidebar.selectbox(
         "Price Source", ["Auto (Realtime->Snapshot->Prev Close)", "Previous Close Only"],
-        help="Use Previous Close Only if your plan does not include realtime data.")
+        help="Auto detects your plan on the first screen and switches to previous close when realtime "
+             "endpoints are not included. Endpoints your plan refuses are never requested again.")
+    price_source_key = "previous_close" if price_source_mode.startswith("Previous") else "auto"
+    if api_key and get_capability_registry().known(api_key):
+        realtime = resolve_price_source(api_key) == "auto"
+        st.sidebar.caption(
+            f"Detected plan: {'realtime / snapshot prices' if realtime else 'previous close prices only'}, "
+            f"{detect_chain_source(api_key)} option chains."
+        )
+    max_workers = st.sidebar.number_input(
+        "Max Concurrent Tickers", min_value=1, max_value=32, value=DEFAULT_MAX_WORKERS, step=1,
+        help="How many tickers are fetched and processed in parallel. Lower this if you hit rate limits."
+    )
+    client = get_polygon_client()
+    rate_limit_rpm = st.sidebar.number_input(
+        "Rate Limit (requests/min)", min_value=0, value=int(client.limiter.rate_per_minute), step=5,
+        help="Shared across all sessions on this server. 0 = unlimited. Free Polygon plans allow 5/min."
+    )
+    if float(rate_limit_rpm) != client.limiter.rate_per_minute:
+        client.limiter.configure(float(rate_limit_rpm))
+    with st.sidebar.expander("Background pre-warm"):
+        scheduler = get_prewarm_scheduler()
+        prewarm = st.toggle(
+            "Keep watched tickers warm", value=scheduler.running, disabled=not api_key,
+            help="During market hours, re-fetch prices and quotes of the saved watchlist and of tickers screened "
+                 "in the last week shortly before they go stale (stalest and most recently viewed first), using "
+                 "at most half the rate limit, so screens are served from the cache. Shared by every session on "
+                 "this server; `python app.py prewarm` runs the same loop as a separate worker.",
+        )
+        if prewarm and api_key:
+            scheduler.watch_window(dte_range)
+            scheduler.start(api_key, price_source_key, int(max_workers))
+        elif not prewarm and scheduler.running:
+            scheduler.stop()
+        status = scheduler.status
+        summary = f"{status['state'].capitalize()}."
+        if status["last_cycle_at"] is not None:
+            summary += (
+                f" Last cycle {format_age(time.time() - status['last_cycle_at'])} ago: {len(status['refreshed'])} "
+                f"of {status['due']} due tickers refreshed with {status['requests']} requests."
+            )
+        if status["next_run_at"] is not None:
+            summary += f" Next in {format_age(status['next_run_at'] - time.time())}."
+        st.caption(summary)
+        for error in status["errors"][:3]:
+            st.caption(f"⚠️ {error}")
+        st.dataframe(prewarm_status_frame(scheduler), hide_index=True, use_container_width=True)
+    progressive = st.sidebar.checkbox(
+        "Stream results as tickers complete", value=True,
+        help="Show a progress bar, per-ticker status and a table that fills in while the screen runs."
+    )
     show_formatted = st.sidebar.checkbox(
         "Format numbers (currency & %)", value=True,
-        help="Uncheck to keep raw numeric values (enables copy & further numeric sorting)."
+        help="Display formatting only: values stay numeric either way, so column sorting and copying work."
     )
 
     remember = st.sidebar.checkbox(
@@ -558,7 +523,28 @@ def main():
     )
     tickers = [t.strip().upper() for t in tickers_text.splitlines() if t.strip()]
 
-    if st.button("Find Opportunities", type="primary"):
+    def apply_filters(frame: pd.DataFrame) -> pd.DataFrame:
+        return filter_results_frame(
+            frame, dte_range[0], dte_range[1], int(min_oi), float(min_premium), float(min_annualized_roi)
+        )
+
+    stored = st.session_state.get('screen_data')
+    find_col, refresh_col = st.columns([1, 1])
+    find_clicked = find_col.button("Find Opportunities", type="primary")
+    refresh_clicked = stored is not None and refresh_col.button(
+        "Refresh Data", help="Refetch prices and option quotes for the current tickers (contract listings are kept)."
+    )
+
+    # Only the slider's expirations (and the scenario grid's, while the sweep is on) are fetched; narrowing
+    # filters reuse the stored frame, widening past the fetched window refetches (the chain store keeps the
+    # listings that still cover it)
+    wanted_window = widest_window(tuple(dte_range), sweep_fetch_window())
+    widened = (
+        stored is not None and not find_clicked and not refresh_clicked
+        and widest_window(stored["dte_window"], wanted_window) != stored["dte_window"]
+    )
+    run_stats: Optional[RunStats] = None
+    if find_clicked or refresh_clicked or widened:
         if not api_key:
             st.error("Please enter your Polygon.io API key in the sidebar.")
             return
@@ -566,28 +552,42 @@ def main():
             st.warning("Please enter at least one ticker.")
             return
 
-        results: List[Dict[str, Any]] = []
-        errors: List[str] = []
+        if refresh_clicked:
+            invalidate_ticker_data(tickers)
         today = date.today()
+        fetched_at = datetime.now()
+        fetch_window = widest_window(stored["dte_window"], wanted_window) if widened else wanted_window
+        if widened:
+            st.info(f"DTE range or scenario grid reaches past the fetched {stored['dte_window'][0]}-"
+                    f"{stored['dte_window'][1]} days; fetching the added expirations.")
+
+        # Fetch the DTE window with the widest other thresholds; the sidebar filters are applied to the
+        # stored frame below
+        screen_args = (tickers, api_key, *fetch_window, 0, today)
+        screen_kwargs = dict(
+            min_premium=0.0,
+            min_annualized_roi=float("-inf"),
+            price_source_mode=price_source_key,
+            max_workers=int(max_workers),
+        )
+        with track_run(f"{len(tickers)} tickers") as run_stats:
+            if progressive:
+                results, errors = stream_screen_results(
+                    iter_with_analytics(iter_screen_tickers(*screen_args, **screen_kwargs), risk_free_rate),
+                    len(tickers), sort_choice, show_formatted, row_filter=apply_filters,
+                    top_k=int(top_k), per_ticker=int(per_ticker),
+                )
+            else:
+                with st.spinner("Fetching and processing option data..."):
+                    results, errors = screen_tickers(*screen_args, **screen_kwargs, risk_free_rate=risk_free_rate)
 
-        with st.spinner("Fetching and processing option data..."):
-            for tk in tickers:
-                try:
-                    opps = process_ticker(
-                        tk, api_key, dte_range[0], dte_range[1], int(min_oi), today,
-                        min_premium=float(min_premium),
-                        min_annualized_roi=float(min_annualized_roi),
-                        price_source_mode=(
-                            "previous_close" if price_source_mode.startswith("Previous") else "auto"
-                        ),
-                    )
-                    results.extend(opps)
-                except Exception as e:
-                    errors.append(f"{tk}: {e}")
-                    # Abort early if all remaining likely to fail due to auth
-                    if "401" in str(e) and len(results) == 0:
-                        errors.append("Authentication issue detected. Aborting remaining tickers.")
-                        break
+        view_log = get_view_log()
+        if view_log is not None:
+            try:
+                view_log.record(tickers)
+            except sqlite3.Error:
+                pass
+        get_prewarm_scheduler().watch_window(fetch_window)
 
         # Save config if requested & successful button press
         if remember and api_key:
@@ -600,45 +600,96 @@ def main():
             except Exception:
                 st.sidebar.warning("Failed to save config file.")
 
-        if results:
-            df = pd.DataFrame(results)
-            # Ensure column order
-            desired_cols = [
-                "Ticker",
-                "Stock Price",
-                "Strike",
-                "Expiration",
-                "DTE",
-                "Premium",
-                "Return if Assigned %",
-                "Breakeven",
-                "Downside Protection %",
-                "Annualized ROI %",
-                "Open Interest",
-            ]
-            df = df[desired_cols]
-
-            # Sort numeric before formatting
-            df = sort_dataframe(df, sort_choice)
-            if show_formatted:
-                df_display = format_dataframe(df)
-            else:
-                df_display = df
-
-            st.success(f"Found {len(df)} opportunities after filters.")
-            st.dataframe(df_display, use_container_width=True)
+        stored = {
+            "df": results_to_frame(results),
+            "errors": errors,
+            "fetched_at": fetched_at,
+            "tickers": list(tickers),
+            "price_source_mode": price_source_key,
+            "risk_free_rate": risk_free_rate,
+            "dte_window": fetch_window,
+        }
+        st.session_state['screen_data'] = stored
+
+    if stored is not None:
+        render_started = time.perf_counter()
+        if stored.get("risk_free_rate") != risk_free_rate:
+            stored["df"] = add_analytics_columns(stored["df"], risk_free_rate)
+            stored["risk_free_rate"] = risk_free_rate
+        age_seconds = (datetime.now() - stored["fetched_at"]).total_seconds()
+        st.caption(
+            f"Data as of {stored['fetched_at']:%Y-%m-%d %H:%M:%S} ({format_age(age_seconds)} ago) for "
+            f"{len(stored['tickers'])} tickers, {len(stored['df'])} ITM contracts at "
+            f"{stored['dte_window'][0]}-{stored['dte_window'][1]} DTE before filters. Sort, format and narrowing "
+            "filter changes apply to this data without refetching."
+        )
+        if stored["tickers"] != tickers or stored["price_source_mode"] != price_source_key:
+            st.info("Tickers or price source changed since this data was fetched. Click Refresh Data to update.")
+
+        def show_results() -> pd.DataFrame:
+            df_filtered = apply_filters(stored["df"])
+            if df_filtered.empty:
+                st.info("No opportunities found matching your criteria.")
+                return df_filtered
+            df = build_results_frame(df_filtered, sort_choice, int(top_k), int(per_ticker))
+            shown = f", showing the best {len(df)}" if len(df) < len(df_filtered) else ""
+            st.success(f"Found {len(df_filtered)} opportunities after filters{shown}.")
+            render_results_table(df, show_formatted)
+            return df
+
+        live_enabled = st.toggle(
+            "Live quotes", key="live_enabled", disabled=ws_connect is None or not api_key,
+            help="Stream trades for the shown underlyings and quotes for the shown contracts (best "
+                 f"{LIVE_MAX_CONTRACTS:,}) over Polygon's WebSocket feed and reprice the table in place, redrawn at "
+                 f"most every {LIVE_REFRESH_SECONDS:g}s. Needs a plan with real-time (or delayed) streaming"
+                 + ("." if ws_connect is not None else "; install the websockets package to enable."),
+        )
+        session_id = get_script_run_ctx().session_id if get_script_run_ctx() is not None else "main"
+        if live_enabled and ws_connect is not None and api_key:
+            render_live_results(stored, api_key, risk_free_rate, session_id, show_results)
         else:
-            st.info("No opportunities found matching your criteria.")
+            subscribed_key = stored.pop("live_api_key", None)
+            if subscribed_key:  # live mode was just switched off: stop streaming this session's symbols
+                get_live_feed(subscribed_key).subscribe(session_id, (), ())
+            show_results()
+        if run_stats is not None:
+            run_stats.record_stage("", "render", time.perf_counter() - render_started)
+            st.session_state['last_run_stats'] = run_stats.summary()
+
+        with st.expander("Scenario sweep (DTE windows x moneyness x open interest)"):
+            if st.checkbox(
+                "Evaluate scenario grid", key="sweep_enabled",
+                help="Summarizes every scenario from one fetch of the grid's whole DTE range (enabling it or "
+                     "widening the grid refetches once). The minimum premium and ROI filters apply; DTE and open "
+                     "interest come from the grid.",
+            ):
+                render_scenario_sweep(
+                    filter_results_frame(
+                        stored["df"], *stored["dte_window"], 0, float(min_premium), float(min_annualized_roi)
+                    ),
+                    sort_choice, show_formatted,
+                    (
+                        stored["fetched_at"], stored.get("risk_free_rate"), stored.get("live_cursor"),
+                        float(min_premium), float(min_annualized_roi),
+                    ),
+                    stored["dte_window"],
+                )
 
-        if errors:
+        if stored["errors"]:
             with st.expander("View errors / skipped tickers"):
-                for msg in errors:
+                for msg in stored["errors"]:
                     st.write(msg)
 
+    render_run_diagnostics(run_diagnostics, st.session_state.get('last_run_stats'))
+
     st.caption(
         "All data sourced from Polygon.io. This tool is for informational purposes only and not investment advice."  # noqa: E501
     )
 
 
 if __name__ == "__main__":
+    from itm_cc.cli import CLI_COMMANDS, cli_main
+
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        sys.exit(cli_main(sys.argv[1:]))
     main()
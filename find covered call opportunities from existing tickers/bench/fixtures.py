@@ -0,0 +1,160 @@
+"""Synthetic and recorded Polygon payloads for benchmarks.
+
+Synthetic chains are deterministic per (ticker, size, seed) and shaped like the
+/v3/reference/options/contracts results that process_ticker consumes.
+
+Recorded fixtures are gzip JSON files ({"price": float, "contracts": [...]}) captured
+from the real API with:
+
+    python bench/fixtures.py record --tickers AAPL,MSFT --out bench/fixtures/recorded
+"""
+import argparse
+import gzip
+import json
+import math
+import random
+import sys
+import zlib
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+BENCH_DIR = Path(__file__).resolve().parent
+APP_DIR = BENCH_DIR.parent
+RECORDED_DIR = BENCH_DIR / "fixtures" / "recorded"
+
+CHAIN_SIZES = [50, 500, 5_000, 20_000]
+
+
+def synthetic_price(ticker: str) -> float:
+    """Deterministic underlying price in the $20 - $500 range."""
+    return round(20.0 + zlib.crc32(ticker.upper().encode()) % 48_000 / 100.0, 2)
+
+
+def _next_friday(d: date) -> date:
+    return d + timedelta(days=(4 - d.weekday()) % 7 or 7)
+
+
+def synthetic_chain(
+    ticker: str,
+    n_contracts: int,
+    seed: int = 0,
+    today: Optional[date] = None,
+    stock_price: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """Build n_contracts call contracts spread over weekly expirations and a strike ladder around the price.
+    About 10% of contracts have no quote and 5% have zero open interest, like thin real chains.
+    """
+    today = today or date.today()
+    price = stock_price or synthetic_price(ticker)
+    rnd = random.Random(f"{ticker.upper()}:{n_contracts}:{seed}")
+    n_expirations = max(1, min(104, n_contracts // 25))
+    strikes_per_exp = math.ceil(n_contracts / n_expirations)
+    step = max(0.5, round(price * 1.2 / strikes_per_exp, 1))
+    low = max(step, price * 0.4)
+
+    contracts: List[Dict[str, Any]] = []
+    expiration = _next_friday(today)
+    for _ in range(n_expirations):
+        dte = (expiration - today).days
+        for j in range(strikes_per_exp):
+            if len(contracts) >= n_contracts:
+                break
+            strike = round(low + j * step, 2)
+            intrinsic = max(0.0, price - strike)
+            time_value = price * 0.25 * math.sqrt(dte / 365.0) * math.exp(-abs(price - strike) / price * 3)
+            contract: Dict[str, Any] = {
+                "ticker": f"O:{ticker.upper()}{expiration:%y%m%d}C{int(round(strike * 1000)):08d}",
+                "underlying_ticker": ticker.upper(),
+                "contract_type": "call",
+                "exercise_style": "american",
+                "shares_per_contract": 100,
+                "strike_price": strike,
+                "expiration_date": expiration.isoformat(),
+                "open_interest": 0 if rnd.random() < 0.05 else rnd.randint(1, 20_000),
+            }
+            if rnd.random() >= 0.10:
+                mid = intrinsic + time_value
+                bid = round(max(0.0, mid * rnd.uniform(0.95, 0.99)), 2)
+                contract["last_quote"] = {"bid": bid, "ask": round(mid * rnd.uniform(1.01, 1.05), 2)}
+            contracts.append(contract)
+        expiration += timedelta(days=7)
+    return contracts
+
+
+def to_snapshot_result(contract: Dict[str, Any], stock_price: float) -> Dict[str, Any]:
+    """Reshape a contracts-endpoint record into an /v3/snapshot/options result."""
+    return {
+        "details": {
+            "ticker": contract["ticker"],
+            "strike_price": contract["strike_price"],
+            "expiration_date": contract["expiration_date"],
+            "contract_type": "call",
+            "shares_per_contract": 100,
+        },
+        "open_interest": contract.get("open_interest"),
+        "last_quote": contract.get("last_quote") or {},
+        "greeks": {},
+        "underlying_asset": {"ticker": contract.get("underlying_ticker"), "price": stock_price},
+    }
+
+
+def load_recorded(ticker: str, directory: Path = RECORDED_DIR) -> Optional[Dict[str, Any]]:
+    """Return {"price": float, "contracts": [...]} for a recorded ticker, or None if not recorded."""
+    path = directory / f"{ticker.upper()}.json.gz"
+    if not path.exists():
+        return None
+    with gzip.open(path, "rt", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def fetch_raw_chain(client: Any, ticker: str, api_key: str) -> List[Dict[str, Any]]:
+    """Every call contract of a ticker as raw /v3/reference/options/contracts results, following next_url
+    up to the client's MAX_CHAIN_CONTRACTS. Raises requests exceptions on HTTP / network errors.
+    """
+    url, params = client.chain_request(ticker, client.CHAIN_SOURCE_CONTRACTS)
+    params = {**params, "apiKey": api_key}
+    contracts: List[Dict[str, Any]] = []
+    while url and len(contracts) < client.MAX_CHAIN_CONTRACTS:
+        resp = client.polygon_get(url, params=params, timeout=20)
+        resp.raise_for_status()
+        data = resp.json()
+        contracts.extend(data.get("results") or [])
+        # next_url already carries the cursor and filters, only the key must be re-sent
+        url, params = data.get("next_url"), {"apiKey": api_key}
+    if url:
+        print(f"{ticker}: chain truncated at {len(contracts)} contracts", file=sys.stderr)
+    return contracts
+
+
+def record_fixtures(tickers: List[str], api_key: str, directory: Path = RECORDED_DIR) -> None:
+    """Capture live price + full chain payloads for tickers (uses the app's own fetchers)."""
+    sys.path.insert(0, str(APP_DIR))
+    from itm_cc import client  # noqa: E402
+
+    directory.mkdir(parents=True, exist_ok=True)
+    for tk in tickers:
+        price, err = client.fetch_previous_close_price(tk, api_key)
+        contracts = fetch_raw_chain(client, tk, api_key)
+        if price is None or not contracts:
+            print(f"{tk}: skipped ({err or 'no contracts'})", file=sys.stderr)
+            continue
+        with gzip.open(directory / f"{tk.upper()}.json.gz", "wt", encoding="utf-8") as fh:
+            json.dump({"price": price, "contracts": contracts, "recorded": date.today().isoformat()}, fh)
+        print(f"{tk}: recorded {len(contracts)} contracts", file=sys.stderr)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark fixture utilities.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record", help="Record live Polygon payloads as fixtures.")
+    rec.add_argument("--tickers", required=True, help="Comma separated tickers.")
+    rec.add_argument("--api-key", required=True)
+    rec.add_argument("--out", default=str(RECORDED_DIR))
+    args = parser.parse_args(argv)
+    record_fixtures([t.strip() for t in args.tickers.split(",") if t.strip()], args.api_key, Path(args.out))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
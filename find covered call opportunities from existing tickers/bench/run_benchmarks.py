@@ -0,0 +1,430 @@
+"""Screener benchmark suite.
+
+Runs every benchmark against the local Polygon stub (never the real API) and writes a
+results file that can be compared between versions:
+
+    python bench/run_benchmarks.py --output bench/results/my-branch.json
+    python bench/run_benchmarks.py --compare bench/results/main.json --fail-on-regression
+
+Benchmarks:
+- process_ticker CPU time on warm caches for chains of 50 - 20,000 contracts
+- re-screening a warm 200-ticker watchlist with changing DTE windows (chain store hits)
+- chain_to_columns (full records and projected columns) / compute_opportunities (the metric kernel) / option_analytics
+  (implied volatility, delta, assignment probability for every ITM contract) and extract_bid
+- display_frame (rank + page + Arrow conversion) / sort_dataframe / streaming TopKRanker (all three metrics) / scenario
+  sweep summaries (1 vs 100 scenarios) / live repricing of 100 quote updates on 1k - 100k result rows
+- backtest (streamed snapshot history replay, alone and with outcomes for 1 vs 100 rule sets) over 1 - 3 years of
+  daily snapshots
+- end-to-end watchlist wall time (screen_tickers) at several ticker counts with stub latency
+
+Before timing anything it checks that screens and sweeps come back with solved analytics (implied volatility
+reprices the bid, delta / assignment probability in range); a failed check fails the run.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from fixtures import APP_DIR, CHAIN_SIZES, synthetic_chain, synthetic_price
+from stub_server import StubConfig, StubServer
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+TICKER_COUNTS = [10, 50, 150]
+RESULT_ROWS = [1_000, 10_000, 100_000]
+RESCREEN_TICKERS = 200
+TOP_K = 500
+LIVE_UPDATES = 100  # contract bids per live redraw (plus one underlying trade)
+BACKTEST_HISTORIES = [(100, 252), (300, 756)]  # (tickers, trading days) of synthetic daily snapshots
+BACKTEST_CONTRACTS = 120  # quoted ITM candidates per snapshot
+SWEEP_GRIDS = [  # one scenario, then ~100: the sweep should cost a few passes over the rows, not one per scenario
+    ("25-45", "0-1", "100"),
+    ("7-21, 21-45, 45-90, 90-180", "0.95-1, 0.9-0.95, 0.85-0.9, 0.8-0.85, 0-0.8", "0, 100, 500, 1000, 5000"),
+]
+
+
+def measure(fn: Callable[[], Any], repeats: int, warmup: int = 1) -> Dict[str, float]:
+    """Time fn() `repeats` times after `warmup` untimed calls; returns wall and CPU statistics in seconds."""
+    for _ in range(warmup):
+        fn()
+    walls: List[float] = []
+    cpus: List[float] = []
+    for _ in range(repeats):
+        cpu0, wall0 = time.process_time(), time.perf_counter()
+        fn()
+        walls.append(time.perf_counter() - wall0)
+        cpus.append(time.process_time() - cpu0)
+    return {
+        "wall_min_s": min(walls),
+        "wall_median_s": statistics.median(walls),
+        "wall_mean_s": statistics.fmean(walls),
+        "cpu_median_s": statistics.median(cpus),
+        "repeats": repeats,
+    }
+
+
+def display_frame(df: Any) -> Any:
+    """What a results rerun costs server-side: rank, take the first page and convert it to Arrow for st.dataframe."""
+    from itm_cc import engine
+    import pyarrow as pa
+
+    page = engine.results_page(engine.build_results_frame(df, "Annualized ROI %"), 1)
+    return pa.Table.from_pandas(page)
+
+
+def result_key(entry: Dict[str, Any]) -> str:
+    return entry["name"] + json.dumps(entry["params"], sort_keys=True)
+
+
+class Suite:
+    def __init__(self, stub: StubServer, quick: bool):
+        self.stub = stub
+        self.quick = quick
+        self.results: List[Dict[str, Any]] = []
+
+    def record(self, name: str, params: Dict[str, Any], stats: Dict[str, float], **extra: Any) -> None:
+        entry = {"name": name, "params": params, **stats, **extra}
+        self.results.append(entry)
+        print(f"  {name:<28} {json.dumps(params):<40} median {stats['wall_median_s'] * 1e3:10.2f} ms", file=sys.stderr)
+
+    def reset_caches(self) -> None:
+        from itm_cc import client
+
+        st.cache_data.clear()
+        cache = client.get_disk_cache()
+        if cache is not None:
+            cache.clear()
+
+    def check_analytics(self, tmp: Path) -> List[str]:
+        """Screen and sweep a stub ticker; returns what is wrong with their analytics columns (empty when fine)."""
+        from itm_cc import cli, engine
+        problems: List[str] = []
+        rows, errors = engine.screen_tickers(["N500"], "bench-key", 1, 180, 0, date.today())
+        df = engine.results_to_frame(rows)
+        if errors or df.empty:
+            return [f"screen returned no rows ({errors})"]
+        for col in engine.ANALYTICS_COLUMNS:
+            if df[col].isna().all():
+                problems.append(f"screen: {col} is empty")
+        solved = df[df["IV %"].notna()]
+        repriced = engine.bs_call_price(
+            solved["Stock Price"].to_numpy(), solved["Strike"].to_numpy(), solved["DTE"].to_numpy() / 365.0,
+            engine.RISK_FREE_RATE, solved["IV %"].to_numpy() / 100.0,
+        )
+        if not np.allclose(repriced, solved["Premium"].to_numpy(), atol=1e-4):
+            problems.append("screen: IV % does not reprice the premium")
+        delta, prob = solved["Delta"].to_numpy(), solved["Prob. Assignment %"].to_numpy()
+        if not (np.all((delta >= 0) & (delta <= 1)) and np.all(prob <= delta * 100 + 1e-9)):
+            problems.append("screen: Delta outside [0, 1] or Prob. Assignment % above it")
+        output = tmp / "check_sweep.csv"
+        if cli.cli_main(["sweep", "--tickers", "N500", "--api-key", "bench-key", "--output", str(output)]) != 0:
+            return problems + ["sweep: command failed"]
+        summary = pd.read_csv(output)
+        if summary.loc[summary["Contracts"] > 0, "Median Prob. Assignment %"].isna().any():
+            problems.append("sweep: Median Prob. Assignment % is empty")
+        return problems
+
+    def sizes(self) -> List[int]:
+        return CHAIN_SIZES[:3] if self.quick else CHAIN_SIZES
+
+    def bench_process_ticker(self) -> None:
+        from itm_cc import engine
+        today = date.today()
+        for size in self.sizes():
+            tk = f"N{size}"
+            price_table = {tk: synthetic_price(tk)}
+
+            def run() -> None:
+                engine.process_ticker(tk, "bench-key", 1, 720, 0, today, price_table=price_table)
+
+            self.record("process_ticker_warm", {"contracts": size}, measure(run, 3 if size >= 20_000 else 10))
+
+    def bench_rescreen(self) -> None:
+        """Re-screen a warm watchlist with changing slider values (chain store hits, no fetching)."""
+        from itm_cc import client, engine
+        today = date.today()
+        tickers = [f"S{i:04d}" for i in range(RESCREEN_TICKERS)]
+        price_table = {tk: synthetic_price(tk) for tk in tickers}
+        source = client.detect_chain_source("bench-key")  # resolved once per screen, as in iter_screen_tickers
+        for tk in tickers:
+            engine.process_ticker(tk, "bench-key", 1, 180, 0, today, chain_source=source, price_table=price_table)
+        windows = [(25, 45), (1, 180), (7, 30), (60, 120)]
+        state = {"i": 0}
+
+        def run() -> None:
+            dte_min, dte_max = windows[state["i"] % len(windows)]
+            state["i"] += 1
+            for tk in tickers:
+                engine.process_ticker(
+                    tk, "bench-key", dte_min, dte_max, 100, today, chain_source=source, price_table=price_table
+                )
+
+        self.record("rescreen_warm", {"tickers": RESCREEN_TICKERS}, measure(run, 8))
+
+    def bench_kernel(self) -> None:
+        from itm_cc import client, engine
+        today = date.today()
+        for size in self.sizes():
+            contracts = synthetic_chain(f"K{size}", size)
+            price = synthetic_price(f"K{size}")
+            repeats = 3 if size >= 20_000 else 10
+            self.record(
+                "chain_to_columns", {"contracts": size}, measure(lambda: engine.chain_to_columns(contracts), repeats)
+            )
+            projected = client.new_chain_columns()
+            for contract in contracts:
+                client.project_contract(contract, projected)
+            self.record(
+                "projected_to_columns", {"contracts": size},
+                measure(lambda: engine.chain_to_columns(projected), repeats),
+            )
+            columns = engine.chain_to_columns(contracts)
+            self.record(
+                "compute_opportunities", {"contracts": size},
+                measure(lambda: engine.compute_opportunities("K", price, columns, today, 1, 720, 0), repeats),
+            )
+            itm = pd.DataFrame(engine.compute_opportunities("K", price, columns, today, 1, 720, 0))
+            if not itm.empty:
+                self.record(
+                    "option_analytics", {"contracts": size, "itm_rows": len(itm)},
+                    measure(lambda: engine.option_analytics(
+                        price, itm["Strike"].to_numpy(), itm["DTE"].to_numpy(), itm["Premium"].to_numpy()
+                    ), repeats),
+                )
+            self.record(
+                "extract_bid", {"contracts": size},
+                measure(lambda: [client.extract_bid(c) for c in contracts], repeats),
+            )
+
+    def _result_frame(self, rows: int) -> Any:
+        from itm_cc import engine
+        today = date.today()
+        opps: List[Dict[str, Any]] = []
+        i = 0
+        while len(opps) < rows:
+            tk = f"R{i}"
+            columns = engine.chain_to_columns(synthetic_chain(tk, 5_000))
+            opps.extend(engine.compute_opportunities(tk, synthetic_price(tk), columns, today, 1, 720, 0))
+            i += 1
+        return pd.DataFrame(opps[:rows])[engine.RESULT_COLUMNS]
+
+    def bench_dataframes(self) -> None:
+        from itm_cc import engine, live
+        for rows in (RESULT_ROWS[:2] if self.quick else RESULT_ROWS):
+            df = self._result_frame(rows)
+            repeats = 3 if rows >= 100_000 else 10
+            self.record("display_frame", {"rows": rows}, measure(lambda: display_frame(df), repeats))
+            self.record(
+                "sort_dataframe", {"rows": rows},
+                measure(lambda: engine.sort_dataframe(df, "Annualized ROI %"), repeats),
+            )
+            records = df.to_dict("records")
+            batches = [records[i:i + 500] for i in range(0, len(records), 500)]  # ~one ticker's rows each
+
+            def rank() -> None:
+                ranker = engine.TopKRanker(TOP_K)
+                for batch in batches:
+                    ranker.add(batch)
+                ranker.top("Annualized ROI %")
+
+            self.record("top_k_ranker", {"rows": rows, "k": TOP_K}, measure(rank, repeats))
+            for windows, bands, floors in SWEEP_GRIDS:
+                grid = engine.scenario_grid(
+                    engine.parse_dte_windows(windows), engine.parse_ranges(bands), engine.parse_values(floors)
+                )
+                self.record(
+                    "scenario_sweep", {"rows": rows, "scenarios": len(grid)},
+                    measure(lambda: engine.sweep_summary(df, grid), repeats),
+                )
+            sample = df.sample(LIVE_UPDATES, random_state=0)
+            bids = dict(zip(sample["Contract"], sample["Premium"] * 1.01))
+            prices = {sample["Ticker"].iloc[0]: float(sample["Stock Price"].iloc[0]) * 1.001}
+            self.record(
+                "live_quotes", {"rows": rows, "updates": LIVE_UPDATES},
+                measure(lambda: live.apply_live_quotes(df, prices, bids), repeats),
+            )
+
+    def _history(self, root: Path, tickers: int, days: int) -> Any:
+        """Synthetic snapshot history: one snapshot per ticker and trading day, compacted to one part per date."""
+        from itm_cc import client, history
+        store = history.HistoryStore(root, interval=0)
+        rng = np.random.default_rng(0)
+        prices = np.array([synthetic_price(f"H{i:04d}") for i in range(tickers)])
+        day = date(2020, 1, 2)
+        written = 0
+        while written < days:
+            if client.is_trading_day(day):
+                captured_at = datetime.combine(day, dt_time(15), tzinfo=client.MARKET_TZ).timestamp()
+                prices *= np.exp(rng.normal(0, 0.015, tickers))
+                fridays = day.toordinal() + (4 - day.weekday()) % 7 + 7 * np.arange(26)
+                for i in range(tickers):
+                    n = BACKTEST_CONTRACTS
+                    strike = np.round(prices[i] * rng.uniform(0.7, 1.0, n), 1)
+                    exp_ordinal = rng.choice(fridays, n)
+                    time_value = prices[i] * 0.3 * np.sqrt((exp_ordinal - day.toordinal() + 1) / 365.0) * 0.4
+                    columns = {
+                        "strike": strike, "exp_ordinal": exp_ordinal, "open_interest": rng.integers(0, 5000, n),
+                        "bid": np.round(prices[i] - strike + time_value, 2), "valid": np.ones(n, dtype=bool),
+                    }
+                    store.record(f"H{i:04d}", float(prices[i]), columns, np.arange(n), captured_at=captured_at)
+                store.flush()
+                written += 1
+            day += timedelta(days=1)
+        return store
+
+    def bench_backtest(self, root: Path) -> None:
+        from itm_cc import backtest, engine
+        for tickers, days in (BACKTEST_HISTORIES[:1] if self.quick else BACKTEST_HISTORIES):
+            store = self._history(root / f"history-{tickers}-{days}", tickers, days)
+            params = {"tickers": tickers, "days": days, "contracts": tickers * days * BACKTEST_CONTRACTS}
+            # Streamed part by part like `python -m itm_cc backtest`; the full frame of the larger history would not fit here
+            trades = sum(len(chunk["DTE"]) for chunk in backtest.iter_backtest_trades(store))
+            self.record(
+                "backtest_trades", params,
+                measure(lambda: sum(len(chunk["DTE"]) for chunk in backtest.iter_backtest_trades(store)), 3),
+            )
+            for windows, bands, floors in SWEEP_GRIDS:
+                grid = engine.scenario_grid(
+                    engine.parse_dte_windows(windows), engine.parse_ranges(bands), engine.parse_values(floors)
+                )
+                self.record(
+                    "backtest_replay_summary", {**params, "trades": trades, "scenarios": len(grid)},
+                    measure(lambda: backtest.backtest_summary(backtest.iter_backtest_trades(store), grid), 3),
+                )
+
+    def bench_end_to_end(self, latency_ms: float, max_workers: int) -> None:
+        from itm_cc import engine
+        config = self.stub.state.config
+        config.latency_ms = latency_ms
+        try:
+            for count in (TICKER_COUNTS[:2] if self.quick else TICKER_COUNTS):
+                tickers = [f"W{i:04d}" for i in range(count)]
+                before = dict(self.stub.state.counters)
+
+                def run() -> None:
+                    self.reset_caches()
+                    engine.screen_tickers(tickers, "bench-key", 25, 45, 100, date.today(), max_workers=max_workers)
+
+                stats = measure(run, 3, warmup=0)
+                requests_made = self.stub.state.counters.get("requests", 0) - before.get("requests", 0)
+                self.record(
+                    "screen_watchlist_cold",
+                    {"tickers": count, "latency_ms": latency_ms, "max_workers": max_workers},
+                    stats,
+                    requests_per_run=requests_made / 3,
+                )
+        finally:
+            config.latency_ms = 0.0
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict[str, Any], baseline_path: Path, threshold: float) -> int:
+    """Print median wall-time ratios vs a baseline results file; returns the number of regressions."""
+    baseline = {result_key(r): r for r in json.loads(baseline_path.read_text(encoding="utf-8"))["results"]}
+    regressions = 0
+    print(f"\nComparison vs {baseline_path} (threshold {threshold:.0%}):")
+    for entry in current["results"]:
+        base = baseline.get(result_key(entry))
+        if base is None or not base["wall_median_s"]:
+            continue
+        ratio = entry["wall_median_s"] / base["wall_median_s"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+        print(f"  {entry['name']:<28} {json.dumps(entry['params']):<40} x{ratio:6.2f}{flag}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run screener benchmarks against a local Polygon stub.")
+    parser.add_argument("--output", default=None, help="Results JSON (default: bench/results/<timestamp>.json).")
+    parser.add_argument("--compare", default=None, help="Baseline results JSON to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown flagged as regression.")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--quick", action="store_true", help="Skip the largest sizes.")
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="Stub latency for end-to-end runs.")
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument(
+        "--only", default="",
+        help="Comma separated subset: checks,process_ticker,rescreen,kernel,dataframes,backtest,e2e",
+    )
+    args = parser.parse_args(argv)
+
+    sizes = {f"N{n}": n for n in CHAIN_SIZES}
+    with StubServer(StubConfig(sizes=sizes)) as stub, tempfile.TemporaryDirectory() as tmp:
+        # The client reads its base URL at import time, so the stub must be up first
+        os.environ["POLYGON_BASE_URL"] = stub.base_url
+        os.environ["POLYGON_RATE_LIMIT_RPM"] = "0"
+        sys.path.insert(0, str(APP_DIR))
+        from itm_cc import client, history
+
+        client.DISK_CACHE_PATH = Path(tmp) / "bench_cache.sqlite"
+        history.HISTORY_PATH = Path(tmp) / "history"
+        suite = Suite(stub, args.quick)
+        selected = {s.strip() for s in args.only.split(",") if s.strip()}
+        print(f"Benchmarking against stub at {stub.base_url}", file=sys.stderr)
+        if not selected or "checks" in selected:
+            problems = suite.check_analytics(Path(tmp))
+            for problem in problems:
+                print(f"CHECK FAILED: {problem}", file=sys.stderr)
+            if problems:
+                return 1
+        if not selected or "process_ticker" in selected:
+            suite.bench_process_ticker()
+        if not selected or "rescreen" in selected:
+            suite.bench_rescreen()
+        if not selected or "kernel" in selected:
+            suite.bench_kernel()
+        if not selected or "dataframes" in selected:
+            suite.bench_dataframes()
+        if not selected or "backtest" in selected:
+            suite.bench_backtest(Path(tmp))
+        if not selected or "e2e" in selected:
+            suite.bench_end_to_end(args.latency_ms, args.max_workers)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick,
+        },
+        "results": suite.results,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"\nWrote {len(suite.results)} results to {output}", file=sys.stderr)
+
+    if args.compare:
+        regressions = compare(report, Path(args.compare), args.threshold)
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+"""Local stand-in for the Polygon REST endpoints the screener uses.
+
+Serves synthetic (or recorded) prices and option chains with configurable latency,
+server error rate and 429 rate, so benchmarks never touch the real API:
+
+    python bench/stub_server.py --port 8765 --latency-ms 40 --rate-429 0.02
+    POLYGON_BASE_URL=http://127.0.0.1:8765 streamlit run app.py
+
+Pagination, the expiration / strike range filters and the multi-ticker snapshot are implemented
+closely enough for the app's code paths; anything else returns 404.
+"""
+import argparse
+import gzip
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from fixtures import RECORDED_DIR, load_recorded, synthetic_chain, synthetic_price, to_snapshot_result
+
+
+class StubConfig:
+    def __init__(
+        self,
+        contracts_per_ticker: int = 500,
+        latency_ms: float = 0.0,
+        latency_jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        rate_429: float = 0.0,
+        retry_after: str = "0",
+        seed: int = 0,
+        recorded_dir: Optional[Path] = None,
+        forbidden: Tuple[str, ...] = (),
+        sizes: Optional[Dict[str, int]] = None,
+    ):
+        self.contracts_per_ticker = contracts_per_ticker
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.seed = seed
+        self.recorded_dir = recorded_dir
+        self.forbidden = forbidden  # path prefixes answered with 403, e.g. ("/v2/last/trade",)
+        self.sizes = {k.upper(): v for k, v in (sizes or {}).items()}  # per-ticker chain size overrides
+
+
+class StubState:
+    """Shared between handler threads: config, generated chains and request counters."""
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.rng = random.Random(config.seed)
+        self.chains: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+        self.counters: Dict[str, int] = {}
+
+    def count(self, key: str) -> None:
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def roll(self) -> float:
+        with self.lock:
+            return self.rng.random()
+
+    def ticker_data(self, ticker: str) -> Tuple[float, List[Dict[str, Any]]]:
+        ticker = ticker.upper()
+        with self.lock:
+            cached = self.chains.get(ticker)
+        if cached is not None:
+            return cached
+        recorded = load_recorded(ticker, self.config.recorded_dir) if self.config.recorded_dir else None
+        if recorded:
+            data = (float(recorded["price"]), recorded["contracts"])
+        else:
+            data = (
+                synthetic_price(ticker),
+                synthetic_chain(
+                    ticker, self.config.sizes.get(ticker, self.config.contracts_per_ticker), self.config.seed
+                ),
+            )
+        with self.lock:
+            self.chains[ticker] = data
+        return data
+
+
+def _filter_chain(contracts: List[Dict[str, Any]], query: Dict[str, str]) -> List[Dict[str, Any]]:
+    exp_gte = query.get("expiration_date.gte")
+    exp_lte = query.get("expiration_date.lte")
+    strike_lt = float(query["strike_price.lt"]) if "strike_price.lt" in query else None
+    strike_gte = float(query["strike_price.gte"]) if "strike_price.gte" in query else None
+    strike_lte = float(query["strike_price.lte"]) if "strike_price.lte" in query else None
+    out = []
+    for c in contracts:
+        exp = c.get("expiration_date") or ""
+        if exp_gte and exp < exp_gte:
+            continue
+        if exp_lte and exp > exp_lte:
+            continue
+        strike = c.get("strike_price") or 0
+        if strike_lt is not None and not strike < strike_lt:
+            continue
+        if strike_gte is not None and not strike >= strike_gte:
+            continue
+        if strike_lte is not None and not strike <= strike_lte:
+            continue
+        out.append(c)
+    return out
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "PolygonStub/1.0"
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002 - silence default logging
+        pass
+
+    @property
+    def state(self) -> StubState:
+        return self.server.state  # type: ignore[attr-defined]
+
+    def _send(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload, separators=(",", ":")).encode()
+        gzip_ok = "gzip" in (self.headers.get("Accept-Encoding") or "")
+        if gzip_ok:
+            body = gzip.compress(body, 5)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if gzip_ok:
+            self.send_header("Content-Encoding", "gzip")
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:  # noqa: N802 - http.server API
+        cfg = self.state.config
+        parsed = urlparse(self.path)
+        path = parsed.path
+        query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        self.state.count("requests")
+
+        if cfg.latency_ms or cfg.latency_jitter_ms:
+            time.sleep(max(0.0, cfg.latency_ms + random.uniform(-1, 1) * cfg.latency_jitter_ms) / 1000.0)
+        if not query.get("apiKey"):
+            self.state.count("401")
+            return self._send(401, {"status": "ERROR", "error": "Unknown API Key"})
+        if any(path.startswith(prefix) for prefix in cfg.forbidden):
+            self.state.count("403")
+            return self._send(403, {"status": "NOT_AUTHORIZED", "error": "You are not entitled to this data."})
+        roll = self.state.roll()
+        if roll < cfg.rate_429:
+            self.state.count("429")
+            return self._send(429, {"status": "ERROR", "error": "Too many requests"}, {"Retry-After": cfg.retry_after})
+        if roll < cfg.rate_429 + cfg.error_rate:
+            self.state.count("500")
+            return self._send(500, {"status": "ERROR", "error": "Internal error"})
+
+        try:
+            status, payload = self._route(path, query)
+        except Exception as e:  # surface stub bugs as 500s instead of dropped connections
+            status, payload = 500, {"status": "ERROR", "error": str(e)}
+        self.state.count(str(status))
+        self._send(status, payload)
+
+    def _route(self, path: str, query: Dict[str, str]) -> Tuple[int, Dict[str, Any]]:
+        m = re.fullmatch(r"/v2/last/trade/([^/]+)", path)
+        if m:
+            price, _ = self.state.ticker_data(m.group(1))
+            return 200, {"status": "OK", "results": {"p": price}, "last": {"price": price}}
+
+        m = re.fullmatch(r"/v2/aggs/ticker/([^/]+)/prev", path)
+        if m:
+            price, _ = self.state.ticker_data(m.group(1))
+            return 200, {"status": "OK", "results": [{"T": m.group(1).upper(), "c": price}]}
+
+        m = re.fullmatch(r"/v2/aggs/grouped/locale/us/market/stocks/([0-9-]+)", path)
+        if m:
+            with self.state.lock:
+                known = list(self.state.chains)
+            return 200, {"status": "OK", "results": [{"T": tk, "c": self.state.ticker_data(tk)[0]} for tk in known]}
+
+        if path == "/v2/snapshot/locale/us/markets/stocks/tickers":
+            tickers = [t for t in (query.get("tickers") or "").split(",") if t]
+            return 200, {"status": "OK", "tickers": [
+                {"ticker": tk.upper(), "lastTrade": {"p": self.state.ticker_data(tk)[0]}} for tk in tickers
+            ]}
+
+        m = re.fullmatch(r"/v2/snapshot/locale/us/markets/stocks/tickers/([^/]+)", path)
+        if m:
+            price, _ = self.state.ticker_data(m.group(1))
+            return 200, {"status": "OK", "ticker": {"ticker": m.group(1).upper(), "lastTrade": {"p": price}}}
+
+        if path == "/v3/reference/options/contracts":
+            ticker = query.get("underlying_ticker") or "AAPL"
+            _, contracts = self.state.ticker_data(ticker)
+            return 200, self._page(path, query, _filter_chain(contracts, query), 1000)
+
+        m = re.fullmatch(r"/v3/snapshot/options/([^/]+)", path)
+        if m:
+            price, contracts = self.state.ticker_data(m.group(1))
+            page = self._page(path, query, _filter_chain(contracts, query), 250)
+            page["results"] = [to_snapshot_result(c, price) for c in page["results"]]
+            return 200, page
+
+        return 404, {"status": "NOT_FOUND", "error": f"Stub does not serve {path}"}
+
+    def _page(self, path: str, query: Dict[str, str], rows: List[Dict[str, Any]], max_limit: int) -> Dict[str, Any]:
+        limit = min(max_limit, int(query.get("limit") or 10))
+        offset = int(query.get("cursor") or 0)
+        payload: Dict[str, Any] = {"status": "OK", "results": rows[offset:offset + limit]}
+        if offset + limit < len(rows):
+            nxt = {k: v for k, v in query.items() if k != "apiKey"}
+            nxt["cursor"] = str(offset + limit)
+            host = self.headers.get("Host") or "%s:%d" % self.server.server_address[:2]
+            payload["next_url"] = f"http://{host}{path}?{urlencode(nxt)}"
+        return payload
+
+
+class StubServer:
+    """Run the stub on a background thread: `with StubServer(StubConfig(...)) as stub: stub.base_url`."""
+
+    def __init__(self, config: Optional[StubConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.state = StubState(config or StubConfig())
+        self.httpd = ThreadingHTTPServer((host, port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = self.state  # type: ignore[attr-defined]
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="polygon-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Local Polygon API stub for benchmarks and offline testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--contracts", type=int, default=500, help="Synthetic contracts per ticker.")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--latency-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500.")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of requests answered with 429.")
+    parser.add_argument("--retry-after", default="0", help="Retry-After header value sent with 429s.")
+    parser.add_argument("--forbid", default="", help="Comma separated path prefixes answered with 403.")
+    parser.add_argument("--recorded-dir", default=None, help=f"Serve recorded fixtures (e.g. {RECORDED_DIR}).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    config = StubConfig(
+        contracts_per_ticker=args.contracts,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after,
+        seed=args.seed,
+        recorded_dir=Path(args.recorded_dir) if args.recorded_dir else None,
+        forbidden=tuple(p.strip() for p in args.forbid.split(",") if p.strip()),
+    )
+    server = StubServer(config, args.host, args.port)
+    print(f"Polygon stub listening on {server.base_url} (Ctrl+C to stop)", file=sys.stderr)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
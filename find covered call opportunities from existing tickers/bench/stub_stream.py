@@ -0,0 +1,202 @@
+"""Local stand-in for the Polygon WebSocket clusters live mode uses (/stocks trades, /options quotes).
+
+Speaks the connect / auth / subscribe / unsubscribe protocol and streams random-walk updates for the
+subscribed symbols, batched into JSON arrays like the real feed:
+
+    python bench/stub_stream.py --port 8766 --rate 200
+    POLYGON_WS_BASE_URL=ws://127.0.0.1:8766 streamlit run app.py
+
+Stock trades start at the synthetic price the REST stub serves; option bids start near the synthetic
+chain's value for the strike / expiration encoded in the contract symbol.
+"""
+import argparse
+import json
+import logging
+import math
+import random
+import re
+import sys
+import threading
+import time
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from websockets.exceptions import ConnectionClosed
+from websockets.sync.server import ServerConnection, serve
+
+from fixtures import synthetic_price
+
+OPTION_SYMBOL = re.compile(r"O:([A-Z.]+)(\d{6})([CP])(\d{8})")
+CHANNELS = {"stocks": "T", "options": "Q"}
+
+
+class StreamConfig:
+    def __init__(
+        self,
+        rate: float = 100.0,
+        batch_seconds: float = 0.1,
+        seed: int = 0,
+        rejected_keys: Tuple[str, ...] = (),
+    ):
+        self.rate = rate  # events per second per connection (spread over the subscribed symbols)
+        self.batch_seconds = batch_seconds
+        self.seed = seed
+        self.rejected_keys = rejected_keys  # API keys answered with auth_failed
+
+
+class StreamState:
+    """Shared between connections: config, current values per symbol and counters."""
+
+    def __init__(self, config: StreamConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.rng = random.Random(config.seed)
+        self.values: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+
+    def count(self, key: str, n: int = 1) -> None:
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def initial_value(self, symbol: str) -> float:
+        match = OPTION_SYMBOL.fullmatch(symbol)
+        if not match:
+            return synthetic_price(symbol)
+        underlying, expiry, _, strike = match.groups()
+        price = synthetic_price(underlying)
+        strike_price = int(strike) / 1000.0
+        dte = max(1, (datetime.strptime(expiry, "%y%m%d").date() - date.today()).days)
+        time_value = price * 0.25 * math.sqrt(dte / 365.0) * math.exp(-abs(price - strike_price) / price * 3)
+        return round(max(0.05, max(0.0, price - strike_price) + time_value) * 0.97, 2)
+
+    def step(self, symbol: str) -> float:
+        """Next value of symbol's random walk (0.1% steps for stocks, 2% for option bids)."""
+        with self.lock:
+            value = self.values.get(symbol)
+            if value is None:
+                value = self.initial_value(symbol)
+            scale = 0.02 if symbol.startswith("O:") else 0.001
+            value = round(max(0.01, value * (1 + self.rng.gauss(0, scale))), 2)
+            self.values[symbol] = value
+            return value
+
+
+def _event(channel: str, symbol: str, value: float) -> Dict[str, Any]:
+    t = int(time.time() * 1000)
+    if channel == "T":
+        return {"ev": "T", "sym": symbol, "x": 4, "p": value, "s": 100, "c": [], "t": t}
+    return {"ev": "Q", "sym": symbol, "bx": 1, "ax": 1, "bp": value, "ap": round(value * 1.03, 2), "bs": 10,
+            "as": 10, "t": t}
+
+
+def _handle(conn: ServerConnection, state: StreamState) -> None:
+    cfg = state.config
+    cluster = (conn.request.path if conn.request else "/").strip("/")
+    channel = CHANNELS.get(cluster)
+    if channel is None:
+        conn.close(code=1008, reason=f"Stub does not serve /{cluster}")
+        return
+    state.count("connections")
+    conn.send(json.dumps([{"ev": "status", "status": "connected", "message": "Connected Successfully"}]))
+    subscribed: Set[str] = set()
+    authenticated = False
+    rnd = random.Random(f"{cfg.seed}:{id(conn)}")
+    next_batch = time.monotonic() + cfg.batch_seconds
+    try:
+        while True:
+            try:
+                raw = conn.recv(timeout=max(0.0, next_batch - time.monotonic()))
+            except TimeoutError:
+                raw = None
+            if raw is not None:
+                message = json.loads(raw)
+                action, params = message.get("action"), str(message.get("params") or "")
+                if action == "auth":
+                    authenticated = bool(params) and params not in cfg.rejected_keys
+                    status = "auth_success" if authenticated else "auth_failed"
+                    conn.send(json.dumps([{"ev": "status", "status": status, "message": status.replace("_", " ")}]))
+                    if not authenticated:
+                        state.count("auth_failed")
+                        conn.close()
+                        return
+                elif not authenticated:
+                    conn.send(json.dumps([{"ev": "status", "status": "error", "message": "not authorized"}]))
+                elif action in ("subscribe", "unsubscribe"):
+                    symbols = {p.split(".", 1)[1] for p in params.split(",") if p.startswith(channel + ".")}
+                    if action == "subscribe":
+                        subscribed |= symbols
+                    else:
+                        subscribed -= symbols
+                    state.count(action, len(symbols))
+                    conn.send(json.dumps([{"ev": "status", "status": "success", "message": f"{action}d to: {params}"}]))
+                continue
+            next_batch = time.monotonic() + cfg.batch_seconds
+            if not subscribed:
+                continue
+            n = min(len(subscribed), max(1, round(cfg.rate * cfg.batch_seconds)))
+            events = [_event(channel, symbol, state.step(symbol)) for symbol in rnd.sample(sorted(subscribed), n)]
+            conn.send(json.dumps(events))
+            state.count("events", len(events))
+    except ConnectionClosed:
+        pass
+
+
+class StubStream:
+    """Run the stream stub on a background thread: `with StubStream(StreamConfig(...)) as stream: stream.base_url`."""
+
+    def __init__(self, config: Optional[StreamConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.state = StreamState(config or StreamConfig())
+        quiet = logging.getLogger("stub_stream")  # connection open / close lines would drown benchmark output
+        quiet.setLevel(logging.WARNING)
+        self.server = serve(lambda conn: _handle(conn, self.state), host, port, logger=quiet)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.socket.getsockname()[:2]
+        return f"ws://{host}:{port}"
+
+    def start(self) -> "StubStream":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+
+    def __enter__(self) -> "StubStream":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Local Polygon WebSocket stub for live mode testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--rate", type=float, default=100.0, help="Events per second per connection.")
+    parser.add_argument("--batch-seconds", type=float, default=0.1, help="Interval between event batches.")
+    parser.add_argument("--reject-keys", default="", help="Comma separated API keys answered with auth_failed.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    config = StreamConfig(
+        rate=args.rate,
+        batch_seconds=args.batch_seconds,
+        seed=args.seed,
+        rejected_keys=tuple(k.strip() for k in args.reject_keys.split(",") if k.strip()),
+    )
+    stream = StubStream(config, args.host, args.port)
+    print(f"Polygon stream stub listening on {stream.base_url} (Ctrl+C to stop)", file=sys.stderr)
+    try:
+        stream.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stream.server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,9 @@
+"""Headless pieces of the covered call screener; app.py is the Streamlit UI on top of them."""
+
+import streamlit.logger
+from streamlit import runtime as st_runtime
+
+if not st_runtime.exists():
+    # Headless (`python -m itm_cc <command>`, universe workers): bare-mode caching warns about the missing
+    # runtime for every cached helper as it is defined and called; keep stderr for progress output
+    streamlit.logger.set_log_level("error")
@@ -0,0 +1,329 @@
+"""Backtest over recorded snapshot history."""
+
+from datetime import datetime, date
+from typing import List, Dict, Any, Optional, Iterator
+import collections
+
+import pandas as pd
+import numpy as np
+import requests
+
+from .client import GROUPED_DAILY_URL, MARKET_CLOSE, MARKET_TZ, market_now, polygon_get
+from .engine import covered_call_metrics
+from .history import HISTORY_ROW_COLUMNS, HistoryStore, range_indices
+
+
+# -----------------------------
+# Backtest
+# -----------------------------
+
+HISTORY_SETTLE_GRACE_DAYS = 4  # no price recorded on an expiration date: settle at the first one this soon after
+BACKTEST_TRADE_COLUMNS = [
+    "Ticker", "Entry Date", "Stock Price", "Strike", "Expiration", "DTE", "Premium", "Open Interest",
+    "Return if Assigned %", "Annualized ROI %", "Settle Price", "Called Away", "Realized Return %",
+    "Realized Annualized ROI %",
+]
+BACKTEST_METRICS = [
+    "Trades", "Tickers", "Expired", "Called Away %", "Win Rate %", "Median Projected Annualized ROI %",
+    "Median Realized Annualized ROI %", "Mean Projected Annualized ROI %", "Mean Realized Annualized ROI %",
+]
+BACKTEST_COUNT_METRICS = ("Trades", "Tickers", "Expired")
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def _history_index(store: HistoryStore) -> tuple:
+    """Every stored snapshot as flat arrays (part, position in its part, ticker code, date ordinal, time, price,
+    contract rows), the parts as (path, date ordinal, first row of each snapshot) and the ticker vocabulary.
+    """
+    vocab: Dict[str, int] = {}
+    parts: List[tuple] = []
+    pieces: Dict[str, List[np.ndarray]] = collections.defaultdict(list)
+    for day, paths in store.partitions():
+        for path in paths:
+            table = store.read_part(path, ("snapshots",))["snapshots"]
+            counts = np.asarray(table["rows"])
+            pieces["part"].append(np.full(len(table), len(parts), dtype=np.int64))
+            pieces["local"].append(np.arange(len(table), dtype=np.int64))
+            pieces["ticker"].append(np.array(
+                [vocab.setdefault(tk, len(vocab)) for tk in table["ticker"].tolist()], dtype=np.int64
+            ))
+            pieces["day"].append(np.full(len(table), day.toordinal(), dtype=np.int64))
+            pieces["time"].append(np.asarray(table["time"]))
+            pieces["price"].append(np.asarray(table["price"]))
+            pieces["rows"].append(counts)
+            parts.append((path, day.toordinal(), np.cumsum(counts) - counts))
+    index = {k: np.concatenate(v) for k, v in pieces.items()} if parts else {
+        k: np.empty(0, dtype=np.int64) for k in ("part", "local", "ticker", "day", "time", "price", "rows")
+    }
+    return index, parts, list(vocab)
+
+
+def _last_per_key(keys: np.ndarray, times: np.ndarray) -> np.ndarray:
+    """Positions of the latest time for each distinct key, in key order."""
+    order = np.lexsort((times, keys))
+    if not len(order):
+        return order
+    return order[np.r_[keys[order][1:] != keys[order][:-1], True]]
+
+
+def iter_backtest_trades(
+    store: HistoryStore,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    tickers: Optional[List[str]] = None,
+    dte_min: int = 1,
+    dte_max: int = 180,
+    min_oi: int = 0,
+    min_premium: float = 0.0,
+    min_annualized_roi: float = 0.0,
+    today: Optional[date] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Replay the process_ticker filters over the stored snapshots of start..end and settle every candidate,
+    yielding the trades of one stored part at a time as columns (BACKTEST_TRADE_COLUMNS).
+
+    Each ticker enters once per market date, from its last snapshot of that date with contracts. A contract
+    settles at the underlying's last recorded price on its expiration date (else the first one recorded within
+    HISTORY_SETTLE_GRACE_DAYS after) and is called away when that is above the strike; contracts not expired
+    by today or without a settle price keep empty outcomes. Only the chosen snapshots' rows are read from the
+    memory-mapped parts, and the filters and outcomes are array operations over each part.
+    """
+    today = today or market_now().date()
+    index, parts, vocab = _history_index(store)
+    if not parts:
+        return
+    keys = (index["ticker"] << 32) | index["day"]
+
+    # Settle prices by ticker and calendar day: the last price recorded on that day, else on the first day with
+    # one within the grace period (a dense table, so each contract's lookup is a plain index)
+    priced = np.flatnonzero(index["price"] > 0)
+    last = priced[_last_per_key(keys[priced], index["time"][priced])]
+    first_day = int(index["day"].min()) - HISTORY_SETTLE_GRACE_DAYS
+    recorded = np.full((len(vocab), int(index["day"].max()) - first_day + 1), np.nan)
+    recorded[index["ticker"][last], index["day"][last] - first_day] = index["price"][last]
+    settle_table = recorded.copy()
+    for grace in range(1, HISTORY_SETTLE_GRACE_DAYS + 1):
+        gap = np.isnan(settle_table[:, :-grace])
+        settle_table[:, :-grace][gap] = recorded[:, grace:][gap]
+
+    # Entries: the last snapshot with contracts of each (ticker, date) in the period, grouped by part
+    eligible = (index["rows"] > 0) & (index["day"] >= (start or date.min).toordinal())
+    eligible &= index["day"] <= (end or date.max).toordinal()
+    if tickers:
+        eligible &= np.isin(np.array(vocab, dtype=str), [tk.upper() for tk in tickers])[index["ticker"]]
+    candidates = np.flatnonzero(eligible)
+    chosen = candidates[_last_per_key(keys[candidates], index["time"][candidates])]
+    chosen = chosen[np.argsort(index["part"][chosen], kind="stable")]
+    part_ids, first = np.unique(index["part"][chosen], return_index=True)
+
+    ticker_dtype = pd.CategoricalDtype(vocab)
+    for part_id, lo, hi in zip(part_ids.tolist(), first.tolist(), np.append(first[1:], len(chosen)).tolist()):
+        sel = chosen[lo:hi]
+        path, day_ordinal, starts = parts[part_id]
+        data = store.read_part(path, tuple(HISTORY_ROW_COLUMNS))
+        counts = index["rows"][sel]
+        rows = range_indices(starts[index["local"][sel]], counts)
+        of_row = np.repeat(np.arange(len(sel)), counts)
+        price = index["price"][sel][of_row]
+        strike, bid = data["strike"][rows], data["bid"][rows]
+        open_interest = data["open_interest"][rows].astype(np.int64)
+        exp_ordinal = data["exp_ordinal"][rows].astype(np.int64)
+        dte = exp_ordinal - day_ordinal
+        metrics = covered_call_metrics(price, strike, bid, dte)
+        # Same masks as compute_opportunities (negated comparisons keep its NaN handling)
+        keep = np.flatnonzero(
+            (dte > 0) & (dte >= dte_min) & (dte <= dte_max) & ~(strike >= price) & ~(open_interest < min_oi)
+            & (bid > 0) & ~(bid < min_premium) & ~(metrics["Annualized ROI %"] < min_annualized_roi)
+        )
+        ticker = index["ticker"][sel][of_row][keep]
+        price, strike, bid, exp_ordinal, dte = price[keep], strike[keep], bid[keep], exp_ordinal[keep], dte[keep]
+
+        offset = exp_ordinal - first_day
+        known = (offset >= 0) & (offset < settle_table.shape[1]) & (exp_ordinal < today.toordinal())
+        settle = np.full(len(offset), np.nan)
+        settle[known] = settle_table[ticker[known], offset[known]]
+        resolved = ~np.isnan(settle)
+        realized = (np.minimum(settle, strike) + bid - price) / price * 100.0
+        yield {
+            "Ticker": pd.Categorical.from_codes(ticker, dtype=ticker_dtype),
+            "Entry Date": np.full(len(keep), day_ordinal - _EPOCH_ORDINAL).astype("datetime64[D]"),
+            "Stock Price": price,
+            "Strike": strike,
+            "Expiration": (exp_ordinal - _EPOCH_ORDINAL).astype("datetime64[D]"),
+            "DTE": dte,
+            "Premium": bid,
+            "Open Interest": open_interest[keep],
+            "Return if Assigned %": metrics["Return if Assigned %"][keep],
+            "Annualized ROI %": metrics["Annualized ROI %"][keep],
+            "Settle Price": settle,
+            "Called Away": pd.arrays.BooleanArray(settle > strike, ~resolved),
+            "Realized Return %": realized,
+            "Realized Annualized ROI %": realized * (365.0 / dte),
+        }
+
+
+def backtest_trades(store: HistoryStore, **filters: Any) -> pd.DataFrame:
+    """All trades of iter_backtest_trades (same filters) as one frame."""
+    chunks = list(iter_backtest_trades(store, **filters))
+    if not chunks:
+        return pd.DataFrame(columns=BACKTEST_TRADE_COLUMNS)
+    columns = {col: np.concatenate([chunk[col] for chunk in chunks]) for col in BACKTEST_TRADE_COLUMNS}
+    # Extension arrays don't survive np.concatenate: rebuild them from their parts
+    columns["Ticker"] = pd.Categorical.from_codes(
+        np.concatenate([chunk["Ticker"].codes for chunk in chunks]), dtype=chunks[0]["Ticker"].dtype
+    )
+    columns["Called Away"] = pd.concat([pd.Series(chunk["Called Away"]) for chunk in chunks]).array
+    return pd.DataFrame(columns)
+
+
+def _trade_chunks(trades: Any) -> Iterator[Any]:
+    """A backtest_trades frame as a single chunk, or the chunks of iter_backtest_trades as they come."""
+    return iter([trades]) if isinstance(trades, pd.DataFrame) else iter(trades)
+
+
+def _grid_segments(lower: np.ndarray, upper: np.ndarray) -> tuple:
+    """Cut one grid dimension at every bound: (sorted bounds, scenario x segment membership). A value v falls in
+    segment searchsorted(bounds, v, "right") and that segment lies within [lower, upper) of the member scenarios.
+    """
+    bounds = np.unique(np.concatenate([lower, upper]))
+    segments = np.arange(len(bounds) + 1)
+    first = np.searchsorted(bounds, lower, side="right")[:, None]
+    last = np.searchsorted(bounds, upper, side="right")[:, None]
+    return bounds, (segments >= first) & (segments < last)
+
+
+def _member_medians(cell: np.ndarray, values: np.ndarray, member: np.ndarray) -> np.ndarray:
+    """Exact median of values over the rows in each scenario's member cells (member: scenarios x cells).
+    Rows are grouped by cell and sorted within it once; both middle order statistics of every scenario are then
+    found together by bisecting over the sorted values, counting member rows at or below each probe per cell.
+    """
+    n = len(values)
+    if not n:
+        return np.full(len(member), np.nan)
+    per_cell = np.bincount(cell, minlength=member.shape[1])
+    used = np.flatnonzero(per_cell)
+    # Cell ids fit 16 bits for any sensible grid, where a stable argsort is a linear radix sort
+    by_cell = np.argsort(cell.astype(np.uint16) if member.shape[1] <= 1 << 16 else cell, kind="stable")
+    ends = np.cumsum(per_cell[used])
+    grouped = values[by_cell]
+    segments = [np.sort(grouped[lo:hi]) for lo, hi in zip((ends - per_cell[used]).tolist(), ends.tolist())]
+    ordered = np.sort(values)
+    weight = np.tile(member[:, used].astype(np.int64), (2, 1))
+    sizes = member[:, used].astype(np.int64) @ per_cell[used]
+    k = np.concatenate([(sizes - 1) // 2, sizes // 2])
+    lo, hi = np.zeros(len(k), dtype=np.int64), np.full(len(k), n - 1)
+    while (lo < hi).any():
+        active = lo < hi
+        mid = (lo + hi) // 2
+        probe = ordered[mid]
+        below = np.zeros(len(k), dtype=np.int64)
+        for j, segment in enumerate(segments):
+            below += weight[:, j] * np.searchsorted(segment, probe, side="right")
+        hit = below >= k + 1
+        hi = np.where(active & hit, mid, hi)
+        lo = np.where(active & ~hit, mid + 1, lo)
+    middle = ordered[lo]
+    return np.where(sizes > 0, 0.5 * (middle[:len(sizes)] + middle[len(sizes):]), np.nan)
+
+
+def backtest_summary(trades: Any, grid: pd.DataFrame) -> pd.DataFrame:
+    """Realized outcomes per rule set (a scenario of grid, see scenario_grid): trades, tickers, how many expired,
+    the share called away and the share that made money, and projected vs realized annualized ROI over the
+    expired trades. trades is a backtest_trades frame or the chunks of iter_backtest_trades, aggregated as they
+    stream. Rows are binned once into the cells the grid's bounds cut (DTE x moneyness x open interest), so the
+    cost is a pass over the trades plus work per cell, not per scenario and row as with sweep_summary's masks.
+    """
+    dims = [
+        _grid_segments(grid["dte_min"].to_numpy(float), np.nextafter(grid["dte_max"].to_numpy(float), np.inf)),
+        _grid_segments(grid["moneyness_min"].to_numpy(float), grid["moneyness_max"].to_numpy(float)),
+        _grid_segments(grid["Min OI"].to_numpy(float), np.full(len(grid), np.inf)),
+    ]
+    (_, dte_in), (_, band_in), (_, oi_in) = dims
+    member = (dte_in[:, :, None, None] & band_in[:, None, :, None] & oi_in[:, None, None, :]).reshape(len(grid), -1)
+    n_cells = member.shape[1]
+    sums = np.zeros((n_cells, 5))  # expired, called away, won, projected and realized ROI over the expired
+    counts = np.zeros(n_cells)
+    presence = None
+    expired_cells: List[np.ndarray] = []
+    projected: List[np.ndarray] = []
+    realized: List[np.ndarray] = []
+    for chunk in _trade_chunks(trades):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            moneyness = np.asarray(chunk["Strike"], float) / np.asarray(chunk["Stock Price"], float)
+        cell = np.zeros(len(moneyness), dtype=np.int64)
+        for (bounds, inside), values in zip(dims, (chunk["DTE"], moneyness, chunk["Open Interest"])):
+            cell = cell * inside.shape[1] + np.searchsorted(bounds, np.asarray(values, float), side="right")
+        expired = ~np.isnan(np.asarray(chunk["Settle Price"], float))
+        called = np.asarray(pd.array(chunk["Called Away"], dtype="boolean").to_numpy(bool, na_value=False))
+        won = expired & (np.asarray(chunk["Realized Return %"], float) >= 0)
+        chunk_projected = np.asarray(chunk["Annualized ROI %"], float)[expired]
+        chunk_realized = np.asarray(chunk["Realized Annualized ROI %"], float)[expired]
+        counts += np.bincount(cell, minlength=n_cells)
+        for j, (rows, weights) in enumerate((
+            (expired, None), (called, None), (won, None), (expired, chunk_projected), (expired, chunk_realized),
+        )):
+            sums[:, j] += np.bincount(cell[rows], weights=weights, minlength=n_cells)
+        codes = pd.Categorical(chunk["Ticker"])
+        if presence is None:
+            presence = np.zeros((n_cells, max(1, len(codes.categories))), dtype=bool)
+        presence[cell, codes.codes] = True
+        expired_cells.append(cell[expired])
+        projected.append(chunk_projected)
+        realized.append(chunk_realized)
+
+    weight = member.astype(float)
+    expired_count = weight @ sums[:, 0]
+    out = {
+        "Trades": weight @ counts,
+        "Tickers": (weight @ presence > 0).sum(axis=1) if presence is not None else np.zeros(len(grid)),
+        "Expired": expired_count,
+    }
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out["Called Away %"] = weight @ sums[:, 1] / expired_count * 100.0
+        out["Win Rate %"] = weight @ sums[:, 2] / expired_count * 100.0
+        out["Mean Projected Annualized ROI %"] = weight @ sums[:, 3] / expired_count
+        out["Mean Realized Annualized ROI %"] = weight @ sums[:, 4] / expired_count
+    cells = np.concatenate(expired_cells) if expired_cells else np.empty(0, dtype=np.int64)
+    medians = (("Median Projected Annualized ROI %", projected), ("Median Realized Annualized ROI %", realized))
+    for name, values in medians:
+        out[name] = _member_medians(cells, np.concatenate(values) if values else np.empty(0), member)
+    summary = grid[["Scenario", "DTE Window", "Moneyness", "Min OI"]].copy()
+    for name in BACKTEST_METRICS:
+        summary[name] = out[name].astype(int) if name in BACKTEST_COUNT_METRICS else out[name]
+    return summary
+
+
+def fetch_grouped_daily_closes(api_key: str, day: date) -> Dict[str, float]:
+    """Close of every US stock on one past session (grouped daily aggregates); {} when there are no bars."""
+    try:
+        resp = polygon_get(
+            f"{GROUPED_DAILY_URL}/{day.isoformat()}", params={"adjusted": "true", "apiKey": api_key}, timeout=30
+        )
+        if resp.status_code != 200:
+            return {}
+        results = resp.json().get("results") or []
+    except (requests.RequestException, ValueError):
+        return {}
+    return {r["T"].upper(): float(r["c"]) for r in results if r.get("T") and r.get("c")}
+
+
+def fill_settle_closes(store: HistoryStore, api_key: str, trades: Any, today: Optional[date] = None) -> int:
+    """Record official closes for the past expiration dates that left trades (a backtest_trades frame or
+    iter_backtest_trades chunks) unsettled: one grouped daily request per date, covering every ticker.
+    Returns the number of dates recorded.
+    """
+    today = today or market_now().date()
+    missing: Dict[date, set] = collections.defaultdict(set)
+    for chunk in _trade_chunks(trades):
+        expiration = np.asarray(chunk["Expiration"], dtype="datetime64[D]")
+        open_rows = np.isnan(np.asarray(chunk["Settle Price"], float)) & (expiration < np.datetime64(today))
+        tickers = np.asarray(chunk["Ticker"], dtype=object)[open_rows]
+        for day, tk in set(zip(expiration[open_rows].tolist(), tickers.tolist())):
+            missing[day].add(tk)
+    filled = 0
+    for day, tickers in sorted(missing.items()):
+        closes = fetch_grouped_daily_closes(api_key, day)
+        found = {tk: closes[tk] for tk in tickers if tk in closes}
+        if found:
+            store.record_prices(day, found, datetime.combine(day, MARKET_CLOSE, tzinfo=MARKET_TZ).timestamp())
+            filled += 1
+    return filled
@@ -0,0 +1,812 @@
+"""Headless CLI: `python -m itm_cc <command> ...` (also reachable as `python app.py <command> ...`)."""
+
+from datetime import datetime, date, timedelta
+from typing import List, Dict, Any, Optional, Iterator
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import threading
+import signal
+import time
+import argparse
+import csv
+import json
+import os
+import sys
+
+import pandas as pd
+import numpy as np
+
+from .client import (
+    CHAIN_SOURCE_CONTRACTS, CHAIN_SOURCE_SNAPSHOT, CONFIG_PATH, DEFAULT_RATE_LIMIT_RPM, MARKET_OPEN, SharedTokenBucket,
+    detect_chain_source, detect_env_api_key, ensure_plan_detected, get_polygon_client, in_market_session, market_now,
+    next_market_time, resolve_price_source, track_run,
+)
+from .engine import (
+    AUTH_ABORT_MESSAGE, DEFAULT_DTE_WINDOW, DEFAULT_MAX_WORKERS, RESULT_COLUMNS, RISK_FREE_RATE, SORT_METRICS,
+    SWEEP_DTE_WINDOWS, SWEEP_MIN_OI, SWEEP_MONEYNESS_BANDS, TopKRanker, add_analytics_records, best_per_ticker,
+    iter_screen_tickers, iter_with_analytics, parse_dte_windows, parse_ranges, parse_values, results_to_frame,
+    scenario_grid, sort_column, sweep_summary,
+)
+from .history import HISTORY_PATH, HISTORY_RETENTION_DAYS, HistoryStore
+from .backtest import BACKTEST_TRADE_COLUMNS, backtest_summary, fill_settle_closes, iter_backtest_trades
+from .prewarm import PREWARM_INTERVAL_SECONDS, PrewarmScheduler
+from .universe import WorkQueue, init_universe_worker, universe_worker
+
+
+# -----------------------------
+# Headless CLI
+# -----------------------------
+
+def read_tickers_file(path: str) -> List[str]:
+    """Read tickers from a text file: one or more per line (comma / whitespace separated), # starts a comment.
+    Duplicates are dropped, first occurrence wins.
+    """
+    seen = set()
+    tickers: List[str] = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            for tk in line.split("#", 1)[0].replace(",", " ").split():
+                tk = tk.strip().upper()
+                if tk and tk not in seen:
+                    seen.add(tk)
+                    tickers.append(tk)
+    return tickers
+
+
+def collect_cli_tickers(args: argparse.Namespace) -> List[str]:
+    """Tickers from --tickers-file followed by any extra --tickers, without duplicates."""
+    tickers: List[str] = read_tickers_file(args.tickers_file) if args.tickers_file else []
+    for tk in args.tickers.split(","):
+        tk = tk.strip().upper()
+        if tk and tk not in tickers:
+            tickers.append(tk)
+    return tickers
+
+
+def resolve_cli_api_key(explicit: Optional[str]) -> str:
+    """API key priority for headless runs: --api-key > POLYGON_API_KEY > saved config file."""
+    if explicit:
+        return explicit.strip()
+    env_key = detect_env_api_key()
+    if env_key:
+        return env_key.strip()
+    if CONFIG_PATH.exists():
+        try:
+            return (json.loads(CONFIG_PATH.read_text(encoding="utf-8")).get("api_key") or "").strip()
+        except (OSError, ValueError):
+            pass
+    return ""
+
+
+class ResultWriter:
+    """Streams opportunity rows to CSV, JSON Lines or Parquet (format taken from the file extension).
+    Parquet needs pyarrow; rows are buffered into row groups of PARQUET_ROW_GROUP rows.
+    """
+
+    PARQUET_ROW_GROUP = 50_000
+
+    def __init__(self, path: str, fmt: Optional[str] = None, columns: Optional[List[str]] = None):
+        self.path = path
+        self.format = (fmt or Path(path).suffix.lstrip(".") or "csv").lower()
+        if self.format not in ("csv", "jsonl", "parquet"):
+            raise ValueError(f"Unsupported output format '{self.format}' (use csv, jsonl or parquet).")
+        self.rows_written = 0
+        self._buffer: List[Dict[str, Any]] = []
+        self._fh = None
+        self._csv = None
+        self._parquet = None
+        if self.format == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+                import pyarrow.parquet  # noqa: F401
+            except ImportError as e:
+                raise RuntimeError("Parquet output requires pyarrow (pip install pyarrow).") from e
+        else:
+            self._fh = open(path, "w", encoding="utf-8", newline="")
+            if self.format == "csv":
+                self._csv = csv.DictWriter(self._fh, fieldnames=columns or RESULT_COLUMNS, extrasaction="ignore")
+                self._csv.writeheader()
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        if self.format == "csv":
+            self._csv.writerows(rows)
+            self._fh.flush()
+        elif self.format == "jsonl":
+            for row in rows:
+                self._fh.write(json.dumps(row) + "\n")
+            self._fh.flush()
+        else:
+            self._buffer.extend(rows)
+            if len(self._buffer) >= self.PARQUET_ROW_GROUP:
+                self._flush_parquet()
+        self.rows_written += len(rows)
+
+    def _flush_parquet(self) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self._buffer:
+            return
+        table = pa.Table.from_pylist(self._buffer)
+        if self._parquet is None:
+            self._parquet = pq.ParquetWriter(self.path, table.schema)
+        self._parquet.write_table(table.cast(self._parquet.schema))
+        self._buffer = []
+
+    def close(self) -> None:
+        if self.format == "parquet":
+            self._flush_parquet()
+            if self._parquet is not None:
+                self._parquet.close()
+        elif self._fh is not None:
+            self._fh.close()
+
+
+class RankedResultWriter:
+    """ResultWriter front end for --top / --per-ticker. With top, rows go through a TopKRanker and only the best
+    top rows for sort_by are written on close(); per_ticker alone trims each ticker's rows as they stream.
+    """
+
+    def __init__(self, writer: ResultWriter, sort_by: str, top: int = 0, per_ticker: int = 0):
+        self.writer = writer
+        self.sort_by = sort_column(sort_by)
+        self.per_ticker = per_ticker
+        self.ranker = TopKRanker(top, per_ticker, metrics=(self.sort_by,)) if top else None
+
+    @property
+    def rows_written(self) -> int:
+        """Rows written so far, counting rows currently held for the final top list."""
+        held = min(self.ranker.k, self.ranker.seen) if self.ranker else 0
+        return self.writer.rows_written + held
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        if self.ranker is not None:
+            self.ranker.add(rows)
+        elif self.per_ticker:
+            self.writer.write(best_per_ticker(rows, self.sort_by, self.per_ticker))
+        else:
+            self.writer.write(rows)
+
+    def close(self) -> None:
+        if self.ranker is not None:
+            self.writer.write(self.ranker.top(self.sort_by))
+            self.ranker = None
+        self.writer.close()
+
+
+class ProgressLine:
+    """Single-line progress / ETA reporter on stderr, redrawn at most every `interval` seconds."""
+
+    def __init__(self, total: int, interval: float = 0.5, stream=None):
+        self.total = total
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.started = time.monotonic()
+        self._last_draw = 0.0
+        self._tty = hasattr(self.stream, "isatty") and self.stream.isatty()
+
+    @staticmethod
+    def _fmt(seconds: float) -> str:
+        seconds = int(max(0, seconds))
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+    def update(self, done: int, rows: int, errors: int, last_ticker: str = "", force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._last_draw < self.interval:
+            return
+        self._last_draw = now
+        elapsed = now - self.started
+        eta = (elapsed / done) * (self.total - done) if done else 0.0
+        pct = (done / self.total * 100.0) if self.total else 100.0
+        line = (
+            f"[{done}/{self.total}] {pct:5.1f}%  elapsed {self._fmt(elapsed)}  eta {self._fmt(eta)}  "
+            f"rows {rows}  errors {errors}  last {last_ticker}"
+        )
+        if self._tty:
+            self.stream.write("\r" + line.ljust(100))
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
+
+    def finish(self) -> None:
+        if self._tty:
+            self.stream.write("\n")
+            self.stream.flush()
+
+
+def add_screen_filter_args(parser: argparse.ArgumentParser, windows: bool = True) -> None:
+    """Filter / source options shared by headless commands (defaults match the sidebar).
+    windows=False leaves out the DTE / open interest bounds for commands that sweep them.
+    """
+    if windows:
+        parser.add_argument("--dte-min", type=int, default=25, help="Minimum days to expiration (default 25).")
+        parser.add_argument("--dte-max", type=int, default=45, help="Maximum days to expiration (default 45).")
+        parser.add_argument("--min-oi", type=int, default=100, help="Minimum open interest (default 100).")
+    parser.add_argument("--min-premium", type=float, default=0.10, help="Minimum bid premium $ (default 0.10).")
+    parser.add_argument("--min-roi", type=float, default=0.0, help="Minimum annualized ROI %% (default 0).")
+    parser.add_argument(
+        "--price-source", choices=["auto", "previous_close"], default="auto",
+        help="auto = realtime -> snapshot -> prev close; previous_close for restricted plans.",
+    )
+    parser.add_argument(
+        "--chain-source", choices=["auto", CHAIN_SOURCE_SNAPSHOT, CHAIN_SOURCE_CONTRACTS], default="auto",
+        help="Option chain endpoint (auto picks the snapshot when the plan includes it).",
+    )
+    parser.add_argument(
+        "--risk-free-rate", type=float, default=RISK_FREE_RATE * 100.0,
+        help="Annual risk-free rate %% for IV / delta / assignment analytics (default: ITM_CC_RISK_FREE_RATE).",
+    )
+    parser.add_argument("--api-key", default=None, help="Polygon API key (default: POLYGON_API_KEY or saved config).")
+    parser.add_argument(
+        "--rate-limit", type=float, default=DEFAULT_RATE_LIMIT_RPM,
+        help="Requests per minute budget, 0 = unlimited (default: POLYGON_RATE_LIMIT_RPM).",
+    )
+
+
+def add_ranking_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--top", type=int, default=0,
+        help="Write only the best N rows for --sort-by, ranked in bounded memory (default 0 = all rows, unsorted).",
+    )
+    parser.add_argument("--per-ticker", type=int, default=0, help="Keep each ticker's best N rows (default 0 = all).")
+    parser.add_argument(
+        "--sort-by", choices=SORT_METRICS, default=SORT_METRICS[0], help="Metric for --top / --per-ticker."
+    )
+
+
+def build_cli_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python app.py", description="ITM Covered Call Screener (headless mode)."
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    screen = sub.add_parser("screen", help="Screen a ticker universe and stream opportunities to a file.")
+    screen.add_argument("--tickers-file", help="Text file with tickers (one per line, # comments allowed).")
+    screen.add_argument("--tickers", default="", help="Comma separated tickers (combined with --tickers-file).")
+    screen.add_argument("--output", "-o", required=True, help="Output file (.csv, .jsonl or .parquet).")
+    screen.add_argument("--format", choices=["csv", "jsonl", "parquet"], default=None, help="Override output format.")
+    screen.add_argument("--errors-log", default=None, help="JSON Lines error log (default: <output>.errors.jsonl).")
+    screen.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS, help="Concurrent tickers.")
+    screen.add_argument("--metrics", default=None, help="Write the run's instrumentation summary (JSON) here.")
+    add_screen_filter_args(screen)
+    add_ranking_args(screen)
+
+    universe = sub.add_parser(
+        "universe", help="Screen a large universe across worker processes with a resumable work queue."
+    )
+    universe.add_argument("--tickers-file", help="Text file with tickers (one per line, # comments allowed).")
+    universe.add_argument("--tickers", default="", help="Comma separated tickers (combined with --tickers-file).")
+    universe.add_argument("--output", "-o", required=True, help="Output file (.csv, .jsonl or .parquet).")
+    universe.add_argument("--format", choices=["csv", "jsonl", "parquet"], default=None, help="Override output format.")
+    universe.add_argument("--errors-log", default=None, help="JSON Lines error log (default: <output>.errors.jsonl).")
+    universe.add_argument("--queue", default=None, help="Work queue database (default: <output>.queue.sqlite).")
+    universe.add_argument("--fresh", action="store_true", help="Discard an existing queue instead of resuming it.")
+    universe.add_argument(
+        "--processes", type=int, default=os.cpu_count() or 1, help="Worker processes (default: CPU count)."
+    )
+    universe.add_argument("--threads", type=int, default=4, help="Concurrent tickers per worker process (default 4).")
+    universe.add_argument("--batch-size", type=int, default=25, help="Tickers claimed per queue round trip.")
+    universe.add_argument(
+        "--max-attempts", type=int, default=2, help="Attempts per ticker before it is logged as failed (default 2)."
+    )
+    add_screen_filter_args(universe)
+    add_ranking_args(universe)
+
+    sweep = sub.add_parser(
+        "sweep", help="Fetch each ticker once and summarize a grid of DTE / moneyness / open interest scenarios."
+    )
+    sweep.add_argument("--tickers-file", help="Text file with tickers (one per line, # comments allowed).")
+    sweep.add_argument("--tickers", default="", help="Comma separated tickers (combined with --tickers-file).")
+    sweep.add_argument("--output", "-o", required=True, help="Scenario summary file (.csv, .jsonl or .parquet).")
+    sweep.add_argument("--format", choices=["csv", "jsonl", "parquet"], default=None, help="Override output format.")
+    sweep.add_argument("--rows-output", default=None, help="Also write every candidate row (for drilling into cells).")
+    sweep.add_argument(
+        "--dte-windows", type=parse_dte_windows, default=SWEEP_DTE_WINDOWS,
+        help=f"DTE windows, e.g. '{SWEEP_DTE_WINDOWS}'.",
+    )
+    sweep.add_argument(
+        "--moneyness", type=parse_ranges, default=SWEEP_MONEYNESS_BANDS,
+        help=f"Strike / stock price bands, upper bound exclusive (default '{SWEEP_MONEYNESS_BANDS}').",
+    )
+    sweep.add_argument(
+        "--min-oi", type=parse_values, default=SWEEP_MIN_OI, help=f"Open interest floors (default '{SWEEP_MIN_OI}')."
+    )
+    sweep.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS, help="Concurrent tickers.")
+    add_screen_filter_args(sweep, windows=False)
+
+    prewarm = sub.add_parser(
+        "prewarm",
+        help="Companion worker: keep the saved watchlist and recently screened tickers warm in the shared disk "
+             "cache during market hours.",
+    )
+    prewarm.add_argument("--tickers-file", help="Extra tickers to keep warm (one per line, # comments allowed).")
+    prewarm.add_argument("--tickers", default="", help="Extra comma separated tickers to keep warm.")
+    prewarm.add_argument(
+        "--interval", type=float, default=PREWARM_INTERVAL_SECONDS,
+        help="Seconds between cycles (default: ITM_CC_PREWARM_INTERVAL or 60).",
+    )
+    prewarm.add_argument(
+        "--dte-min", type=int, default=DEFAULT_DTE_WINDOW[0],
+        help=f"Shortest expiration kept warm, in days (default {DEFAULT_DTE_WINDOW[0]}, the UI's default range).",
+    )
+    prewarm.add_argument(
+        "--dte-max", type=int, default=DEFAULT_DTE_WINDOW[1],
+        help=f"Longest expiration kept warm, in days (default {DEFAULT_DTE_WINDOW[1]}).",
+    )
+    prewarm.add_argument("--once", action="store_true", help="Run a single cycle and exit.")
+    prewarm.add_argument(
+        "--outside-hours", action="store_true", help="Also run outside market hours (e.g. to warm a cold cache)."
+    )
+    prewarm.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS, help="Concurrent tickers.")
+    prewarm.add_argument(
+        "--price-source", choices=["auto", "previous_close"], default="auto",
+        help="Use the same price source as the UI sessions it warms for.",
+    )
+    prewarm.add_argument("--api-key", default=None, help="Polygon API key (default: POLYGON_API_KEY or saved config).")
+    prewarm.add_argument(
+        "--rate-limit", type=float, default=DEFAULT_RATE_LIMIT_RPM,
+        help="Requests per minute budget of this worker, half of which pre-warming uses (default: "
+             "POLYGON_RATE_LIMIT_RPM, 0 = unlimited).",
+    )
+
+    backtest = sub.add_parser(
+        "backtest",
+        help="Replay the screen's filters over the recorded snapshot history and report realized outcomes "
+             "(called away, realized vs projected annualized ROI) per rule set.",
+    )
+    backtest.add_argument("--tickers-file", help="Only these tickers (default: every recorded ticker).")
+    backtest.add_argument("--tickers", default="", help="Comma separated tickers (combined with --tickers-file).")
+    backtest.add_argument("--start", type=date.fromisoformat, default=None, help="First entry date (YYYY-MM-DD).")
+    backtest.add_argument("--end", type=date.fromisoformat, default=None, help="Last entry date (YYYY-MM-DD).")
+    backtest.add_argument("--output", "-o", required=True, help="Rule set summary file (.csv, .jsonl or .parquet).")
+    backtest.add_argument("--format", choices=["csv", "jsonl", "parquet"], default=None, help="Override output format.")
+    backtest.add_argument("--trades-output", default=None, help="Also write every trade with its outcome.")
+    backtest.add_argument(
+        "--dte-windows", type=parse_dte_windows, default=SWEEP_DTE_WINDOWS,
+        help=f"DTE windows, e.g. '{SWEEP_DTE_WINDOWS}'.",
+    )
+    backtest.add_argument(
+        "--moneyness", type=parse_ranges, default=SWEEP_MONEYNESS_BANDS,
+        help=f"Strike / stock price bands, upper bound exclusive (default '{SWEEP_MONEYNESS_BANDS}').",
+    )
+    backtest.add_argument(
+        "--min-oi", type=parse_values, default=SWEEP_MIN_OI, help=f"Open interest floors (default '{SWEEP_MIN_OI}')."
+    )
+    backtest.add_argument("--min-premium", type=float, default=0.10, help="Minimum bid premium $ (default 0.10).")
+    backtest.add_argument("--min-roi", type=float, default=0.0, help="Minimum annualized ROI %% (default 0).")
+    backtest.add_argument(
+        "--fill-closes", action="store_true",
+        help="Fetch official closes for past expiration dates the history has no price for (one request per date).",
+    )
+    backtest.add_argument("--api-key", default=None, help="Polygon API key for --fill-closes.")
+    backtest.add_argument(
+        "--rate-limit", type=float, default=DEFAULT_RATE_LIMIT_RPM,
+        help="Requests per minute budget for --fill-closes, 0 = unlimited (default: POLYGON_RATE_LIMIT_RPM).",
+    )
+    backtest.add_argument(
+        "--history-dir", default=str(HISTORY_PATH), help="Snapshot history (default: ITM_CC_HISTORY_DIR or "
+                                                          ".itm_cc_history next to the app).",
+    )
+
+    history = sub.add_parser("history", help="Show the recorded snapshot history per date, optionally compacting it.")
+    history.add_argument(
+        "--compact", action="store_true",
+        help="Merge each past date's parts into one (run while no screens are writing, e.g. nightly).",
+    )
+    history.add_argument(
+        "--prune", action="store_true", help="Delete the dates older than --retention-days.",
+    )
+    history.add_argument(
+        "--retention-days", type=int, default=HISTORY_RETENTION_DAYS,
+        help="Days of history --prune keeps (default: ITM_CC_HISTORY_RETENTION_DAYS or 730).",
+    )
+    history.add_argument("--start", type=date.fromisoformat, default=None, help="First date (YYYY-MM-DD).")
+    history.add_argument("--end", type=date.fromisoformat, default=None, help="Last date (YYYY-MM-DD).")
+    history.add_argument(
+        "--history-dir", default=str(HISTORY_PATH), help="Snapshot history (default: ITM_CC_HISTORY_DIR or "
+                                                          ".itm_cc_history next to the app).",
+    )
+    return parser
+
+
+def run_screen_command(args: argparse.Namespace) -> int:
+    tickers = collect_cli_tickers(args)
+    if not tickers:
+        print("No tickers given (use --tickers-file and/or --tickers).", file=sys.stderr)
+        return 2
+    api_key = resolve_cli_api_key(args.api_key)
+    if not api_key:
+        print("No Polygon API key (use --api-key, POLYGON_API_KEY or the saved config).", file=sys.stderr)
+        return 2
+    get_polygon_client().limiter.configure(args.rate_limit)
+
+    writer = RankedResultWriter(ResultWriter(args.output, args.format), args.sort_by, args.top, args.per_ticker)
+    errors_path = args.errors_log or f"{args.output}.errors.jsonl"
+    progress = ProgressLine(len(tickers))
+    done = 0
+    error_count = 0
+    aborted = False
+    try:
+        with track_run(f"{len(tickers)} tickers") as run_stats, open(errors_path, "w", encoding="utf-8") as errors_fh:
+            outcomes = iter_screen_tickers(
+                tickers, api_key, args.dte_min, args.dte_max, args.min_oi, date.today(),
+                min_premium=args.min_premium,
+                min_annualized_roi=args.min_roi,
+                price_source_mode=args.price_source,
+                max_workers=args.max_workers,
+                chain_source=args.chain_source,
+            )
+            for outcome in iter_with_analytics(outcomes, args.risk_free_rate / 100.0):
+                done += 1
+                writer.write(outcome.opportunities)
+                if outcome.error:
+                    error_count += 1
+                    errors_fh.write(json.dumps({
+                        "ticker": outcome.ticker, "message": outcome.error, "time": datetime.now().isoformat(),
+                    }) + "\n")
+                if outcome.aborted:
+                    aborted = True
+                    errors_fh.write(json.dumps({
+                        "ticker": None, "message": AUTH_ABORT_MESSAGE, "time": datetime.now().isoformat(),
+                    }) + "\n")
+                errors_fh.flush()
+                progress.update(done, writer.rows_written, error_count, outcome.ticker, force=outcome.aborted)
+    finally:
+        writer.close()
+        progress.update(done, writer.rows_written, error_count, force=True)
+        progress.finish()
+    if args.metrics:
+        Path(args.metrics).write_text(json.dumps(run_stats.summary(), indent=2), encoding="utf-8")
+
+    print(
+        f"Wrote {writer.rows_written} opportunities for {done} tickers to {args.output} "
+        f"({error_count} errors logged to {errors_path}).",
+        file=sys.stderr,
+    )
+    return 3 if aborted else 0
+
+
+def run_universe_command(args: argparse.Namespace) -> int:
+    """Shard a universe across worker processes through a WorkQueue next to the output.
+    Re-running the same command resumes an interrupted run: finished tickers are kept and the output
+    file is rebuilt from the queue. The coordinator only merges finished rows and reports progress.
+    """
+    tickers = collect_cli_tickers(args)
+    if not tickers:
+        print("No tickers given (use --tickers-file and/or --tickers).", file=sys.stderr)
+        return 2
+    api_key = resolve_cli_api_key(args.api_key)
+    if not api_key:
+        print("No Polygon API key (use --api-key, POLYGON_API_KEY or the saved config).", file=sys.stderr)
+        return 2
+
+    queue_path = Path(args.queue or f"{args.output}.queue.sqlite")
+    if args.fresh:
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{queue_path}{suffix}").unlink(missing_ok=True)
+    queue = WorkQueue(queue_path)
+    run_filters = {
+        "dte_min": args.dte_min,
+        "dte_max": args.dte_max,
+        "min_oi": args.min_oi,
+        "min_premium": args.min_premium,
+        "min_roi": args.min_roi,
+        "price_source_mode": args.price_source,
+        "chain_source_mode": args.chain_source,
+        "risk_free_rate": args.risk_free_rate / 100.0,
+    }
+    stored = queue.get_meta("run")
+    if stored is None:
+        queue.set_meta("run", {**run_filters, "today": date.today().isoformat()})
+    elif {k: stored.get(k) for k in run_filters} != run_filters or stored.get("today") != date.today().isoformat():
+        queue.close()
+        print(
+            f"{queue_path} belongs to a run with other filters or from {stored.get('today')}; "
+            "pass --fresh to start over.",
+            file=sys.stderr,
+        )
+        return 2
+    else:
+        requeued = queue.recover()
+        counts = queue.counts()
+        print(
+            f"Resuming {queue_path}: {counts['done']} done, {counts['failed']} failed, "
+            f"{counts['pending'] + requeued} to go ({requeued} interrupted).",
+            file=sys.stderr,
+        )
+    queue.set_meta("aborted", None)
+    queue.set_meta("stop", None)
+    queue.add(tickers)
+    queue.reset_merged()
+
+    # Resolve plan-dependent sources once here instead of probing from every worker
+    ensure_plan_detected(api_key)
+    settings = {
+        **run_filters,
+        "today": date.today().isoformat(),
+        "price_source": resolve_price_source(api_key, args.price_source),
+        "chain_source": detect_chain_source(api_key) if args.chain_source == "auto" else args.chain_source,
+        "threads": max(1, args.threads),
+        "batch_size": max(1, args.batch_size),
+        "max_attempts": max(1, args.max_attempts),
+    }
+    mp_context = multiprocessing.get_context("spawn")
+    limiter = SharedTokenBucket(args.rate_limit, mp_context=mp_context)
+    processes = max(1, args.processes)
+
+    writer = RankedResultWriter(ResultWriter(args.output, args.format), args.sort_by, args.top, args.per_ticker)
+    errors_path = args.errors_log or f"{args.output}.errors.jsonl"
+    total = sum(queue.counts().values())
+    progress = ProgressLine(total)
+    done = 0
+    error_count = 0
+    aborted = None
+    crashed = False
+    interrupted = False
+    stop_requested = threading.Event()
+
+    def _request_stop(signum, frame) -> None:
+        stop_requested.set()
+        signal.signal(signal.SIGINT, signal.default_int_handler)  # a second Ctrl+C raises as usual
+
+    previous_handler = signal.getsignal(signal.SIGINT)
+    try:
+        with open(errors_path, "w", encoding="utf-8") as errors_fh, ProcessPoolExecutor(
+            max_workers=processes, mp_context=mp_context, initializer=init_universe_worker, initargs=(limiter,)
+        ) as pool:
+            # Workers are spawned by submit(); an ignored SIGINT is inherited, so Ctrl+C cannot kill them mid-import
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            try:
+                futures = [pool.submit(universe_worker, str(queue_path), api_key, settings) for _ in range(processes)]
+            finally:
+                signal.signal(signal.SIGINT, _request_stop)
+            while True:
+                workers_done = all(f.done() for f in futures)  # checked first so the last rows are merged below
+                if not workers_done:
+                    wait(futures, timeout=0.5)
+                if stop_requested.is_set() and not interrupted:
+                    # Workers finish their in-flight tickers and return their claims to the queue
+                    interrupted = True
+                    queue.set_meta("stop", "interrupted")
+                    print("\nStopping after in-flight tickers...", file=sys.stderr)
+                for ticker, status, rows, error in queue.take_finished():
+                    done += 1
+                    writer.write(rows)
+                    if status == "failed":
+                        error_count += 1
+                        errors_fh.write(json.dumps({
+                            "ticker": ticker, "message": error, "time": datetime.now().isoformat(),
+                        }) + "\n")
+                        errors_fh.flush()
+                    progress.update(done, writer.rows_written, error_count, ticker)
+                if workers_done:
+                    break
+            aborted = queue.get_meta("aborted")
+            if aborted:
+                errors_fh.write(json.dumps({
+                    "ticker": None, "message": f"{aborted} {AUTH_ABORT_MESSAGE}", "time": datetime.now().isoformat(),
+                }) + "\n")
+            for fut in futures:
+                fut.result()
+    except BrokenProcessPool:
+        crashed = True
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+        writer.close()
+        progress.update(done, writer.rows_written, error_count, force=True)
+        progress.finish()
+        counts = queue.counts()
+        queue.close()
+
+    remaining = counts["pending"] + counts["running"]
+    print(
+        f"Wrote {writer.rows_written} opportunities for {done} tickers to {args.output} "
+        f"({error_count} errors logged to {errors_path}, {remaining} tickers left in {queue_path}).",
+        file=sys.stderr,
+    )
+    if crashed or (interrupted and remaining):
+        reason = "A worker process died" if crashed else "Interrupted"
+        print(f"{reason}; re-run the same command to resume.", file=sys.stderr)
+        return 1 if crashed else 130
+    return 3 if aborted else 0
+
+
+def run_sweep_command(args: argparse.Namespace) -> int:
+    """Screen the tickers once with the widest DTE window / lowest OI floor of the grid, then write the
+    scenario summary (sweep_summary) of the collected rows.
+    """
+    tickers = collect_cli_tickers(args)
+    if not tickers:
+        print("No tickers given (use --tickers-file and/or --tickers).", file=sys.stderr)
+        return 2
+    api_key = resolve_cli_api_key(args.api_key)
+    if not api_key:
+        print("No Polygon API key (use --api-key, POLYGON_API_KEY or the saved config).", file=sys.stderr)
+        return 2
+    get_polygon_client().limiter.configure(args.rate_limit)
+
+    grid = scenario_grid(args.dte_windows, args.moneyness, args.min_oi)
+    rows: List[Dict[str, Any]] = []
+    progress = ProgressLine(len(tickers))
+    done = error_count = 0
+    aborted = False
+    try:
+        for outcome in iter_screen_tickers(
+            tickers, api_key,
+            min(lo for lo, _ in args.dte_windows), max(hi for _, hi in args.dte_windows), min(args.min_oi),
+            date.today(),
+            min_premium=args.min_premium,
+            min_annualized_roi=args.min_roi,
+            price_source_mode=args.price_source,
+            max_workers=args.max_workers,
+            chain_source=args.chain_source,
+        ):
+            done += 1
+            rows.extend(outcome.opportunities)
+            if outcome.error:
+                error_count += 1
+                print(f"{outcome.ticker}: {outcome.error}", file=sys.stderr)
+            aborted = aborted or outcome.aborted
+            progress.update(done, len(rows), error_count, outcome.ticker, force=outcome.aborted)
+    finally:
+        progress.update(done, len(rows), error_count, force=True)
+        progress.finish()
+    if aborted:
+        print(AUTH_ABORT_MESSAGE, file=sys.stderr)
+        return 3
+
+    rows = add_analytics_records(rows, args.risk_free_rate / 100.0)
+    summary = sweep_summary(results_to_frame(rows), grid)
+    writer = ResultWriter(args.output, args.format, columns=list(summary.columns))
+    writer.write(json.loads(summary.to_json(orient="records")))  # plain Python scalars, NaN -> null
+    writer.close()
+    if args.rows_output:
+        rows_writer = ResultWriter(args.rows_output)
+        rows_writer.write(rows)
+        rows_writer.close()
+    print(
+        f"Wrote {len(grid)} scenarios over {len(rows)} candidate contracts from {done} tickers to {args.output} "
+        f"({error_count} errors).",
+        file=sys.stderr,
+    )
+    return 0
+
+
+def run_prewarm_command(args: argparse.Namespace) -> int:
+    """Run PrewarmScheduler in the foreground against the shared disk cache, logging one line per cycle."""
+    api_key = resolve_cli_api_key(args.api_key)
+    if not api_key:
+        print("No Polygon API key (use --api-key, POLYGON_API_KEY or the saved config).", file=sys.stderr)
+        return 2
+    get_polygon_client().limiter.configure(args.rate_limit)
+    scheduler = PrewarmScheduler(
+        interval=args.interval, max_workers=args.max_workers, outside_hours=args.outside_hours,
+        extra_tickers=tuple(collect_cli_tickers(args)),
+    )
+    scheduler.api_key = api_key
+    scheduler.price_source_mode = args.price_source
+    scheduler.dte_window = (args.dte_min, args.dte_max)
+
+    def log_cycle(status: Dict[str, Any]) -> None:
+        print(
+            f"[{datetime.now():%H:%M:%S}] refreshed {len(status['refreshed'])} of {status['due']} due tickers "
+            f"({status['requests']} requests){': ' + ', '.join(status['refreshed']) if status['refreshed'] else ''}",
+            file=sys.stderr,
+        )
+        for error in status["errors"]:
+            print(f"  {error}", file=sys.stderr)
+
+    if args.once:
+        scheduler.run_cycle()
+        log_cycle(scheduler.status)
+        return 3 if AUTH_ABORT_MESSAGE in scheduler.status["errors"] else 0
+    if not args.outside_hours and not in_market_session():
+        print(f"Market closed; first cycle at {next_market_time(market_now(), MARKET_OPEN):%Y-%m-%d %H:%M %Z}.",
+              file=sys.stderr)
+    try:
+        scheduler.run(on_cycle=log_cycle)
+    except KeyboardInterrupt:
+        scheduler.stop()
+    return 3 if AUTH_ABORT_MESSAGE in scheduler.status["errors"] else 0
+
+
+def run_backtest_command(args: argparse.Namespace) -> int:
+    """Backtest every rule set of the grid over the stored snapshots, streaming the trades part by part."""
+    store = HistoryStore(Path(args.history_dir))
+    if not store.partitions(args.start, args.end):
+        print(f"No snapshots recorded in {args.history_dir} for that period (screens record them as they run).",
+              file=sys.stderr)
+        return 2
+    grid = scenario_grid(args.dte_windows, args.moneyness, args.min_oi)
+    filters = dict(
+        start=args.start, end=args.end, tickers=collect_cli_tickers(args) or None,
+        dte_min=min(lo for lo, _ in args.dte_windows), dte_max=max(hi for _, hi in args.dte_windows),
+        min_oi=min(args.min_oi), min_premium=args.min_premium, min_annualized_roi=args.min_roi,
+    )
+    t0 = time.perf_counter()
+    if args.fill_closes:
+        api_key = resolve_cli_api_key(args.api_key)
+        if not api_key:
+            print("--fill-closes needs a Polygon API key (use --api-key, POLYGON_API_KEY or the saved config).",
+                  file=sys.stderr)
+            return 2
+        get_polygon_client().limiter.configure(args.rate_limit)
+        filled = fill_settle_closes(store, api_key, iter_backtest_trades(store, **filters))
+        print(f"Recorded closes for {filled} expiration dates.", file=sys.stderr)
+
+    totals = {"trades": 0, "expired": 0}
+    tickers: set = set()
+    trades_writer = ResultWriter(args.trades_output, columns=BACKTEST_TRADE_COLUMNS) if args.trades_output else None
+
+    def trade_chunks() -> Iterator[Dict[str, Any]]:
+        """The trades as they stream into the summary, counted and written to --trades-output on the way."""
+        for chunk in iter_backtest_trades(store, **filters):
+            totals["trades"] += len(chunk["DTE"])
+            totals["expired"] += int((~np.isnan(chunk["Settle Price"])).sum())
+            tickers.update(chunk["Ticker"].unique().tolist())
+            if trades_writer is not None:
+                frame = pd.DataFrame({
+                    **chunk, "Entry Date": np.datetime_as_string(chunk["Entry Date"]),
+                    "Expiration": np.datetime_as_string(chunk["Expiration"]),
+                })
+                for start in range(0, len(frame), ResultWriter.PARQUET_ROW_GROUP):
+                    rows = frame.iloc[start:start + ResultWriter.PARQUET_ROW_GROUP]
+                    trades_writer.write(json.loads(rows.to_json(orient="records")))  # NaN / NA -> null
+            yield chunk
+
+    try:
+        summary = backtest_summary(trade_chunks(), grid)
+    finally:
+        if trades_writer is not None:
+            trades_writer.close()
+    elapsed = time.perf_counter() - t0
+
+    writer = ResultWriter(args.output, args.format, columns=list(summary.columns))
+    writer.write(json.loads(summary.to_json(orient="records")))  # plain Python scalars, NaN -> null
+    writer.close()
+    print(
+        f"Backtested {len(grid)} rule sets over {totals['trades']} trades ({totals['expired']} expired) from "
+        f"{len(tickers)} tickers in {elapsed:.2f} s; wrote {args.output}.",
+        file=sys.stderr,
+    )
+    return 0
+
+
+def run_history_command(args: argparse.Namespace) -> int:
+    store = HistoryStore(Path(args.history_dir))
+    if args.prune and args.retention_days > 0:
+        removed = store.prune(market_now().date() - timedelta(days=args.retention_days))
+        print(f"Pruned {len(removed)} dates.", file=sys.stderr)
+    if args.compact:
+        today = market_now().date()
+        merged = [day for day, _ in store.partitions(args.start, args.end) if day < today and store.compact(day)]
+        print(f"Compacted {len(merged)} dates.", file=sys.stderr)
+    rows = store.summary(args.start, args.end)
+    for row in rows:
+        print(
+            f"{row['date']}  {row['parts']:>4} parts  {row['snapshots']:>6} snapshots  {row['tickers']:>5} tickers  "
+            f"{row['contracts']:>10,} contracts  {row['bytes'] / 1e6:8.1f} MB"
+        )
+    if not rows:
+        print(f"No snapshots recorded in {args.history_dir}.", file=sys.stderr)
+    return 0
+
+
+CLI_COMMANDS = {
+    "screen": run_screen_command,
+    "universe": run_universe_command,
+    "sweep": run_sweep_command,
+    "prewarm": run_prewarm_command,
+    "backtest": run_backtest_command,
+    "history": run_history_command,
+}
+
+
+def cli_main(argv: List[str]) -> int:
+    """Entry point for `python app.py <command> ...` (Streamlit is only used for its caches here)."""
+    args = build_cli_parser().parse_args(argv)
+    return CLI_COMMANDS[args.command](args)
@@ -0,0 +1,1708 @@
+"""Polygon client: instrumentation, HTTP session, market clock, disk cache, request coalescing, plan
+capabilities and the cached API fetchers.
+"""
+
+from datetime import datetime, date, timedelta, time as dt_time
+from typing import List, Dict, Any, Optional, Iterator, Callable
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from zoneinfo import ZoneInfo
+import contextvars
+import functools
+import hashlib
+import inspect
+import multiprocessing
+import sqlite3
+import threading
+import random
+import time
+import collections
+import re
+import json
+import os
+import zlib
+
+import streamlit as st
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+try:  # optional: incremental decoding of chain pages straight from the socket
+    import ijson
+except ImportError:
+    ijson = None
+try:  # optional: fast whole-page decoding when ijson (with a C backend) is not available
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# -----------------------------
+# Instrumentation
+# -----------------------------
+
+ENDPOINT_LABELS = [
+    (re.compile(r"^/v2/last/trade/"), "last_trade"),
+    (re.compile(r"^/v2/aggs/ticker/[^/]+/prev"), "previous_close"),
+    (re.compile(r"^/v2/aggs/grouped/"), "grouped_daily"),
+    (re.compile(r"^/v2/snapshot/locale/us/markets/stocks/tickers/?$"), "stocks_snapshot_bulk"),
+    (re.compile(r"^/v2/snapshot/locale/us/markets/stocks/tickers/"), "stocks_snapshot"),
+    (re.compile(r"^/v3/reference/options/contracts"), "options_contracts"),
+    (re.compile(r"^/v3/snapshot/options/"), "options_snapshot"),
+]
+
+
+def endpoint_label(url: str) -> str:
+    """Collapse a Polygon URL to a low-cardinality endpoint name (no tickers / query strings)."""
+    path = urlparse(url).path
+    for pattern, label in ENDPOINT_LABELS:
+        if pattern.search(path):
+            return label
+    return "other"
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    return float(np.percentile(values, pct)) if values else None
+
+
+class RunStats:
+    """Thread-safe collector for one screening run: every Polygon request (latency, status, bytes),
+    per-ticker stage timings and cache hit / miss counters per helper.
+    """
+
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.started_at = datetime.now()
+        self._t0 = time.perf_counter()
+        self.wall_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+        self.requests: List[Dict[str, Any]] = []
+        self.stages: Dict[str, Dict[str, float]] = collections.defaultdict(dict)
+        self.cache: Dict[str, Dict[str, int]] = collections.defaultdict(
+            lambda: {"calls": 0, "misses": 0, "coalesced": 0}
+        )
+
+    def record_request(self, endpoint: str, status: str, seconds: float, nbytes: int) -> None:
+        with self._lock:
+            self.requests.append({"endpoint": endpoint, "status": status, "seconds": seconds, "bytes": nbytes})
+
+    def record_stage(self, ticker: str, stage: str, seconds: float) -> None:
+        with self._lock:
+            stages = self.stages[ticker or "(run)"]
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    def record_cache(self, helper: str, event: str) -> None:
+        with self._lock:
+            self.cache[helper][event] += 1
+
+    def finish(self) -> None:
+        self.wall_seconds = time.perf_counter() - self._t0
+
+    def summary(self) -> Dict[str, Any]:
+        """JSON-serializable run summary with p50 / p95 latencies per endpoint and per stage."""
+        with self._lock:
+            requests_ = list(self.requests)
+            stages = {tk: dict(v) for tk, v in self.stages.items()}
+            cache = {helper: dict(v) for helper, v in self.cache.items()}
+
+        by_endpoint: Dict[str, List[Dict[str, Any]]] = collections.defaultdict(list)
+        for r in requests_:
+            by_endpoint[r["endpoint"]].append(r)
+        endpoints = {}
+        for name, rows in sorted(by_endpoint.items()):
+            latencies = [r["seconds"] for r in rows]
+            endpoints[name] = {
+                "requests": len(rows),
+                "statuses": dict(collections.Counter(r["status"] for r in rows)),
+                "bytes": sum(r["bytes"] for r in rows),
+                "p50_ms": _ms(percentile(latencies, 50)),
+                "p95_ms": _ms(percentile(latencies, 95)),
+            }
+
+        stage_values: Dict[str, List[float]] = collections.defaultdict(list)
+        for per_ticker in stages.values():
+            for stage, seconds in per_ticker.items():
+                stage_values[stage].append(seconds)
+        stage_summary = {
+            stage: {
+                "count": len(vals),
+                "total_ms": _ms(sum(vals)),
+                "p50_ms": _ms(percentile(vals, 50)),
+                "p95_ms": _ms(percentile(vals, 95)),
+            }
+            for stage, vals in sorted(stage_values.items())
+        }
+        cache_summary = {
+            helper: {
+                "hits": max(0, c["calls"] - c["misses"]),
+                "misses": c["misses"],
+                "coalesced": c["coalesced"],
+            }
+            for helper, c in sorted(cache.items())
+        }
+        all_latencies = [r["seconds"] for r in requests_]
+        return {
+            "label": self.label,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "wall_seconds": self.wall_seconds,
+            "requests": len(requests_),
+            "bytes": sum(r["bytes"] for r in requests_),
+            "latency_p50_ms": _ms(percentile(all_latencies, 50)),
+            "latency_p95_ms": _ms(percentile(all_latencies, 95)),
+            "endpoints": endpoints,
+            "stages": stage_summary,
+            "cache": cache_summary,
+            "tickers": stages,
+        }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000.0, 2)
+
+
+class MetricsRegistry:
+    """Process-wide cumulative counters (all sessions) exported in Prometheus text format."""
+
+    def __init__(self, recent: int = 5000):
+        self._lock = threading.Lock()
+        self._recent = recent
+        self.requests: Dict[tuple, int] = collections.Counter()
+        self.request_seconds: Dict[str, float] = collections.Counter()
+        self.request_count: Dict[str, int] = collections.Counter()
+        self.response_bytes: Dict[str, int] = collections.Counter()
+        self.cache_events: Dict[tuple, int] = collections.Counter()
+        self.stage_seconds: Dict[str, float] = collections.Counter()
+        self.stage_count: Dict[str, int] = collections.Counter()
+        # Latest request latencies per endpoint, for the summary quantiles
+        self.recent_latencies: Dict[str, collections.deque] = {}
+
+    def record_request(self, endpoint: str, status: str, seconds: float, nbytes: int) -> None:
+        with self._lock:
+            self.requests[(endpoint, status)] += 1
+            self.request_seconds[endpoint] += seconds
+            self.request_count[endpoint] += 1
+            self.response_bytes[endpoint] += nbytes
+            window = self.recent_latencies.get(endpoint)
+            if window is None:
+                window = self.recent_latencies[endpoint] = collections.deque(maxlen=self._recent)
+            window.append(seconds)
+
+    def record_stage(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stage_seconds[stage] += seconds
+            self.stage_count[stage] += 1
+
+    def record_cache(self, helper: str, event: str) -> None:
+        with self._lock:
+            self.cache_events[(helper, event)] += 1
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            lines = [
+                "# HELP itm_cc_requests_total Polygon HTTP requests by endpoint and status.",
+                "# TYPE itm_cc_requests_total counter",
+            ]
+            lines += [
+                f'itm_cc_requests_total{{endpoint="{ep}",status="{st_}"}} {n}'
+                for (ep, st_), n in sorted(self.requests.items())
+            ]
+            lines += [
+                "# HELP itm_cc_request_duration_seconds Polygon request latency.",
+                "# TYPE itm_cc_request_duration_seconds summary",
+            ]
+            for ep in sorted(self.request_count):
+                latencies = list(self.recent_latencies.get(ep, ()))
+                for q in (0.5, 0.95):
+                    value = percentile(latencies, q * 100)
+                    if value is not None:
+                        labels = f'endpoint="{ep}",quantile="{q}"'
+                        lines.append(f"itm_cc_request_duration_seconds{{{labels}}} {value:.6f}")
+                lines.append(f'itm_cc_request_duration_seconds_sum{{endpoint="{ep}"}} {self.request_seconds[ep]:.6f}')
+                lines.append(f'itm_cc_request_duration_seconds_count{{endpoint="{ep}"}} {self.request_count[ep]}')
+            lines += [
+                "# HELP itm_cc_response_bytes_total Polygon response body bytes by endpoint.",
+                "# TYPE itm_cc_response_bytes_total counter",
+            ]
+            lines += [f'itm_cc_response_bytes_total{{endpoint="{ep}"}} {n}' for ep, n in sorted(self.response_bytes.items())]
+            lines += [
+                "# HELP itm_cc_cache_events_total Cached helper calls, misses (hits = calls - misses), coalesced waits.",
+                "# TYPE itm_cc_cache_events_total counter",
+            ]
+            lines += [
+                f'itm_cc_cache_events_total{{helper="{helper}",event="{event}"}} {n}'
+                for (helper, event), n in sorted(self.cache_events.items())
+            ]
+            lines += [
+                "# HELP itm_cc_stage_duration_seconds Per-ticker processing stage durations.",
+                "# TYPE itm_cc_stage_duration_seconds summary",
+            ]
+            for stage in sorted(self.stage_count):
+                lines.append(f'itm_cc_stage_duration_seconds_sum{{stage="{stage}"}} {self.stage_seconds[stage]:.6f}')
+                lines.append(f'itm_cc_stage_duration_seconds_count{{stage="{stage}"}} {self.stage_count[stage]}')
+        return "\n".join(lines) + "\n"
+
+
+def per_run_resource(getter: Callable[[], Any]) -> Callable[[], Any]:
+    """Remember what a no-argument st.cache_resource getter returned for the rest of this script run.
+    The shared instance is the same either way; this only skips Streamlit's per-call cache lookup,
+    which dominates hot paths that fetch a resource per ticker or per stage.
+    """
+    holder: List[Any] = []
+
+    @functools.wraps(getter)
+    def wrapper():
+        if not holder:
+            holder.append(getter())
+        return holder[0]
+
+    return wrapper
+
+
+@per_run_resource
+@st.cache_resource(show_spinner=False)
+def get_metrics() -> MetricsRegistry:
+    return MetricsRegistry()
+
+
+@per_run_resource
+@st.cache_resource(show_spinner=False)
+def current_run_var() -> contextvars.ContextVar:
+    """The ContextVar holding the active RunStats. Cached as a resource because Streamlit re-executes the
+    script on every rerun, and objects cached by earlier runs (e.g. the shared client) must see the same var.
+    """
+    return contextvars.ContextVar("itm_cc_current_run", default=None)
+
+
+@contextmanager
+def track_run(label: str = "") -> Iterator[RunStats]:
+    """Collect RunStats for everything executed in this context (and in worker threads started
+    with a copied context, see iter_screen_tickers)."""
+    run = RunStats(label)
+    var = current_run_var()
+    token = var.set(run)
+    try:
+        yield run
+    finally:
+        run.finish()
+        var.reset(token)
+
+
+def record_request(endpoint: str, status: str, seconds: float, nbytes: int) -> None:
+    get_metrics().record_request(endpoint, status, seconds, nbytes)
+    run = current_run_var().get()
+    if run is not None:
+        run.record_request(endpoint, status, seconds, nbytes)
+
+
+def record_cache_event(helper: str, event: str) -> None:
+    get_metrics().record_cache(helper, event)
+    run = current_run_var().get()
+    if run is not None:
+        run.record_cache(helper, event)
+
+
+@contextmanager
+def timed_stage(ticker: str, stage: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - t0
+        get_metrics().record_stage(stage, seconds)
+        run = current_run_var().get()
+        if run is not None:
+            run.record_stage(ticker, stage, seconds)
+
+
+def instrumented_cache_data(helper: str, **cache_kwargs: Any):
+    """st.cache_data that also counts calls (outside the cache) and misses (inside it) for `helper`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def on_miss(*args, **kwargs):
+            record_cache_event(helper, "misses")
+            return fn(*args, **kwargs)
+
+        cached = st.cache_data(show_spinner=False, **cache_kwargs)(on_miss)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            record_cache_event(helper, "calls")
+            return cached(*args, **kwargs)
+
+        wrapper.clear = cached.clear
+        return wrapper
+
+    return decorator
+
+
+# -----------------------------
+# HTTP Client
+# -----------------------------
+
+POLYGON_BASE_URL = os.environ.get("POLYGON_BASE_URL", "https://api.polygon.io").rstrip("/")
+USER_AGENT = "ITM-Covered-Call-Screener/1.0"
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+DEFAULT_RATE_LIMIT_RPM = float(os.environ.get("POLYGON_RATE_LIMIT_RPM", "0") or 0)
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiter. A rate of 0 requests/minute disables limiting.
+    Capacity defaults to ~10 seconds worth of requests so bursts stay well inside a per-minute quota.
+    """
+
+    def __init__(self, rate_per_minute: float = 0.0, capacity: Optional[float] = None):
+        self._lock = threading.Lock()
+        self.tokens = 0.0
+        self.configure(rate_per_minute, capacity)
+
+    def configure(self, rate_per_minute: float, capacity: Optional[float] = None) -> None:
+        with self._lock:
+            self.rate_per_minute = max(0.0, float(rate_per_minute or 0))
+            self.capacity = float(capacity) if capacity else max(1.0, self.rate_per_minute / 6.0)
+            self.tokens = min(self.tokens, self.capacity) if self.tokens else self.capacity
+            self.updated = time.monotonic()
+
+    def acquire(self) -> float:
+        """Block until a token is available. Returns the number of seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                if self.rate_per_minute <= 0:
+                    return waited
+                rate = self.rate_per_minute / 60.0
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return waited
+                delay = (1.0 - self.tokens) / rate
+            time.sleep(delay)
+            waited += delay
+
+
+class SharedTokenBucket(TokenBucket):
+    """TokenBucket whose token count lives in shared memory, so every process of a universe run draws from
+    one requests-per-minute budget. Pass it to worker processes at start-up (initializer args);
+    time.monotonic() is system-wide, so refill timestamps are comparable across processes.
+    """
+
+    def __init__(self, rate_per_minute: float = 0.0, capacity: Optional[float] = None, mp_context=None):
+        self._shared = (mp_context or multiprocessing.get_context()).Array("d", 2)  # tokens, updated
+        super().__init__(rate_per_minute, capacity)
+        self._lock = self._shared.get_lock()
+
+    @property
+    def tokens(self) -> float:
+        return self._shared[0]
+
+    @tokens.setter
+    def tokens(self, value: float) -> None:
+        self._shared[0] = value
+
+    @property
+    def updated(self) -> float:
+        return self._shared[1]
+
+    @updated.setter
+    def updated(self, value: float) -> None:
+        self._shared[1] = value
+
+
+class PolygonClient:
+    """Shared HTTP layer for every Polygon call: pooled keep-alive connections, gzip,
+    bounded retries with jittered exponential backoff (honoring Retry-After) and a token bucket limiter.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 32,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        rate_per_minute: float = DEFAULT_RATE_LIMIT_RPM,
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limiter = TokenBucket(rate_per_minute)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"User-Agent": USER_AGENT, "Accept-Encoding": "gzip, deflate"})
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniform in [0, base * 2^attempt], capped
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _retry_after(self, resp: requests.Response) -> Optional[float]:
+        value = resp.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return min(self.backoff_max, max(0.0, float(value)))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return min(self.backoff_max, max(0.0, retry_at.timestamp() - time.time()))
+        except (TypeError, ValueError):
+            return None
+
+    def get(
+        self, url: str, params: Optional[Dict[str, Any]] = None, timeout: float = 10, stream: bool = False
+    ) -> requests.Response:
+        """GET with rate limiting and retries on 429 / 5xx / network errors.
+        Returns the final response (possibly still an error status); raises requests.RequestException
+        if the network fails on every attempt. With stream the body is left unread for the caller
+        (latency then covers the headers only and bytes come from Content-Length).
+        """
+        if url.startswith("/"):
+            url = POLYGON_BASE_URL + url
+        endpoint = endpoint_label(url)
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            t0 = time.perf_counter()
+            try:
+                resp = self.session.get(url, params=params, timeout=timeout, stream=stream)
+            except requests.RequestException:
+                record_request(endpoint, "error", time.perf_counter() - t0, 0)
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            nbytes = int(resp.headers.get("Content-Length") or 0) if stream else len(resp.content)
+            record_request(endpoint, str(resp.status_code), time.perf_counter() - t0, nbytes)
+            if resp.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                return resp
+            delay = self._retry_after(resp)
+            resp.close()
+            time.sleep(self._backoff(attempt) if delay is None else delay)
+            attempt += 1
+
+
+@st.cache_resource(show_spinner=False)
+def get_polygon_client() -> PolygonClient:
+    """Process-wide client shared by all threads and Streamlit sessions."""
+    return PolygonClient()
+
+
+def polygon_get(
+    url: str, params: Optional[Dict[str, Any]] = None, timeout: float = 10, stream: bool = False
+) -> requests.Response:
+    """Issue a GET through the shared Polygon client.
+    Endpoints the key is known to be refused (see CapabilityRegistry) are answered locally with the
+    remembered 401 / 403, so callers keep their usual status handling without spending a request.
+    """
+    api_key = (params or {}).get("apiKey")
+    if not api_key:
+        return get_polygon_client().get(url, params=params, timeout=timeout, stream=stream)
+    registry = get_capability_registry()
+    label = endpoint_label(url)
+    refused = registry.refused_status(api_key, label)
+    if refused is not None:
+        return refused_response(url, refused, label)
+    resp = get_polygon_client().get(url, params=params, timeout=timeout, stream=stream)
+    registry.record(api_key, label, resp.status_code)
+    return resp
+
+
+# -----------------------------
+# Market Session
+# -----------------------------
+
+MARKET_TZ = ZoneInfo("America/New_York")
+MARKET_OPEN = dt_time(9, 30)
+MARKET_CLOSE = dt_time(16, 0)  # early closes are treated as full sessions (quotes just expire sooner)
+REFERENCE_ROLLOVER = dt_time(6, 0)  # new option listings are published before the open
+PREVIOUS_CLOSE_SETTLE = timedelta(minutes=15)  # daily bars are final shortly after the close
+QUOTE_TTL = float(os.environ.get("ITM_CC_QUOTE_TTL", "300"))  # quotes / last trades during the session
+# NYSE full-day closures; extend with ITM_CC_MARKET_HOLIDAYS=YYYY-MM-DD,...
+MARKET_HOLIDAYS = frozenset(
+    date.fromisoformat(d.strip())
+    for d in (
+        "2025-01-01,2025-01-20,2025-02-17,2025-04-18,2025-05-26,2025-06-19,2025-07-04,2025-09-01,2025-11-27,"
+        "2025-12-25,2026-01-01,2026-01-19,2026-02-16,2026-04-03,2026-05-25,2026-06-19,2026-07-03,2026-09-07,"
+        "2026-11-26,2026-12-25,2027-01-01,2027-01-18,2027-02-15,2027-03-26,2027-05-31,2027-06-18,2027-07-05,"
+        "2027-09-06,2027-11-25,2027-12-24," + os.environ.get("ITM_CC_MARKET_HOLIDAYS", "")
+    ).split(",")
+    if d.strip()
+)
+
+
+def is_trading_day(day: date) -> bool:
+    return day.weekday() < 5 and day not in MARKET_HOLIDAYS
+
+
+def market_now() -> datetime:
+    return datetime.now(MARKET_TZ)
+
+
+def next_market_time(now: datetime, at: dt_time) -> datetime:
+    """First moment strictly after now that is `at` (New York time) on a trading day."""
+    now = now.astimezone(MARKET_TZ)
+    day = now.date()
+    while True:
+        moment = datetime.combine(day, at, MARKET_TZ)
+        if moment > now and is_trading_day(day):
+            return moment
+        day += timedelta(days=1)
+
+
+def in_market_session(now: Optional[datetime] = None) -> bool:
+    now = (now or market_now()).astimezone(MARKET_TZ)
+    return is_trading_day(now.date()) and MARKET_OPEN <= now.time() < MARKET_CLOSE
+
+
+def quote_ttl(now: Optional[datetime] = None) -> float:
+    """Quotes, open interest and last trades: QUOTE_TTL during the session; outside it they cannot change
+    before the next open, so they stay valid until then.
+    """
+    now = now or market_now()
+    if in_market_session(now):
+        return QUOTE_TTL
+    return max(QUOTE_TTL, (next_market_time(now, MARKET_OPEN) - now).total_seconds())
+
+
+def previous_close_ttl(now: Optional[datetime] = None) -> float:
+    """A previous close stays valid until the next session's close has settled into a daily bar."""
+    now = now or market_now()
+    return (next_market_time(now - PREVIOUS_CLOSE_SETTLE, MARKET_CLOSE) + PREVIOUS_CLOSE_SETTLE - now).total_seconds()
+
+
+def reference_ttl(now: Optional[datetime] = None) -> float:
+    """Contract listings (symbol, strike, expiration) stay valid until the next trading day's rollover."""
+    now = now or market_now()
+    return (next_market_time(now, REFERENCE_ROLLOVER) - now).total_seconds()
+
+
+def resolve_ttl(ttl: Any) -> float:
+    """Cache ttl given as seconds or as a freshness policy such as quote_ttl."""
+    return float(ttl() if callable(ttl) else ttl)
+
+
+# -----------------------------
+# Persistent Disk Cache
+# -----------------------------
+
+APP_DIR = Path(__file__).resolve().parent.parent  # config, cache, views and history live next to app.py
+CONFIG_PATH = APP_DIR / ".itm_cc_config.json"
+DISK_CACHE_PATH = APP_DIR / ".itm_cc_cache.sqlite"
+DISK_CACHE_MAX_BYTES = int(float(os.environ.get("ITM_CC_CACHE_MAX_MB", "256")) * 1024 * 1024)
+
+
+class DiskCache:
+    """SQLite-backed market data cache that survives Streamlit restarts.
+    Entries are keyed by (endpoint, ticker, params) and stored as zlib-compressed JSON together with
+    fetched / expiry / last access timestamps. Once the stored payload exceeds max_bytes the least
+    recently used entries are evicted. API keys are never part of a key or payload.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = DISK_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    endpoint TEXT NOT NULL,
+                    ticker TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    payload BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access)")
+
+    @staticmethod
+    def make_key(endpoint: str, ticker: str, params: Dict[str, Any]) -> str:
+        return json.dumps([endpoint, ticker.upper(), params], sort_keys=True, default=str)
+
+    def get(self, endpoint: str, ticker: str, params: Dict[str, Any]) -> Optional[Any]:
+        """Return the cached value if present and still fresh, else None."""
+        key = self.make_key(endpoint, ticker, params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                return None
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+        return json.loads(zlib.decompress(row[0]))
+
+    def set(self, endpoint: str, ticker: str, params: Dict[str, Any], value: Any, ttl: float) -> None:
+        key = self.make_key(endpoint, ticker, params)
+        payload = zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"), 6)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(key, endpoint, ticker, params, payload, size, fetched_at, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key, endpoint, ticker.upper(), json.dumps(params, sort_keys=True, default=str),
+                    payload, len(payload), now, now + ttl, now,
+                ),
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until the total payload fits in max_bytes (lock held)."""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            count, size, fresh = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(expires_at > ?), 0) FROM entries", (now,)
+            ).fetchone()
+        return {"entries": count, "fresh_entries": fresh, "bytes": size, "max_bytes": self.max_bytes}
+
+    def fetched_times(self, endpoints: tuple) -> Dict[str, float]:
+        """Latest fetch time (epoch seconds) per ticker over the entries of the given endpoints, expired or not."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT ticker, MAX(fetched_at) FROM entries WHERE endpoint IN ({','.join('?' * len(endpoints))}) "
+                "GROUP BY ticker",
+                endpoints,
+            ).fetchall()
+        return dict(rows)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.execute("VACUUM")
+
+    def invalidate(self, tickers: List[str], keep: tuple = ()) -> int:
+        """Drop every entry for the given tickers except those of the keep endpoints; returns how many
+        were removed.
+        """
+        upper = [t.upper() for t in tickers]
+        if not upper:
+            return 0
+        sql = f"DELETE FROM entries WHERE ticker IN ({','.join('?' * len(upper))})"
+        if keep:
+            sql += f" AND endpoint NOT IN ({','.join('?' * len(keep))})"
+        with self._lock:
+            return self._conn.execute(sql, [*upper, *keep]).rowcount
+
+
+@st.cache_resource(show_spinner=False)
+def get_disk_cache() -> Optional[DiskCache]:
+    """Process-wide disk cache, or None if the cache file cannot be opened (e.g. read-only directory)."""
+    try:
+        return DiskCache(DISK_CACHE_PATH)
+    except sqlite3.Error:
+        return None
+
+
+def disk_cached(
+    endpoint: str,
+    ttl: Any,
+    should_store: Callable[[Any], bool] = bool,
+    decode: Callable[[Any], Any] = lambda value: value,
+):
+    """Read-through disk caching for helpers with a (ticker, api_key, ...) signature.
+    The remaining bound arguments and the key's plan tier (shared_scope) form the cache params; a key without a
+    scope yet reads nothing. Results are stored only when should_store(result), under the scope the key has
+    after the call. ttl is seconds or a freshness policy evaluated at store time (see quote_ttl).
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            cache = get_disk_cache()
+            if cache is None:
+                return fn(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = {k: v for k, v in bound.arguments.items() if k not in ("ticker", "api_key")}
+            ticker = bound.arguments["ticker"]
+            scope = shared_scope(bound.arguments["api_key"])
+            record_cache_event(f"disk:{endpoint}", "calls")
+            cached = None
+            if scope is not None:
+                try:
+                    cached = cache.get(endpoint, ticker, {**params, "plan": scope})
+                except (sqlite3.Error, ValueError, zlib.error):
+                    pass
+            if cached is not None:
+                return decode(cached)
+            record_cache_event(f"disk:{endpoint}", "misses")
+            result = fn(*args, **kwargs)
+            scope = shared_scope(bound.arguments["api_key"])
+            if scope is not None and should_store(result):
+                try:
+                    cache.set(endpoint, ticker, {**params, "plan": scope}, result, resolve_ttl(ttl))
+                except (sqlite3.Error, TypeError, ValueError):
+                    pass
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def _price_found(result: tuple[Optional[float], Optional[str]]) -> bool:
+    return result[0] is not None
+
+
+def _decode_price(value: List[Any]) -> tuple[Optional[float], Optional[str]]:
+    return float(value[0]), None
+
+
+# -----------------------------
+# Request Coalescing
+# -----------------------------
+
+SHARED_RESULTS_MAX_ENTRIES = int(os.environ.get("ITM_CC_SHARED_RESULTS", "2048") or 2048)
+FETCH_CACHE_MAX_ENTRIES = 1024  # bound on each per-API-key st.cache_data fetch cache
+
+
+class SingleFlight:
+    """Process-wide fetch layer shared by every session: at most one upstream call per key is in flight,
+    concurrent callers for that key wait on it and share its result, and shareable results are kept in
+    a bounded LRU for their ttl. Keys never include the API key, only its plan tier (see coalesced), so users
+    of the same plan watching the same tickers share fetches.
+    """
+
+    def __init__(self, max_entries: int = SHARED_RESULTS_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._results: "collections.OrderedDict[str, tuple[float, Any]]" = collections.OrderedDict()
+        self.counters: Dict[str, int] = collections.Counter()
+
+    def _lookup(self, key: str) -> tuple[bool, Any, Optional[Future], bool]:
+        """(hit, value, future, leader) under the lock."""
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                if cached[0] > time.monotonic():
+                    self._results.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return True, cached[1], None, False
+                del self._results[key]
+            future = self._inflight.get(key)
+            if future is not None:
+                self.counters["coalesced"] += 1
+                return False, None, future, False
+            future = Future()
+            self._inflight[key] = future
+            self.counters["upstream"] += 1
+            return False, None, future, True
+
+    def do(
+        self,
+        key: str,
+        fn: Callable[[], Any],
+        ttl: Any,
+        should_share: Callable[[Any], bool] = bool,
+        on_wait: Optional[Callable[[], None]] = None,
+    ) -> Any:
+        """Return fn() for key, joining an in-flight call or the shared cache when possible.
+        A result that should not be shared (e.g. an entitlement error for the leader's key) is not
+        handed to waiting callers; they call fn() with their own arguments instead.
+        """
+        hit, value, future, leader = self._lookup(key)
+        if hit:
+            return value
+        if not leader:
+            if on_wait is not None:
+                on_wait()
+            try:
+                value = future.result()
+            except Exception:
+                return fn()
+            return value if should_share(value) else fn()
+
+        try:
+            value = fn()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._inflight.pop(key, None)
+            if should_share(value):
+                self._results[key] = (time.monotonic() + resolve_ttl(ttl), value)
+                self._results.move_to_end(key)
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        future.set_result(value)
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.counters, "in_flight": len(self._inflight), "shared_entries": len(self._results)}
+
+    def invalidate(self, tickers: List[str], keep: tuple = ()) -> None:
+        """Drop shared results whose ticker (or multi-ticker) argument mentions any of tickers, except
+        those of the keep endpoints.
+        """
+        upper = {t.upper() for t in tickers}
+        with self._lock:
+            for key in list(self._results):
+                endpoint, _, params = json.loads(key)
+                if endpoint in keep:
+                    continue
+                mentioned = {str(t).upper() for t in params.get("tickers") or ()}
+                mentioned.add(str(params.get("ticker", "")).upper())
+                if mentioned & upper:
+                    del self._results[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+
+
+@per_run_resource
+@st.cache_resource(show_spinner=False)
+def get_single_flight() -> SingleFlight:
+    return SingleFlight()
+
+
+def coalesced(endpoint: str, ttl: Any, should_share: Callable[[Any], bool] = bool):
+    """Route a fetch helper through the process-wide SingleFlight, keyed by endpoint, the key's plan tier
+    (shared_scope) and every argument except api_key; a key without a scope yet calls upstream on its own.
+    Counts calls / misses / coalesced waits as `flight:<endpoint>` cache events.
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            helper = f"flight:{endpoint}"
+            record_cache_event(helper, "calls")
+            scope = shared_scope(bound.arguments["api_key"])
+            if scope is None:
+                record_cache_event(helper, "misses")
+                return fn(*args, **kwargs)
+            params = {k: v for k, v in bound.arguments.items() if k != "api_key"}
+            key = json.dumps([endpoint, scope, params], sort_keys=True, default=str)
+
+            def call() -> Any:
+                record_cache_event(helper, "misses")
+                return fn(*args, **kwargs)
+
+            return get_single_flight().do(
+                key, call, ttl, should_share, on_wait=lambda: record_cache_event(helper, "coalesced")
+            )
+
+        return wrapper
+
+    return decorator
+
+
+# -----------------------------
+# Plan Capabilities
+# -----------------------------
+
+# Endpoints sharing an entitlement: a refusal on one applies to the others
+ENDPOINT_ENTITLEMENTS = {"stocks_snapshot_bulk": "stocks_snapshot"}
+ACCESS_STATUSES = (200, 401, 403)  # only these say anything about the plan (5xx / 429 are transient)
+PLAN_CAPABILITIES_TTL = 24 * 3600  # persisted probe results; "Check Plan Limits" re-probes on demand
+KEY_VERIFIED_TTL = 3600  # a key shares cached results this long after its last successful request
+ANY_ENDPOINT = "*"  # a 401 refuses the key everywhere
+
+
+def api_key_fingerprint(api_key: str) -> str:
+    """Stable, non-reversible id for per-key state that is persisted (the key itself never is)."""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+def refused_response(url: str, status: int, label: str) -> requests.Response:
+    """A local stand-in for a response we already know the answer to."""
+    resp = requests.Response()
+    resp.status_code = status
+    resp.url = url
+    resp.reason = "Unauthorized" if status == 401 else "Forbidden"
+    resp._content = json.dumps({
+        "status": "NOT_AUTHORIZED",
+        "error": f"{label} is not available to this API key (known from plan detection, request skipped)",
+    }).encode()
+    return resp
+
+
+class CapabilityRegistry:
+    """Process-wide record of which endpoint groups each API key may use, learned from the concurrent
+    plan probe and from every real response (200 / 401 / 403). Persisted in the disk cache keyed by
+    api_key_fingerprint, so a restart does not re-probe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._probe_locks: Dict[str, threading.Lock] = collections.defaultdict(threading.Lock)
+        self._plans: Dict[str, Dict[str, Any]] = {}
+        self._verified: Dict[str, float] = {}  # fingerprint -> monotonic time of its last 200 in this process
+        self.skipped = 0
+
+    def _plan(self, fingerprint: str) -> Dict[str, Any]:
+        """In-memory plan for a fingerprint, loaded from disk on first use. Caller holds the lock."""
+        plan = self._plans.get(fingerprint)
+        if plan is None:
+            plan = {"statuses": {}, "probed_at": None}
+            cache = get_disk_cache()
+            if cache is not None:
+                try:
+                    plan = cache.get("plan_capabilities", fingerprint, {}) or plan
+                except (sqlite3.Error, ValueError, zlib.error):
+                    pass
+            self._plans[fingerprint] = plan
+        return plan
+
+    def _persist(self, fingerprint: str, plan: Dict[str, Any]) -> None:
+        cache = get_disk_cache()
+        if cache is not None:
+            try:
+                cache.set("plan_capabilities", fingerprint, {}, plan, PLAN_CAPABILITIES_TTL)
+            except sqlite3.Error:
+                pass
+
+    def status(self, api_key: str, label: str) -> Optional[int]:
+        """Last access status seen for the endpoint group (None = unknown)."""
+        with self._lock:
+            statuses = self._plan(api_key_fingerprint(api_key))["statuses"]
+            return statuses.get(ANY_ENDPOINT) or statuses.get(ENDPOINT_ENTITLEMENTS.get(label, label))
+
+    def refused_status(self, api_key: str, label: str) -> Optional[int]:
+        status = self.status(api_key, label) if label != "other" else None
+        if status in (401, 403):
+            with self._lock:
+                self.skipped += 1
+            return status
+        return None
+
+    def record(self, api_key: str, label: str, status: int) -> None:
+        fingerprint = api_key_fingerprint(api_key)
+        if status in (200, 401):
+            with self._lock:
+                if status == 200:
+                    self._verified[fingerprint] = time.monotonic()
+                else:
+                    self._verified.pop(fingerprint, None)
+        if label == "other" or status not in ACCESS_STATUSES:
+            return
+        group = ANY_ENDPOINT if status == 401 else ENDPOINT_ENTITLEMENTS.get(label, label)
+        with self._lock:
+            plan = self._plan(fingerprint)
+            if plan["statuses"].get(group) == status:
+                return
+            plan = {**plan, "statuses": {**plan["statuses"], group: status}}
+            self._plans[fingerprint] = plan
+        self._persist(fingerprint, plan)
+
+    def ensure_probed(self, api_key: str, probe: Callable[[str], Any]) -> None:
+        """Run probe(api_key) once per key (concurrent callers wait for the first) unless already known."""
+        fingerprint = api_key_fingerprint(api_key)
+        with self._lock:
+            if self._plan(fingerprint)["probed_at"]:
+                return
+            probe_lock = self._probe_locks[fingerprint]
+        with probe_lock:
+            with self._lock:
+                if self._plan(fingerprint)["probed_at"]:
+                    return
+            probe(api_key)
+            self.mark_probed(api_key)
+
+    def mark_probed(self, api_key: str) -> None:
+        fingerprint = api_key_fingerprint(api_key)
+        with self._lock:
+            plan = {**self._plan(fingerprint), "probed_at": time.time()}
+            self._plans[fingerprint] = plan
+        self._persist(fingerprint, plan)
+
+    def forget(self, api_key: str) -> None:
+        """Drop what is known about a key so the next probe starts clean (e.g. after a plan upgrade)."""
+        fingerprint = api_key_fingerprint(api_key)
+        with self._lock:
+            self._plans[fingerprint] = {"statuses": {}, "probed_at": None}
+            self._verified.pop(fingerprint, None)
+
+    def known(self, api_key: str) -> bool:
+        with self._lock:
+            return bool(self._plan(api_key_fingerprint(api_key))["probed_at"])
+
+    def tier(self, api_key: str) -> Optional[str]:
+        """Short id of the key's access to the probed endpoint groups (keys with the same entitlements, e.g.
+        real-time vs delayed trades, share one), or None while the key is unprobed, refused everywhere or has
+        not had a successful request in this process within KEY_VERIFIED_TTL.
+        """
+        fingerprint = api_key_fingerprint(api_key)
+        with self._lock:
+            plan = self._plan(fingerprint)
+            verified_at = self._verified.get(fingerprint)
+            if not plan["probed_at"] or verified_at is None or time.monotonic() - verified_at > KEY_VERIFIED_TTL:
+                return None
+            statuses = plan["statuses"]
+        if statuses.get(ANY_ENDPOINT) == 401:
+            return None
+        access = ",".join(f"{group}={statuses.get(group)}" for group in PLAN_TIER_GROUPS)
+        return hashlib.sha256(access.encode()).hexdigest()[:12]
+
+
+@per_run_resource
+@st.cache_resource(show_spinner=False)
+def get_capability_registry() -> CapabilityRegistry:
+    return CapabilityRegistry()
+
+
+def shared_scope(api_key: Optional[str]) -> Optional[str]:
+    """Partition of the shared caches (SingleFlight, disk cache, chain stores) a key reads and writes: its plan
+    tier once it is verified (see CapabilityRegistry.tier). None keeps the key off shared results, so an invalid
+    or revoked key always reaches the API and sees its own 401.
+    """
+    return get_capability_registry().tier(api_key) if api_key else None
+
+
+# -----------------------------
+# Helper / API Functions
+# -----------------------------
+
+@instrumented_cache_data("fetch_last_trade_with_fallback", ttl=300, max_entries=FETCH_CACHE_MAX_ENTRIES)
+@coalesced("last_price", ttl=quote_ttl, should_share=_price_found)
+@disk_cached("last_price", ttl=quote_ttl, should_store=_price_found, decode=_decode_price)
+def fetch_last_trade_with_fallback(ticker: str, api_key: str) -> tuple[Optional[float], Optional[str]]:
+    """Try multiple Polygon endpoints to obtain a last trade price (realtime if entitled).
+    Chain: last trade -> snapshot -> previous close; a 403 moves on to the next endpoint, and endpoints
+    the plan is known to refuse cost no request (see polygon_get). Returns (price, error_message).
+    """
+    primary_url = f"{POLYGON_BASE_URL}/v2/last/trade/{ticker.upper()}"
+    params = {"apiKey": api_key}
+
+    # 1. Primary endpoint
+    try:
+        resp = polygon_get(primary_url, params=params, timeout=10)
+        if resp.status_code == 200:
+            data = resp.json()
+            last = data.get("last", {})
+            price = last.get("price") or last.get("p")
+            if price is not None:
+                return float(price), None
+            # fall through to fallback if structure unexpected
+        elif resp.status_code != 403:  # 403 = plan without realtime trades: fall back to the snapshot
+            # For 401 provide clearer message
+            if resp.status_code == 401:
+                try:
+                    j = resp.json()
+                    err_msg = j.get("error") or j.get("message") or "Unauthorized (401)"
+                except Exception:
+                    err_msg = "Unauthorized (401) - check API key"
+                return None, f"401 fetching last trade ({ticker}): {err_msg} (Invalid / missing API key?)"
+            # Other status codes capture
+            return None, f"HTTP {resp.status_code} fetching last trade ({ticker})."
+    except requests.RequestException as e:
+        # network-level issue - continue to fallback
+        pass
+
+    # 2. Snapshot fallback
+    snapshot_url = f"{POLYGON_BASE_URL}/v2/snapshot/locale/us/markets/stocks/tickers/{ticker.upper()}"
+    try:
+        resp2 = polygon_get(snapshot_url, params=params, timeout=10)
+        if resp2.status_code == 200:
+            data2 = resp2.json()
+            # Typical structure: {"ticker": {"lastTrade": {"p": 123.45, ...}, ...}}
+            tnode = data2.get("ticker") or {}
+            last_trade = tnode.get("lastTrade") or {}
+            price = last_trade.get("price") or last_trade.get("p")
+            if price is not None:
+                return float(price), None
+            return None, f"Snapshot endpoint returned no price for {ticker}."
+        elif resp2.status_code != 403:  # 403 = snapshot not in plan: fall back to previous close
+            if resp2.status_code == 401:
+                try:
+                    j2 = resp2.json()
+                    err_msg2 = j2.get("error") or j2.get("message") or "Unauthorized (401)"
+                except Exception:
+                    err_msg2 = "Unauthorized (401)"
+                return None, f"401 snapshot ({ticker}): {err_msg2}"
+            return None, f"HTTP {resp2.status_code} snapshot for {ticker}."
+    except requests.RequestException:
+        return None, f"Network error retrieving price for {ticker}."
+
+    # 3. Previous close fallback
+    prev_price, prev_err = fetch_previous_close_price(ticker, api_key)
+    if prev_price is not None:
+        return prev_price, None
+
+    return None, prev_err or f"Price not found for {ticker} after all endpoints."
+
+
+@instrumented_cache_data("fetch_previous_close_price", ttl=600, max_entries=FETCH_CACHE_MAX_ENTRIES)
+@coalesced("previous_close", ttl=previous_close_ttl, should_share=_price_found)
+@disk_cached("previous_close", ttl=previous_close_ttl, should_store=_price_found, decode=_decode_price)
+def fetch_previous_close_price(ticker: str, api_key: str) -> tuple[Optional[float], Optional[str]]:
+    """Fetch previous close price for ticker using the Polygon prev aggregate endpoint."""
+    url = f"{POLYGON_BASE_URL}/v2/aggs/ticker/{ticker.upper()}/prev"
+    params = {"apiKey": api_key}
+    try:
+        resp = polygon_get(url, params=params, timeout=10)
+        if resp.status_code == 200:
+            data = resp.json()
+            results = data.get("results") or []
+            if results:
+                close_price = results[0].get("c")
+                if close_price is not None:
+                    return float(close_price), None
+            return None, f"Previous close not found for {ticker}."
+        else:
+            if resp.status_code in (401, 403):
+                try:
+                    j = resp.json(); msg = j.get("error") or j.get("message") or (
+                        "Unauthorized (401)" if resp.status_code == 401 else "Forbidden (403)"
+                    )
+                except Exception:
+                    msg = (
+                        "Unauthorized (401)" if resp.status_code == 401 else "Forbidden (403)"
+                    )
+                prefix = "401" if resp.status_code == 401 else "403"
+                return None, f"{prefix} previous close ({ticker}): {msg}"
+            return None, f"HTTP {resp.status_code} previous close ({ticker})."
+    except requests.RequestException:
+        return None, f"Network error previous close ({ticker})."
+
+
+STOCKS_SNAPSHOT_URL = f"{POLYGON_BASE_URL}/v2/snapshot/locale/us/markets/stocks/tickers"
+GROUPED_DAILY_URL = f"{POLYGON_BASE_URL}/v2/aggs/grouped/locale/us/market/stocks"
+BULK_SNAPSHOT_CHUNK = 250  # tickers per multi-ticker snapshot request (keeps URLs short)
+
+
+@instrumented_cache_data("fetch_bulk_snapshot_prices", ttl=300, max_entries=FETCH_CACHE_MAX_ENTRIES)
+@coalesced("bulk_snapshot", ttl=quote_ttl)
+def fetch_bulk_snapshot_prices(tickers: tuple[str, ...], api_key: str) -> Dict[str, float]:
+    """Fetch last trade prices for many tickers with the multi-ticker stocks snapshot (?tickers=A,B,C).
+    Tickers missing from the response (or from a failed chunk) are simply omitted.
+    """
+    prices: Dict[str, float] = {}
+    for start in range(0, len(tickers), BULK_SNAPSHOT_CHUNK):
+        chunk = tickers[start:start + BULK_SNAPSHOT_CHUNK]
+        try:
+            resp = polygon_get(
+                STOCKS_SNAPSHOT_URL, params={"tickers": ",".join(chunk), "apiKey": api_key}, timeout=20
+            )
+            if resp.status_code != 200:
+                continue
+            for node in resp.json().get("tickers") or []:
+                last_trade = node.get("lastTrade") or {}
+                price = last_trade.get("price") or last_trade.get("p")
+                if node.get("ticker") and price:
+                    prices[node["ticker"].upper()] = float(price)
+        except (requests.RequestException, ValueError, TypeError):
+            continue
+    return prices
+
+
+@instrumented_cache_data("fetch_grouped_previous_close", ttl=600, max_entries=FETCH_CACHE_MAX_ENTRIES)
+@coalesced("grouped_daily", ttl=previous_close_ttl)
+def fetch_grouped_previous_close(api_key: str, today: date) -> Dict[str, float]:
+    """Fetch previous close for the whole US stock market from the grouped daily aggregates endpoint.
+    Walks back from the day before today to the most recent weekday session with data (up to a week).
+    """
+    for days_back in range(1, 8):
+        session_day = today - timedelta(days=days_back)
+        if session_day.weekday() >= 5:
+            continue
+        try:
+            resp = polygon_get(
+                f"{GROUPED_DAILY_URL}/{session_day.isoformat()}",
+                params={"adjusted": "true", "apiKey": api_key},
+                timeout=30,
+            )
+            if resp.status_code in (401, 403):
+                return {}
+            if resp.status_code != 200:
+                continue
+            results = resp.json().get("results") or []
+        except (requests.RequestException, ValueError):
+            continue
+        if results:
+            return {r["T"].upper(): float(r["c"]) for r in results if r.get("T") and r.get("c")}
+    return {}
+
+
+def load_price_table(
+    tickers: List[str],
+    api_key: str,
+    price_source_mode: str = "auto",
+    today: Optional[date] = None,
+) -> Dict[str, float]:
+    """Bulk-load underlying prices for a whole watchlist in one or a few calls.
+    Fresh per-ticker disk cache entries are used first; anything still missing from the bulk
+    response is left out so process_ticker falls back to the per-ticker endpoints for it.
+    """
+    today = today or date.today()
+    endpoint = "previous_close" if price_source_mode == "previous_close" else "last_price"
+    wanted = sorted({t.upper() for t in tickers if t})
+    prices: Dict[str, float] = {}
+
+    cache = get_disk_cache()
+    if cache is not None:
+        for tk in wanted:
+            try:
+                cached = cache.get(endpoint, tk, {})
+            except (sqlite3.Error, ValueError, zlib.error):
+                cached = None
+            if cached is not None:
+                prices[tk] = float(cached[0])
+    missing = tuple(tk for tk in wanted if tk not in prices)
+    if not missing:
+        return prices
+
+    if price_source_mode == "previous_close":
+        market = fetch_grouped_previous_close(api_key, today)
+        fetched = {tk: market[tk] for tk in missing if tk in market}
+        ttl = previous_close_ttl()
+    else:
+        fetched = fetch_bulk_snapshot_prices(missing, api_key)
+        ttl = quote_ttl()
+    prices.update(fetched)
+
+    # Seed the per-ticker disk entries so fallbacks and warm restarts see the bulk prices too
+    if cache is not None:
+        for tk, price in fetched.items():
+            try:
+                cache.set(endpoint, tk, {}, [price, None], ttl)
+            except sqlite3.Error:
+                break
+    return prices
+
+
+def detect_env_api_key() -> Optional[str]:
+    """Return API key from environment if available."""
+    return os.environ.get("POLYGON_API_KEY")
+
+@instrumented_cache_data("quick_api_key_validation", ttl=120)
+def quick_api_key_validation(api_key: str) -> tuple[bool, str]:
+    """Ping a lightweight endpoint to validate key (using previous close for SPY)."""
+    if not api_key:
+        return False, "Empty API key."
+    url = f"{POLYGON_BASE_URL}/v2/aggs/ticker/SPY/prev"
+    try:
+        resp = polygon_get(url, params={"apiKey": api_key}, timeout=8)
+        if resp.status_code == 200:
+            return True, "Key valid (prev data accessible)."
+        if resp.status_code in (401, 403):
+            try:
+                j = resp.json(); msg = j.get("error") or j.get("message") or resp.reason
+            except Exception:
+                msg = resp.reason
+            return False, f"{resp.status_code} {msg}".strip()
+        return False, f"HTTP {resp.status_code} {resp.reason}"
+    except requests.RequestException as e:
+        return False, f"Network error: {e}"
+
+
+PROBE_TICKER = "AAPL"
+# (display name, probe URL) in order of importance; each maps to an endpoint_label group
+CAPABILITY_PROBES = [
+    ("Previous Close", f"{POLYGON_BASE_URL}/v2/aggs/ticker/{PROBE_TICKER}/prev"),
+    ("Last Trade", f"{POLYGON_BASE_URL}/v2/last/trade/{PROBE_TICKER}"),
+    ("Snapshot", f"{POLYGON_BASE_URL}/v2/snapshot/locale/us/markets/stocks/tickers/{PROBE_TICKER}"),
+    ("Options Contracts", f"{POLYGON_BASE_URL}/v3/reference/options/contracts?underlying_ticker={PROBE_TICKER}&contract_type=call&expired=false&limit=10"),
+    ("Options Snapshot", f"{POLYGON_BASE_URL}/v3/snapshot/options/{PROBE_TICKER}?contract_type=call&limit=10"),
+]
+PLAN_TIER_GROUPS = tuple(sorted({endpoint_label(url) for _, url in CAPABILITY_PROBES}))
+
+
+def probe_endpoint(name: str, url: str, api_key: str) -> str:
+    """Request one probe URL and describe the outcome; polygon_get records the status for routing."""
+    try:
+        resp = polygon_get(url, params={"apiKey": api_key}, timeout=10)
+        if resp.status_code == 200:
+            data = resp.json()
+            # Check if we got actual data
+            if name in ("Options Contracts", "Options Snapshot"):
+                contracts = data.get("results", [])
+                if contracts:
+                    # Check if we have bid/ask data
+                    has_quotes = bool(contracts[0].get("last_quote"))
+                    return f"✅ Available ({len(contracts)} contracts, quotes: {'Yes' if has_quotes else 'No'})"
+                return "⚠️ Endpoint works but no data returned"
+            if name == "Previous Close":
+                prev_results = data.get("results", [])
+                if prev_results:
+                    return f"✅ Available (price: ${prev_results[0].get('c', 'N/A')})"
+                return "⚠️ Endpoint works but no data"
+            return "✅ Available"
+        if resp.status_code == 403:
+            try:
+                error_msg = resp.json().get("error", "Forbidden")
+            except ValueError:
+                error_msg = "Forbidden - plan restriction"
+            return f"❌ {error_msg}"
+        if resp.status_code == 401:
+            return "❌ Unauthorized - check API key"
+        return f"❌ HTTP {resp.status_code}"
+    except Exception as e:
+        return f"❌ Error: {str(e)[:50]}"
+
+
+def probe_plan_capabilities(api_key: str) -> Dict[str, str]:
+    """Run every capability probe concurrently; returns {display name: outcome} in CAPABILITY_PROBES order."""
+    with ThreadPoolExecutor(max_workers=len(CAPABILITY_PROBES)) as pool:
+        futures = {
+            name: pool.submit(contextvars.copy_context().run, probe_endpoint, name, url, api_key)
+            for name, url in CAPABILITY_PROBES
+        }
+    return {name: fut.result() for name, fut in futures.items()}
+
+
+@instrumented_cache_data("check_polygon_plan_capabilities", ttl=300)
+def check_polygon_plan_capabilities(api_key: str) -> dict:
+    """Re-probe which Polygon endpoints are accessible with this API key and refresh the routing state."""
+    if not api_key:
+        return {"error": "No API key provided"}
+
+    registry = get_capability_registry()
+    registry.forget(api_key)
+    results = probe_plan_capabilities(api_key)
+    registry.mark_probed(api_key)
+    results[CHAIN_SOURCE_KEY] = detect_chain_source(api_key)
+    results[PRICE_SOURCE_KEY] = resolve_price_source(api_key)
+    return results
+
+
+def ensure_plan_detected(api_key: str) -> CapabilityRegistry:
+    """Probe the key's plan once (persisted for PLAN_CAPABILITIES_TTL) and return the registry."""
+    registry = get_capability_registry()
+    registry.ensure_probed(api_key, probe_plan_capabilities)
+    return registry
+
+
+def detect_chain_source(api_key: str) -> str:
+    """Prefer the snapshot chain (quotes + open interest in one stream) whenever the plan includes it."""
+    registry = ensure_plan_detected(api_key)
+    if registry.status(api_key, "options_snapshot") == 200:
+        return CHAIN_SOURCE_SNAPSHOT
+    return CHAIN_SOURCE_CONTRACTS
+
+
+def reference_source(api_key: str) -> str:
+    """Contract listings come from the contracts reference endpoint unless the plan refuses it."""
+    registry = ensure_plan_detected(api_key)
+    if registry.status(api_key, "options_contracts") in (401, 403):
+        return CHAIN_SOURCE_SNAPSHOT
+    return CHAIN_SOURCE_CONTRACTS
+
+
+def resolve_price_source(api_key: str, price_source_mode: str = "auto") -> str:
+    """"auto" becomes "previous_close" when the plan refuses both realtime endpoints (last trade and
+    snapshot), so bulk loading goes straight to grouped daily bars instead of the refused snapshot.
+    """
+    if price_source_mode != "auto" or not api_key:
+        return price_source_mode
+    registry = ensure_plan_detected(api_key)
+    realtime = [registry.status(api_key, label) for label in ("last_trade", "stocks_snapshot")]
+    return "previous_close" if all(status in (401, 403) for status in realtime) else "auto"
+
+
+OPTIONS_CONTRACTS_URL = f"{POLYGON_BASE_URL}/v3/reference/options/contracts"
+OPTIONS_SNAPSHOT_URL = f"{POLYGON_BASE_URL}/v3/snapshot/options"
+CHAIN_PAGE_LIMIT = 1000  # Polygon maximum for the contracts endpoint
+SNAPSHOT_PAGE_LIMIT = 250  # Polygon maximum for the options chain snapshot endpoint
+MAX_CHAIN_CONTRACTS = 100_000  # safety cap per chain fetch; larger chains raise ChainTooLargeError
+
+
+class ChainTooLargeError(Exception):
+    """A chain still had pages left at MAX_CHAIN_CONTRACTS: the ticker fails instead of screening a cut-off chain."""
+
+
+def _chain_filter_params(
+    expiration_gte: Optional[str],
+    expiration_lte: Optional[str],
+    strike_lt: Optional[float],
+    strike_gte: Optional[float] = None,
+    strike_lte: Optional[float] = None,
+) -> Dict[str, Any]:
+    params: Dict[str, Any] = {"contract_type": "call"}
+    if expiration_gte:
+        params["expiration_date.gte"] = expiration_gte
+    if expiration_lte:
+        params["expiration_date.lte"] = expiration_lte
+    if strike_lt is not None:
+        params["strike_price.lt"] = strike_lt
+    if strike_gte is not None:
+        params["strike_price.gte"] = strike_gte
+    if strike_lte is not None:
+        params["strike_price.lte"] = strike_lte
+    return params
+
+
+def chain_request(
+    ticker: str,
+    source: str,
+    expiration_gte: Optional[str] = None,
+    expiration_lte: Optional[str] = None,
+    strike_lt: Optional[float] = None,
+    strike_gte: Optional[float] = None,
+    strike_lte: Optional[float] = None,
+) -> tuple[str, Dict[str, Any]]:
+    """First-page URL and query params for a ticker's call chain from the given source."""
+    params = _chain_filter_params(expiration_gte, expiration_lte, strike_lt, strike_gte, strike_lte)
+    if source == CHAIN_SOURCE_SNAPSHOT:
+        params["limit"] = SNAPSHOT_PAGE_LIMIT
+        return f"{OPTIONS_SNAPSHOT_URL}/{ticker.upper()}", params
+    params.update({"underlying_ticker": ticker.upper(), "expired": "false", "limit": CHAIN_PAGE_LIMIT})
+    return OPTIONS_CONTRACTS_URL, params
+
+
+def normalize_snapshot_contract(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Flatten an options chain snapshot result into the contract shape process_ticker reads."""
+    details = item.get("details") or {}
+    return {
+        "ticker": details.get("ticker"),
+        "strike_price": details.get("strike_price"),
+        "expiration_date": details.get("expiration_date"),
+        "open_interest": item.get("open_interest"),
+        "last_quote": item.get("last_quote") or {},
+        "greeks": item.get("greeks") or {},
+        "implied_volatility": item.get("implied_volatility"),
+    }
+
+
+CHAIN_SOURCE_KEY = "Chain Source"
+PRICE_SOURCE_KEY = "Price Source"
+CHAIN_SOURCE_CONTRACTS = "contracts"
+CHAIN_SOURCE_SNAPSHOT = "snapshot"
+# Projected chain form: one list per field, the only contract fields the screener reads (plus the
+# contract symbol). Plain lists keep it JSON-serializable for the disk cache and cheap to pickle.
+CHAIN_FIELDS = ("ticker", "strike_price", "expiration_date", "open_interest", "bid")
+# The chain is cached as two layers joined on the contract symbol: the listing changes at most daily,
+# quotes and open interest all the time (see load_indexed_chain / load_chain_quotes).
+REFERENCE_FIELDS = ("ticker", "strike_price", "expiration_date")
+QUOTE_FIELDS = ("ticker", "open_interest", "bid")
+# orjson decodes a 1000-contract page ~7x faster than ijson builds it item by item; ijson (C backend
+# only) is the fallback because it never holds a whole page body in memory.
+CHAIN_DECODER = (
+    "orjson" if orjson is not None
+    else "ijson" if ijson is not None and ijson.backend in ("yajl2_c", "yajl2_cffi")
+    else "json"
+)
+
+
+def new_chain_columns(fields: tuple = CHAIN_FIELDS) -> Dict[str, List[Any]]:
+    return {field: [] for field in fields}
+
+
+def chain_size(columns: Dict[str, List[Any]]) -> int:
+    return len(columns.get("ticker") or ())
+
+
+def chain_found(columns: Dict[str, List[Any]]) -> bool:
+    return chain_size(columns) > 0
+
+
+CONTRACT_FIELD_GETTERS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "ticker": lambda c: c.get("ticker"),
+    "strike_price": lambda c: c.get("strike_price") or c.get("strike"),
+    "expiration_date": lambda c: c.get("expiration_date") or c.get("expiration"),
+    "open_interest": lambda c: c.get("open_interest") or c.get("oi"),
+    "bid": lambda c: extract_bid(c),
+}
+
+
+def project_contract(contract: Dict[str, Any], out: Dict[str, List[Any]]) -> None:
+    """Append one contracts-endpoint record to projected columns (whichever fields out holds), with the
+    same field fallbacks (and falsy-value handling) that chain_to_columns applies to full records.
+    """
+    for field, values in out.items():
+        values.append(CONTRACT_FIELD_GETTERS[field](contract))
+
+
+def project_snapshot_item(item: Dict[str, Any], out: Dict[str, List[Any]]) -> None:
+    project_contract(normalize_snapshot_contract(item), out)
+
+
+def _stream_chain_page(raw: Any, out: Dict[str, List[Any]], project: Callable) -> Optional[str]:
+    """Parse a page incrementally with ijson: each results item is built, projected and dropped
+    before the next one is read. Returns the page's next_url.
+    """
+    next_url = None
+    builder = None
+    for prefix, event, value in ijson.parse(raw, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == "results.item" and event == "end_map":
+                project(builder.value, out)
+                builder = None
+        elif prefix == "results.item" and event == "start_map":
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+        elif prefix == "next_url" and event == "string":
+            next_url = value
+    return next_url
+
+
+def decode_chain_page(
+    resp: requests.Response, out: Dict[str, List[Any]], project: Callable, decoder: str
+) -> Optional[str]:
+    """Append a page's projected contracts to out and return its next_url.
+    "ijson" streams from the unread body of a stream=True response; "orjson" / "json" decode the
+    whole (<= 1000 contract) page first and project it.
+    """
+    if decoder == "ijson":
+        resp.raw.decode_content = True  # let urllib3 gunzip while ijson reads
+        return _stream_chain_page(resp.raw, out, project)
+    data = orjson.loads(resp.content) if decoder == "orjson" else resp.json()
+    for item in data.get("results") or ():
+        project(item, out)
+    return data.get("next_url")
+
+
+def fetch_projected_chain(
+    url: str,
+    params: Dict[str, Any],
+    api_key: str,
+    project: Callable,
+    ticker: str = "",
+    fields: tuple = CHAIN_FIELDS,
+) -> Dict[str, List[Any]]:
+    """Download every page of a chain (following next_url for up to MAX_CHAIN_CONTRACTS contracts) into
+    projected columns. When streaming, chain_download covers the response headers and chain_parse the body.
+    Raises requests exceptions on HTTP / network errors and ChainTooLargeError past the cap.
+    """
+    out = new_chain_columns(fields)
+    decoder = CHAIN_DECODER
+    max_pages = -(-MAX_CHAIN_CONTRACTS // int(params.get("limit") or CHAIN_PAGE_LIMIT))
+    params = {**params, "apiKey": api_key}
+    for _ in range(max_pages):
+        with timed_stage(ticker, "chain_download"):
+            resp = polygon_get(url, params=params, timeout=20, stream=decoder == "ijson")
+        try:
+            resp.raise_for_status()
+            with timed_stage(ticker, "chain_parse"):
+                next_url = decode_chain_page(resp, out, project, decoder)
+        finally:
+            resp.close()
+        if not next_url:
+            return out
+        # next_url already carries the cursor and filters, only the key must be re-sent
+        url, params = next_url, {"apiKey": api_key}
+    raise ChainTooLargeError(
+        f"Option chain has more than {MAX_CHAIN_CONTRACTS:,} calls in this window; narrow the DTE range."
+    )
+
+
+CHAIN_PROJECTIONS = {
+    CHAIN_SOURCE_CONTRACTS: project_contract,
+    CHAIN_SOURCE_SNAPSHOT: project_snapshot_item,
+}
+
+
+@instrumented_cache_data("fetch_contract_reference", ttl=3600, max_entries=FETCH_CACHE_MAX_ENTRIES)
+@coalesced("chain_reference", ttl=reference_ttl, should_share=chain_found)
+@disk_cached("chain_reference", ttl=reference_ttl, should_store=chain_found)
+def fetch_contract_reference(
+    ticker: str,
+    api_key: str,
+    expiration_gte: Optional[str] = None,
+    expiration_lte: Optional[str] = None,
+    source: str = CHAIN_SOURCE_CONTRACTS,
+    with_quotes: bool = False,
+) -> Dict[str, List[Any]]:
+    """Listing layer of a chain: symbol, strike and expiration (REFERENCE_FIELDS) of every non-expired call
+    in the expiration window, all strikes. Valid until the next trading day (reference_ttl).
+    with_quotes also keeps the open interest and bid the records carry (CHAIN_FIELDS) plus "quotes_until", the
+    epoch time they stop being fresh, for when the listing source is the quote source too (see load_indexed_chain).
+    Returns empty columns on error rather than a silently truncated listing; raises ChainTooLargeError.
+    """
+    url, params = chain_request(ticker, source, expiration_gte, expiration_lte)
+    project = CHAIN_PROJECTIONS.get(source, project_contract)
+    fields = CHAIN_FIELDS if with_quotes else REFERENCE_FIELDS
+    try:
+        listing = fetch_projected_chain(url, params, api_key, project, ticker.upper(), fields)
+    except ChainTooLargeError:
+        raise
+    except Exception:
+        return new_chain_columns(REFERENCE_FIELDS)
+    if with_quotes:
+        listing["quotes_until"] = [time.time() + quote_ttl()]
+    return listing
+
+
+@instrumented_cache_data("fetch_chain_quotes", ttl=300, max_entries=FETCH_CACHE_MAX_ENTRIES)
+@coalesced("chain_quotes", ttl=quote_ttl, should_share=chain_found)
+@disk_cached("chain_quotes", ttl=quote_ttl, should_store=chain_found)
+def fetch_chain_quotes(
+    ticker: str,
+    api_key: str,
+    expiration_gte: str,
+    expiration_lte: str,
+    strike_gte: float,
+    strike_lte: float,
+    source: str = CHAIN_SOURCE_SNAPSHOT,
+) -> Dict[str, List[Any]]:
+    """Quote layer of a chain: symbol, open interest and bid (QUOTE_FIELDS) for the calls inside an
+    expiration x strike rectangle, from the options chain snapshot (or, on plans without it, the contracts
+    endpoint, whose records are the only quotes such plans get). Fresh for quote_ttl.
+    Returns empty columns on error; raises ChainTooLargeError.
+    """
+    url, params = chain_request(
+        ticker, source, expiration_gte, expiration_lte, strike_gte=strike_gte, strike_lte=strike_lte
+    )
+    project = CHAIN_PROJECTIONS.get(source, project_contract)
+    try:
+        return fetch_projected_chain(url, params, api_key, project, ticker.upper(), QUOTE_FIELDS)
+    except ChainTooLargeError:
+        raise
+    except Exception:
+        return new_chain_columns(QUOTE_FIELDS)
+
+
+REFERENCE_ENDPOINTS = ("chain_reference",)  # day-scoped layers a refresh keeps
+
+
+def extract_bid(contract: Dict[str, Any]) -> Optional[float]:
+    """Attempt to extract the bid price from various plausible locations in the contract payload.
+    Returns None if not available.
+    """
+    # Potential key paths observed/anticipated
+    candidates = []
+    last_quote = contract.get("last_quote") or contract.get("last_quote_detail") or {}
+    if isinstance(last_quote, dict):
+        candidates.extend([
+            last_quote.get("bid"),
+            last_quote.get("bid_price"),
+            last_quote.get("p_bid"),  # arbitrary fallback
+        ])
+    # Some Polygon structures might nest deeper or use short keys; extend here if needed.
+    for val in candidates:
+        if val is not None:
+            try:
+                v = float(val)
+                if v > 0:
+                    return v
+            except (TypeError, ValueError):
+                continue
+    return None
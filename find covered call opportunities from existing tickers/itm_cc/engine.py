@@ -0,0 +1,1254 @@
+"""Screening engine: options analytics, the columnar metric kernel, the indexed chain store, concurrent
+execution, result formatting and the scenario sweep.
+"""
+
+from datetime import datetime, date
+from typing import List, Dict, Any, Optional, Iterator, Callable, NamedTuple
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+import contextvars
+import heapq
+import itertools
+import sqlite3
+import threading
+import time
+import collections
+import re
+import os
+
+import streamlit as st
+import pandas as pd
+import numpy as np
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from .client import (
+    REFERENCE_ENDPOINTS, REFERENCE_FIELDS, chain_found, detect_chain_source, extract_bid, fetch_bulk_snapshot_prices,
+    fetch_chain_quotes, fetch_contract_reference, fetch_grouped_previous_close, fetch_last_trade_with_fallback,
+    fetch_previous_close_price, get_disk_cache, get_single_flight, load_price_table, per_run_resource, quote_ttl,
+    record_cache_event, reference_source, reference_ttl, resolve_price_source, shared_scope, timed_stage,
+)
+from .history import flush_history, record_history
+
+
+# -----------------------------
+# Options Analytics
+# -----------------------------
+
+RISK_FREE_RATE = float(os.environ.get("ITM_CC_RISK_FREE_RATE", "0.045"))  # annual, continuously compounded
+ANALYTICS_COLUMNS = ["IV %", "Delta", "Prob. Assignment %", "Expected Return %"]
+
+
+def norm_cdf(x: np.ndarray) -> np.ndarray:
+    """Standard normal CDF for arrays (complementary error function approximation, relative error < 1.2e-7)."""
+    z = np.abs(x) / np.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.5 * z)
+    poly = -1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 + t * (-0.18628806 + t * (
+        0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (-0.82215223 + t * 0.17087277))))))))
+    erfc = t * np.exp(-z * z + poly)
+    return np.where(x >= 0, 1.0 - 0.5 * erfc, 0.5 * erfc)
+
+
+def _d1_d2(
+    stock_price: np.ndarray, strike: np.ndarray, years: np.ndarray, rate: float, sigma: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    vol_t = sigma * np.sqrt(years)
+    d1 = (np.log(stock_price / strike) + (rate + 0.5 * sigma * sigma) * years) / vol_t
+    return d1, d1 - vol_t
+
+
+def bs_call_price(
+    stock_price: np.ndarray, strike: np.ndarray, years: np.ndarray, rate: float, sigma: np.ndarray
+) -> np.ndarray:
+    """Black-Scholes price of a European call (no dividends, so also the American call value)."""
+    d1, d2 = _d1_d2(stock_price, strike, years, rate, sigma)
+    return stock_price * norm_cdf(d1) - strike * np.exp(-rate * years) * norm_cdf(d2)
+
+
+def implied_volatility(
+    price: np.ndarray,
+    stock_price: np.ndarray,
+    strike: np.ndarray,
+    years: np.ndarray,
+    rate: float,
+    tol: float = 1e-6,
+    max_iter: int = 60,
+) -> np.ndarray:
+    """Solve Black-Scholes implied volatility for every call at once.
+    Safeguarded Newton: each contract keeps a [lo, hi] bracket and falls back to bisection whenever the Newton
+    step leaves it (deep ITM calls have almost no vega). Only unconverged contracts are re-evaluated each pass.
+    NaN where the price is outside the no-arbitrage bounds (e.g. a bid below intrinsic value) or T <= 0.
+    """
+    price, stock_price, strike, years = (
+        np.array(a, dtype=float) for a in np.broadcast_arrays(price, stock_price, strike, years)
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lower = np.maximum(stock_price - strike * np.exp(-rate * years), 0.0)
+        solvable = (years > 0) & (price > lower) & (price < stock_price)
+        # Brenner-Subrahmanyam style start from the time value
+        sigma = np.clip(np.sqrt(2.0 * np.pi / years) * (price - lower) / stock_price, 0.05, 3.0)
+    sigma[~solvable] = np.nan
+    lo = np.full(price.shape, 1e-4)
+    hi = np.full(price.shape, 10.0)
+    converged = np.zeros(price.shape, dtype=bool)
+    active = np.flatnonzero(solvable)
+    for _ in range(max_iter):
+        if active.size == 0:
+            break
+        s, k, t, sig = stock_price[active], strike[active], years[active], sigma[active]
+        d1, d2 = _d1_d2(s, k, t, rate, sig)
+        diff = s * norm_cdf(d1) - k * np.exp(-rate * t) * norm_cdf(d2) - price[active]
+        vega = s * np.sqrt(t) * np.exp(-0.5 * d1 * d1) / np.sqrt(2.0 * np.pi)
+        lo_a = np.where(diff < 0, sig, lo[active])
+        hi_a = np.where(diff > 0, sig, hi[active])
+        done = (np.abs(diff) < tol) | (hi_a - lo_a < 1e-10)
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            newton = sig - diff / vega
+        bisect = ~np.isfinite(newton) | (newton <= lo_a) | (newton >= hi_a)
+        sigma[active] = np.where(done, sig, np.where(bisect, 0.5 * (lo_a + hi_a), newton))
+        lo[active], hi[active] = lo_a, hi_a
+        converged[active[done]] = True
+        active = active[~done]
+    return np.where(converged, sigma, np.nan)
+
+
+def option_analytics(
+    stock_price: Any,
+    strike: np.ndarray,
+    dte: np.ndarray,
+    premium: np.ndarray,
+    rate: float = RISK_FREE_RATE,
+    reference_vol: Any = None,
+    iv: Optional[np.ndarray] = None,
+) -> Dict[str, np.ndarray]:
+    """Risk view of selling each call at its bid against 100 shares, for whole arrays of contracts:
+    - IV %: implied volatility at the bid (NaN when the bid is below the no-arbitrage bound)
+    - Delta: N(d1) and Prob. Assignment %: N(d2), the risk-neutral chance of finishing in the money
+      (early exercise ignored), both at the contract's own IV
+    - Expected Return %: (E[min(S_T, K)] + premium - S) / S to expiration with
+      E[min(S_T, K)] = S e^(rT) N(-d1) + K N(d2) evaluated at reference_vol, the underlying's typical IV
+      (default: median IV of the given contracts, i.e. one ticker). Against its own IV every contract would
+      just earn the risk-free rate; against the reference vol, rich bids show up as higher expected returns.
+    iv skips the solve when the implied volatilities are already known.
+    """
+    strike = np.asarray(strike, dtype=float)
+    stock_price = np.broadcast_to(np.asarray(stock_price, dtype=float), strike.shape)
+    premium = np.asarray(premium, dtype=float)
+    years = np.asarray(dte, dtype=float) / 365.0
+    if iv is None:
+        iv = implied_volatility(premium, stock_price, strike, years, rate)
+    if reference_vol is None:
+        reference_vol = np.nanmedian(iv) if np.isfinite(iv).any() else np.nan
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        d1, d2 = _d1_d2(stock_price, strike, years, rate, iv)
+        ref_d1, ref_d2 = _d1_d2(stock_price, strike, years, rate, np.asarray(reference_vol, dtype=float))
+        capped_stock = stock_price * np.exp(rate * years) * norm_cdf(-ref_d1) + strike * norm_cdf(ref_d2)
+        expected_return = (capped_stock + premium - stock_price) / stock_price * 100.0
+    unsolved = np.isnan(iv)
+    return {
+        "IV %": iv * 100.0,
+        "Delta": np.where(unsolved, np.nan, norm_cdf(d1)),
+        "Prob. Assignment %": np.where(unsolved, np.nan, norm_cdf(d2) * 100.0),
+        "Expected Return %": np.where(np.isnan(ref_d1), np.nan, expected_return),
+    }
+
+
+def add_analytics_columns(df: pd.DataFrame, rate: float = RISK_FREE_RATE) -> pd.DataFrame:
+    """Recompute the analytics columns of a result frame (e.g. for another risk-free rate) without refetching.
+    The expected-return reference volatility is each ticker's median IV, as in compute_opportunities.
+    """
+    out = df.copy()
+    stock_price = df["Stock Price"].to_numpy(float)
+    strike = df["Strike"].to_numpy(float)
+    dte = df["DTE"].to_numpy(float)
+    premium = df["Premium"].to_numpy(float)
+    iv = implied_volatility(premium, stock_price, strike, dte / 365.0, rate)
+    reference_vol = pd.Series(iv, index=df.index).groupby(df["Ticker"]).transform("median").to_numpy(float)
+    values = option_analytics(stock_price, strike, dte, premium, rate, reference_vol, iv=iv)
+    for col in ANALYTICS_COLUMNS:
+        out[col] = values[col]
+    return out
+
+
+def add_analytics_records(rows: List[Dict[str, Any]], rate: float = RISK_FREE_RATE) -> List[Dict[str, Any]]:
+    """Fill the analytics columns of opportunity dicts in place with one solve over all of them (the reference
+    volatility stays per ticker, as in add_analytics_columns). Returns rows.
+    """
+    if not rows:
+        return rows
+    frame = pd.DataFrame.from_records(rows, columns=["Ticker", "Stock Price", "Strike", "DTE", "Premium"])
+    solved = add_analytics_columns(frame, rate)
+    for col in ANALYTICS_COLUMNS:
+        for row, value in zip(rows, solved[col].tolist()):
+            row[col] = value
+    return rows
+
+
+# -----------------------------
+# Processing Logic
+# -----------------------------
+
+def process_ticker(
+    ticker: str,
+    api_key: str,
+    dte_min: int,
+    dte_max: int,
+    min_oi: int,
+    today: date,
+    min_premium: float = 0.0,
+    min_annualized_roi: float = 0.0,
+    price_source_mode: str = "auto",
+    chain_source: str = "auto",
+    price_table: Optional[Dict[str, float]] = None,
+) -> List[Dict[str, Any]]:
+    """Process one ticker and return list of opportunity dicts (analytics columns not solved yet, see
+    compute_opportunities).
+    chain_source is "contracts", "snapshot" or "auto" (use the snapshot when the plan includes it).
+    price_table holds bulk-loaded prices (see load_price_table); tickers missing from it use per-ticker endpoints.
+    """
+    tk = ticker.upper()
+    # Get stock price
+    with timed_stage(tk, "price"):
+        if price_table and tk in price_table:
+            stock_price, price_err = price_table[tk], None
+        elif price_source_mode == "previous_close":
+            stock_price, price_err = fetch_previous_close_price(ticker, api_key)
+        else:  # auto
+            stock_price, price_err = fetch_last_trade_with_fallback(ticker, api_key)
+    if stock_price is None or stock_price <= 0:
+        raise ValueError(price_err or f"Could not get valid last trade price for {ticker}.")
+
+    # Contract listing for the DTE window (day-scoped, reused from the chain store), then quotes for just
+    # the contracts that survive the DTE and ITM filters
+    if chain_source == "auto":
+        chain_source = detect_chain_source(api_key)
+    with timed_stage(tk, "chain"):
+        chain = load_indexed_chain(
+            ticker, api_key, reference_source(api_key),
+            exp_lo=today.toordinal() + max(dte_min, 0),
+            exp_hi=today.toordinal() + dte_max,
+            quote_source=chain_source,
+        )
+    if chain is None:
+        raise ValueError(f"No option contracts retrieved for {ticker}.")
+    rows = chain.select(today, dte_min, dte_max, stock_price)
+    with timed_stage(tk, "quotes"):
+        quotes = load_chain_quotes(ticker, api_key, chain_source, chain, rows)
+    if quotes is None:
+        raise ValueError(f"No option quotes retrieved for {ticker}.")
+
+    record_history(tk, stock_price, quotes.columns, rows)
+
+    with timed_stage(tk, "filter"):
+        return compute_opportunities(
+            ticker, stock_price, quotes.columns, today, dte_min, dte_max, min_oi,
+            min_premium=min_premium, min_annualized_roi=min_annualized_roi,
+            rows=rows,
+        )
+
+
+# -----------------------------
+# Columnar Metric Kernel
+# -----------------------------
+
+def _float_column(values: List[Any]) -> np.ndarray:
+    """List of numbers / None -> float array with NaN for missing or unparseable values."""
+    try:
+        return np.array(values, dtype=float)  # None becomes NaN
+    except (TypeError, ValueError):
+        out = np.full(len(values), np.nan)
+        for i, v in enumerate(values):
+            try:
+                out[i] = float(v)
+            except (TypeError, ValueError):
+                continue
+        return out
+
+
+def projected_to_columns(chain: Dict[str, List[Any]]) -> Dict[str, np.ndarray]:
+    """chain_to_columns for projected chains (see fetch_projected_chain): whole-column conversions,
+    with expirations parsed once per distinct date. A listing without quote fields (REFERENCE_FIELDS)
+    gives strike / exp_ordinal / valid only; the contract symbols are kept as a "symbol" column.
+    """
+    strike = _float_column(chain["strike_price"])
+    parsed_dates: Dict[Any, int] = {}
+    exp_ordinal = np.zeros(len(strike), dtype=np.int64)
+    for i, expiration in enumerate(chain["expiration_date"]):
+        ordinal = parsed_dates.get(expiration)
+        if ordinal is None:
+            try:
+                ordinal = datetime.strptime(expiration[:10], "%Y-%m-%d").date().toordinal()
+            except (TypeError, ValueError):
+                ordinal = 0
+            parsed_dates[expiration] = ordinal
+        exp_ordinal[i] = ordinal
+    valid = ~np.isnan(strike) & (exp_ordinal > 0)
+    open_interest = _float_column(chain["open_interest"]) if "open_interest" in chain else None
+    if open_interest is not None:
+        valid &= ~np.isnan(open_interest)
+    # Invalid rows carry the same fill values as the per-contract path
+    columns = {
+        "strike": np.where(valid, strike, np.nan),
+        "exp_ordinal": np.where(valid, exp_ordinal, 0),
+        "valid": valid,
+    }
+    if open_interest is not None:
+        columns["open_interest"] = np.where(valid, open_interest, 0).astype(np.int64)
+    if "bid" in chain:
+        columns["bid"] = np.where(valid, _float_column(chain["bid"]), np.nan)
+    if "ticker" in chain:
+        columns["symbol"] = np.array(chain["ticker"], dtype=object)
+    return columns
+
+
+def chain_to_columns(contracts: Any) -> Dict[str, np.ndarray]:
+    """Normalize contract dicts into typed NumPy columns in a single pass.
+    Rows with missing / unparseable strike, expiration or open interest get valid=False,
+    matching the contracts the per-contract loop used to skip. Expirations are stored as
+    proleptic ordinals (date.toordinal) so DTE is a plain integer subtraction.
+    Projected chains (dict of field lists from fetch_projected_chain) take the column-wise path.
+    """
+    if isinstance(contracts, dict):
+        return projected_to_columns(contracts)
+    n = len(contracts)
+    strike = np.full(n, np.nan)
+    exp_ordinal = np.zeros(n, dtype=np.int64)
+    open_interest = np.zeros(n, dtype=np.int64)
+    bid = np.full(n, np.nan)
+    valid = np.zeros(n, dtype=bool)
+    symbol = np.empty(n, dtype=object)
+    parsed_dates: Dict[str, int] = {}  # expirations repeat heavily; parse each string once
+
+    for i, contract in enumerate(contracts):
+        try:
+            symbol[i] = contract.get("ticker")
+            k = contract.get("strike_price") or contract.get("strike")
+            expiration = contract.get("expiration_date") or contract.get("expiration")
+            oi = contract.get("open_interest") or contract.get("oi")
+            if k is None or expiration is None or oi is None:
+                continue  # missing critical fields
+            key = expiration[:10]
+            ordinal = parsed_dates.get(key)
+            if ordinal is None:
+                ordinal = datetime.strptime(key, "%Y-%m-%d").date().toordinal()
+                parsed_dates[key] = ordinal
+            strike[i] = float(k)
+            open_interest[i] = int(oi)
+            exp_ordinal[i] = ordinal
+            b = extract_bid(contract)
+            if b is not None:
+                bid[i] = b
+            valid[i] = True
+        except Exception:
+            continue
+
+    return {
+        "strike": strike,
+        "exp_ordinal": exp_ordinal,
+        "open_interest": open_interest,
+        "bid": bid,
+        "valid": valid,
+        "symbol": symbol,
+    }
+
+
+def covered_call_metrics(stock_price: Any, strike: Any, premium: Any, dte: Any) -> Dict[str, Any]:
+    """Per-share covered call metrics for selling calls at premium against shares bought at stock_price
+    (scalars, arrays or Series). Shared by compute_opportunities and live repricing (apply_live_quotes).
+    """
+    breakeven = stock_price - premium
+    downside_protection_pct = (stock_price - breakeven) / stock_price * 100.0
+    # Profit if assigned at expiration (per 100 shares)
+    profit_assigned = (strike * 100) - (stock_price * 100) + (premium * 100)
+    return_if_assigned_pct = (profit_assigned / (stock_price * 100)) * 100.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        annualized_roi_pct = return_if_assigned_pct * (365.0 / dte)
+    return {
+        "Return if Assigned %": return_if_assigned_pct,
+        "Breakeven": breakeven,
+        "Downside Protection %": downside_protection_pct,
+        "Annualized ROI %": annualized_roi_pct,
+    }
+
+
+def compute_opportunities(
+    ticker: str,
+    stock_price: float,
+    columns: Dict[str, np.ndarray],
+    today: date,
+    dte_min: int,
+    dte_max: int,
+    min_oi: int,
+    min_premium: float = 0.0,
+    min_annualized_roi: float = 0.0,
+    rows: Optional[np.ndarray] = None,
+) -> List[Dict[str, Any]]:
+    """Compute metrics for a whole chain as array operations and apply every filter as a boolean mask.
+    Produces the same rows, in the same order, as evaluating each contract individually.
+    rows limits the work to candidate row indices (e.g. from IndexedChain.select).
+    The analytics columns are left NaN: the implied volatility solve has a fixed cost per call, so it runs once
+    over a whole screen's rows (add_analytics_records / iter_with_analytics) instead of once per ticker.
+    """
+    if rows is not None:
+        columns = {k: v[rows] for k, v in columns.items()}
+    strike = columns["strike"]
+    bid = columns["bid"]
+    open_interest = columns["open_interest"]
+    dte = columns["exp_ordinal"] - today.toordinal()
+
+    premium = bid  # premium per share
+    metrics = covered_call_metrics(stock_price, strike, premium, dte)
+    annualized_roi_pct = metrics["Annualized ROI %"]
+
+    # Negated comparisons keep NaN handling identical to the scalar "skip if" checks
+    mask = (
+        columns["valid"]
+        & (dte > 0)  # expired and 0 DTE contracts are skipped
+        & (dte >= dte_min)
+        & (dte <= dte_max)
+        & ~(strike >= stock_price)  # ITM: strike below current stock price
+        & ~(open_interest < min_oi)
+        & (bid > 0)  # NaN (no usable bid) compares False
+        & ~(premium < min_premium)
+        & ~(annualized_roi_pct < min_annualized_roi)
+    )
+    idx = np.flatnonzero(mask)
+    if idx.size == 0:
+        return []
+
+    iso_dates: Dict[int, str] = {}
+    expirations = []
+    for ordinal in columns["exp_ordinal"][idx].tolist():
+        iso = iso_dates.get(ordinal)
+        if iso is None:
+            iso = date.fromordinal(ordinal).isoformat()
+            iso_dates[ordinal] = iso
+        expirations.append(iso)
+
+    symbols = columns["symbol"][idx].tolist() if "symbol" in columns else [None] * idx.size
+    tk = ticker.upper()
+    return [
+        {
+            "Ticker": tk,
+            "Stock Price": stock_price,
+            "Strike": k,
+            "Expiration": exp,
+            "DTE": d,
+            "Premium": p,
+            "Return if Assigned %": r,
+            "Breakeven": be,
+            "Downside Protection %": dp,
+            "Annualized ROI %": a,
+            "Open Interest": oi,
+            **dict.fromkeys(ANALYTICS_COLUMNS, float("nan")),
+            "Contract": sym,
+        }
+        for k, exp, d, p, r, be, dp, a, oi, sym in zip(
+            strike[idx].tolist(),
+            expirations,
+            dte[idx].tolist(),
+            premium[idx].tolist(),
+            metrics["Return if Assigned %"][idx].tolist(),
+            metrics["Breakeven"][idx].tolist(),
+            metrics["Downside Protection %"][idx].tolist(),
+            annualized_roi_pct[idx].tolist(),
+            open_interest[idx].tolist(),
+            symbols,
+        )
+    ]
+
+
+# -----------------------------
+# Indexed Chain Store
+# -----------------------------
+
+CHAIN_STORE_MAX_ENTRIES = 2048
+
+
+class IndexedChain:
+    """One ticker's contract listing normalized once into read-only columns sorted by (expiration, strike).
+    Remembers the window it was fetched with (expiration ordinals exp_lo..exp_hi, strikes below strike_lt)
+    so a query can tell whether the stored contracts cover it. Quotes live in a separate ChainQuotes layer.
+    """
+
+    __slots__ = ("columns", "exp_values", "exp_starts", "exp_ends", "exp_lo", "exp_hi", "strike_lt", "expires_at")
+
+    def __init__(
+        self, columns: Dict[str, np.ndarray], exp_lo: int, exp_hi: int, strike_lt: float = np.inf, ttl: float = 0.0
+    ):
+        keep = columns["valid"]
+        order = np.lexsort((columns["strike"][keep], columns["exp_ordinal"][keep]))
+        self.columns = {k: v[keep][order] for k, v in columns.items()}
+        for col in self.columns.values():
+            col.flags.writeable = False  # shared between sessions and threads
+        exp_ordinal = self.columns["exp_ordinal"]
+        self.exp_values, self.exp_starts = np.unique(exp_ordinal, return_index=True)
+        self.exp_ends = np.append(self.exp_starts[1:], len(exp_ordinal))
+        self.exp_lo = exp_lo
+        self.exp_hi = exp_hi
+        self.strike_lt = strike_lt
+        self.expires_at = time.monotonic() + ttl
+
+    def __len__(self) -> int:
+        return len(self.columns["strike"])
+
+    def covers(self, exp_lo: int, exp_hi: int, stock_price: float) -> bool:
+        return self.exp_lo <= exp_lo and exp_hi <= self.exp_hi and stock_price <= self.strike_lt
+
+    def select(self, today: date, dte_min: int, dte_max: int, stock_price: float) -> np.ndarray:
+        """Row indices with dte_min <= DTE <= dte_max (and DTE > 0) and strike < stock_price.
+        Binary search for the expiration range, then per expiration for the ITM strike cut-off.
+        """
+        base = today.toordinal()
+        first = np.searchsorted(self.exp_values, base + max(dte_min, 1), side="left")
+        last = np.searchsorted(self.exp_values, base + dte_max, side="right")
+        strike = self.columns["strike"]
+        pieces = []
+        for start, end in zip(self.exp_starts[first:last].tolist(), self.exp_ends[first:last].tolist()):
+            stop = start + int(np.searchsorted(strike[start:end], stock_price, side="left"))
+            if stop > start:
+                pieces.append(np.arange(start, stop))
+        return np.concatenate(pieces) if pieces else np.empty(0, dtype=np.int64)
+
+
+class ChainQuotes:
+    """Quote layer of one IndexedChain: open interest and bid aligned with its rows, and which rows have been
+    quoted. columns is the chain's columns with these filled in, ready for compute_opportunities (unquoted
+    rows are invalid). Never modified once built: load_chain_quotes merges new quotes into a copy.
+    """
+
+    __slots__ = ("chain", "open_interest", "bid", "quoted", "columns", "expires_at")
+
+    def __init__(
+        self, chain: IndexedChain, open_interest: np.ndarray, bid: np.ndarray, quoted: np.ndarray, expires_at: float
+    ):
+        self.chain = chain
+        self.open_interest = open_interest
+        self.bid = bid
+        self.quoted = quoted
+        valid = chain.columns["valid"] & quoted & ~np.isnan(open_interest)
+        self.columns = {
+            **chain.columns,
+            "open_interest": np.where(valid, open_interest, 0).astype(np.int64),
+            "bid": np.where(valid, bid, np.nan),
+            "valid": valid,
+        }
+        self.expires_at = expires_at
+
+    def __len__(self) -> int:
+        return int(self.quoted.sum())
+
+    def covers(self, rows: np.ndarray) -> bool:
+        return bool(self.quoted[rows].all())
+
+
+class ChainStore:
+    """Process-wide store of chain layers (IndexedChain listings or ChainQuotes) keyed by ticker and
+    "source:plan tier" (see shared_scope). Entries are shared, never copied, expire at their expires_at and
+    the least recently used ones are dropped beyond max_entries.
+    """
+
+    def __init__(self, max_entries: int = CHAIN_STORE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "collections.OrderedDict[tuple[str, str], IndexedChain]" = collections.OrderedDict()
+
+    def get(self, ticker: str, source: str) -> Optional[IndexedChain]:
+        key = (ticker.upper(), source)
+        with self._lock:
+            chain = self._entries.get(key)
+            if chain is None:
+                return None
+            if chain.expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return chain
+
+    def put(self, ticker: str, source: str, chain: IndexedChain) -> None:
+        with self._lock:
+            self._entries[(ticker.upper(), source)] = chain
+            self._entries.move_to_end((ticker.upper(), source))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tickers: List[str]) -> None:
+        upper = {t.upper() for t in tickers}
+        with self._lock:
+            for key in [k for k in self._entries if k[0] in upper]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "contracts": sum(len(c) for c in self._entries.values())}
+
+
+@per_run_resource
+@st.cache_resource(show_spinner=False)
+def get_chain_store() -> ChainStore:
+    return ChainStore()
+
+
+@per_run_resource
+@st.cache_resource(show_spinner=False)
+def get_quote_store() -> ChainStore:
+    return ChainStore()
+
+
+def invalidate_ticker_data(tickers: List[str]) -> None:
+    """Force the next screen of these tickers to re-pull what changes: drops their price and quote entries
+    from the disk, shared and in-memory caches (st.cache_data can only be cleared per function, not per
+    ticker) but keeps the contract listings, so a refresh only fetches quotes for the surviving contracts.
+    """
+    cache = get_disk_cache()
+    if cache is not None:
+        try:
+            cache.invalidate(tickers, keep=REFERENCE_ENDPOINTS)
+        except sqlite3.Error:
+            pass
+    get_quote_store().invalidate(tickers)
+    get_single_flight().invalidate(tickers, keep=REFERENCE_ENDPOINTS)
+    for helper in (
+        fetch_last_trade_with_fallback,
+        fetch_previous_close_price,
+        fetch_bulk_snapshot_prices,
+        fetch_grouped_previous_close,
+        fetch_chain_quotes,
+    ):
+        helper.clear()
+
+
+def load_indexed_chain(
+    ticker: str, api_key: str, source: str, exp_lo: int, exp_hi: int, quote_source: Optional[str] = None
+) -> Optional[IndexedChain]:
+    """Stored contract listing covering the expiration window (all strikes), fetching (and storing) it when
+    needed. A refetch asks for the union of the stored and the requested window, so alternating slider values
+    settle on one entry. Listings stay until the next trading day. Returns None when nothing was retrieved.
+    When quote_source is the listing's own source, the quotes its records carry seed the quote layer, so
+    load_chain_quotes only goes back to the endpoint once they are stale. Stored layers are shared within the
+    key's plan tier (shared_scope).
+    """
+    store = get_chain_store()
+    record_cache_event("chain_store", "calls")
+    scope = shared_scope(api_key)
+    chain = store.get(ticker, f"{source}:{scope}") if scope is not None else None
+    if chain is not None and chain.covers(exp_lo, exp_hi, 0.0):
+        return chain
+    record_cache_event("chain_store", "misses")
+    if chain is not None:
+        exp_lo, exp_hi = min(exp_lo, chain.exp_lo), max(exp_hi, chain.exp_hi)
+    listing = fetch_contract_reference(
+        ticker, api_key,
+        expiration_gte=date.fromordinal(exp_lo).isoformat(),
+        expiration_lte=date.fromordinal(exp_hi).isoformat(),
+        source=source,
+        with_quotes=quote_source == source,
+    )
+    if not chain_found(listing):
+        return None
+    scope = shared_scope(api_key)
+    with timed_stage(ticker.upper(), "normalize"):
+        chain = IndexedChain(
+            projected_to_columns({field: listing[field] for field in REFERENCE_FIELDS}), exp_lo, exp_hi,
+            ttl=reference_ttl(),
+        )
+    if scope is not None:
+        store.put(ticker, f"{source}:{scope}", chain)
+    fresh_for = (listing.get("quotes_until") or [0.0])[0] - time.time()
+    if fresh_for > 0:
+        # Quotes that came with the listing seed the quote layer for every row until they go stale
+        with timed_stage(ticker.upper(), "normalize"):
+            quotes = _quotes_with(
+                chain, listing, np.arange(len(chain)), np.full(len(chain), np.nan), np.full(len(chain), np.nan),
+                np.zeros(len(chain), dtype=bool), time.monotonic() + fresh_for,
+            )
+        if scope is not None:
+            get_quote_store().put(ticker, f"{source}:{scope}", quotes)
+    return chain
+
+
+def _quotes_with(
+    chain: IndexedChain,
+    fetched: Dict[str, List[Any]],
+    rect: np.ndarray,
+    open_interest: np.ndarray,
+    bid: np.ndarray,
+    quoted: np.ndarray,
+    expires_at: float,
+) -> ChainQuotes:
+    """ChainQuotes with the rows rect of chain (re)quoted from fetched (QUOTE_FIELDS columns), in place of
+    open_interest / bid / quoted. Rows of rect missing from fetched (delisted, no quote) stay NaN.
+    """
+    symbols = pd.Index(fetched["ticker"])
+    unique = ~symbols.duplicated(keep="last")
+    positions = symbols[unique].get_indexer(chain.columns["symbol"][rect])
+    found = positions >= 0
+    open_interest[rect] = np.nan
+    bid[rect] = np.nan
+    open_interest[rect[found]] = _float_column(fetched["open_interest"])[unique][positions[found]]
+    bid[rect[found]] = _float_column(fetched["bid"])[unique][positions[found]]
+    quoted[rect] = True
+    return ChainQuotes(chain, open_interest, bid, quoted, expires_at)
+
+
+def load_chain_quotes(
+    ticker: str, api_key: str, source: str, chain: IndexedChain, rows: np.ndarray
+) -> Optional[ChainQuotes]:
+    """Quote layer covering rows of chain (the contracts that survived the DTE and ITM filters). Only the
+    rows not quoted yet are fetched, as one expiration x strike rectangle around them, and merged into the
+    stored layer until it expires (quote_ttl). Returns None when the quote fetch came back empty.
+    """
+    store = get_quote_store()
+    record_cache_event("quote_store", "calls")
+    scope = shared_scope(api_key)
+    quotes = store.get(ticker, f"{source}:{scope}") if scope is not None else None
+    if quotes is not None and quotes.chain is not chain:
+        quotes = None  # the listing was refetched, so row positions changed
+    if quotes is not None and quotes.covers(rows):
+        return quotes
+    record_cache_event("quote_store", "misses")
+    if quotes is None:
+        open_interest, bid = np.full(len(chain), np.nan), np.full(len(chain), np.nan)
+        quoted = np.zeros(len(chain), dtype=bool)
+        expires_at = time.monotonic() + quote_ttl()
+    else:
+        open_interest, bid, quoted = quotes.open_interest.copy(), quotes.bid.copy(), quotes.quoted.copy()
+        expires_at = quotes.expires_at
+    missing = rows[~quoted[rows]]
+    if missing.size:
+        exp_ordinal, strike = chain.columns["exp_ordinal"], chain.columns["strike"]
+        exp_lo, exp_hi = int(exp_ordinal[missing].min()), int(exp_ordinal[missing].max())
+        strike_lo, strike_hi = float(strike[missing].min()), float(strike[missing].max())
+        fetched = fetch_chain_quotes(
+            ticker, api_key, date.fromordinal(exp_lo).isoformat(), date.fromordinal(exp_hi).isoformat(),
+            strike_lo, strike_hi, source,
+        )
+        if not chain_found(fetched):
+            return None
+        with timed_stage(ticker.upper(), "normalize"):
+            rect = np.flatnonzero(
+                (exp_ordinal >= exp_lo) & (exp_ordinal <= exp_hi) & (strike >= strike_lo) & (strike <= strike_hi)
+            )
+            quotes = _quotes_with(chain, fetched, rect, open_interest, bid, quoted, expires_at)
+    else:
+        quotes = ChainQuotes(chain, open_interest, bid, quoted, expires_at)
+    scope = shared_scope(api_key)
+    if scope is not None:
+        store.put(ticker, f"{source}:{scope}", quotes)
+    return quotes
+
+
+# -----------------------------
+# Concurrent Execution
+# -----------------------------
+
+DEFAULT_MAX_WORKERS = 8
+AUTH_ABORT_MESSAGE = "Authentication issue detected. Aborting remaining tickers."
+
+
+class ScreenOutcome(NamedTuple):
+    """Result of screening one ticker. error is formatted like the UI errors list ("TICKER: message")."""
+    index: int
+    ticker: str
+    opportunities: List[Dict[str, Any]]
+    error: Optional[str] = None
+    aborted: bool = False  # set on the outcome that triggered the authentication abort
+
+
+def iter_screen_tickers(
+    tickers: List[str],
+    api_key: str,
+    dte_min: int,
+    dte_max: int,
+    min_oi: int,
+    today: date,
+    min_premium: float = 0.0,
+    min_annualized_roi: float = 0.0,
+    price_source_mode: str = "auto",
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    chain_source: str = "auto",
+    bulk_prices: bool = True,
+) -> Iterator[ScreenOutcome]:
+    """Run process_ticker concurrently on a thread pool and yield each ticker's outcome as soon as it completes.
+    At most 2 * max_workers tickers are in flight, so memory stays flat regardless of universe size.
+    A 401 error seen before any opportunities were found cancels the remaining tickers and ends the stream.
+    Chain and price sources marked "auto" are resolved from the key's detected plan (see resolve_price_source).
+    With bulk_prices, underlying prices for the whole list are loaded up front in one or a few calls.
+    Each ticker's quoted chain is snapshotted into the history store (see HistoryStore) as the run ends.
+    Rows come without the analytics columns; wrap the stream in iter_with_analytics where they are needed.
+    """
+    ctx = get_script_run_ctx()
+
+    def _run(tk: str) -> List[Dict[str, Any]]:
+        # Attach the Streamlit script context so cached helpers behave as on the main thread
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return process_ticker(
+            tk, api_key, dte_min, dte_max, min_oi, today,
+            min_premium=min_premium,
+            min_annualized_roi=min_annualized_roi,
+            price_source_mode=price_source_mode,
+            chain_source=chain_source,
+            price_table=price_table,
+        )
+
+    if chain_source == "auto" and api_key:
+        # Resolve once up front instead of racing every worker through the capability probe
+        chain_source = detect_chain_source(api_key)
+    price_source_mode = resolve_price_source(api_key, price_source_mode)
+    price_table = load_price_table(tickers, api_key, price_source_mode, today) if bulk_prices else None
+
+    workers = max(1, int(max_workers))
+    pending: Dict[Future, int] = {}
+    next_index = 0
+    found_any = False
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while pending or next_index < len(tickers):
+                while next_index < len(tickers) and len(pending) < workers * 2:
+                    # Each task runs in a copy of the caller's context so RunStats (track_run) follow it
+                    pending[pool.submit(contextvars.copy_context().run, _run, tickers[next_index])] = next_index
+                    next_index += 1
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in sorted(done, key=pending.get):
+                    i = pending.pop(fut)
+                    try:
+                        opps = fut.result()
+                    except Exception as e:
+                        error = f"{tickers[i]}: {e}"
+                        # Abort early if all remaining likely to fail due to auth
+                        if "401" in str(e) and not found_any:
+                            for other in pending:
+                                other.cancel()
+                            yield ScreenOutcome(i, tickers[i], [], error, aborted=True)
+                            return
+                        yield ScreenOutcome(i, tickers[i], [], error)
+                        continue
+                    found_any = found_any or bool(opps)
+                    yield ScreenOutcome(i, tickers[i], opps)
+    finally:
+        flush_history()  # this run's snapshots (see record_history) as one part
+
+
+ANALYTICS_BATCH_ROWS = 20_000  # outcome rows collected before one analytics solve
+ANALYTICS_BATCH_SECONDS = 0.5  # ... or this long after the first of them arrived
+
+
+def iter_with_analytics(
+    outcomes: Iterator[ScreenOutcome],
+    rate: float = RISK_FREE_RATE,
+    batch_rows: int = ANALYTICS_BATCH_ROWS,
+    batch_seconds: float = ANALYTICS_BATCH_SECONDS,
+) -> Iterator[ScreenOutcome]:
+    """Pass screening outcomes through with their analytics columns filled, solving once per batch of tickers
+    rather than once per ticker. Outcomes keep their order; a batch is released when it holds batch_rows rows,
+    batch_seconds after its first outcome arrived, on an aborting outcome and at the end of the stream.
+    """
+    held: List[ScreenOutcome] = []
+    held_rows = 0
+    started = 0.0
+
+    def release() -> List[ScreenOutcome]:
+        nonlocal held, held_rows
+        add_analytics_records([row for outcome in held for row in outcome.opportunities], rate)
+        batch, held, held_rows = held, [], 0
+        return batch
+
+    for outcome in outcomes:
+        if not held:
+            started = time.monotonic()
+        held.append(outcome)
+        held_rows += len(outcome.opportunities)
+        if held_rows >= batch_rows or outcome.aborted or time.monotonic() - started >= batch_seconds:
+            yield from release()
+    if held:
+        yield from release()
+
+
+def screen_tickers(
+    tickers: List[str],
+    api_key: str,
+    dte_min: int,
+    dte_max: int,
+    min_oi: int,
+    today: date,
+    min_premium: float = 0.0,
+    min_annualized_roi: float = 0.0,
+    price_source_mode: str = "auto",
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    chain_source: str = "auto",
+    bulk_prices: bool = True,
+    risk_free_rate: float = RISK_FREE_RATE,
+) -> tuple[List[Dict[str, Any]], List[str]]:
+    """Screen many tickers concurrently (see iter_screen_tickers), then solve the analytics columns once over
+    all results. Returns (results, errors), both in input ticker order regardless of completion order.
+    """
+    opps_by_index: Dict[int, List[Dict[str, Any]]] = {}
+    errors_by_index: Dict[int, str] = {}
+    aborted = False
+    for outcome in iter_screen_tickers(
+        tickers, api_key, dte_min, dte_max, min_oi, today,
+        min_premium=min_premium,
+        min_annualized_roi=min_annualized_roi,
+        price_source_mode=price_source_mode,
+        max_workers=max_workers,
+        chain_source=chain_source,
+        bulk_prices=bulk_prices,
+    ):
+        if outcome.error:
+            errors_by_index[outcome.index] = outcome.error
+        else:
+            opps_by_index[outcome.index] = outcome.opportunities
+        aborted = aborted or outcome.aborted
+
+    results: List[Dict[str, Any]] = []
+    errors: List[str] = []
+    for i in range(len(tickers)):
+        results.extend(opps_by_index.get(i, []))
+        if i in errors_by_index:
+            errors.append(errors_by_index[i])
+    if aborted:
+        errors.append(AUTH_ABORT_MESSAGE)
+    return add_analytics_records(results, risk_free_rate), errors
+
+
+# -----------------------------
+# Formatting Helpers
+# -----------------------------
+
+RESULT_COLUMNS = [
+    "Ticker",
+    "Stock Price",
+    "Strike",
+    "Expiration",
+    "DTE",
+    "Premium",
+    "Return if Assigned %",
+    "Breakeven",
+    "Downside Protection %",
+    "Annualized ROI %",
+    "Open Interest",
+    *ANALYTICS_COLUMNS,
+    "Contract",  # OCC option symbol (e.g. O:AAPL250117C00150000), the key live quote updates are matched on
+]
+
+
+def format_age(seconds: float) -> str:
+    """Compact age for the "data as of" caption: 42s, 5m, 3h 10m."""
+    seconds = max(0, int(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m"
+    return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+
+
+CURRENCY_COLUMNS = ["Stock Price", "Strike", "Premium", "Breakeven"]
+PERCENT_COLUMNS = [
+    "Return if Assigned %", "Downside Protection %", "Annualized ROI %", "IV %", "Prob. Assignment %",
+    "Expected Return %",
+]
+RESULTS_PAGE_ROWS = 2_000  # larger results are shown a page at a time
+
+
+def results_column_config(formatted: bool = True) -> Dict[str, Any]:
+    """Declarative currency / percent formats for st.dataframe. Values stay numeric (formatting happens in
+    the browser), so header sorting is numeric and no per-cell Python runs; formatted=False shows raw values.
+    """
+    if not formatted:
+        return {}
+    config: Dict[str, Any] = {col: st.column_config.NumberColumn(col, format="$%.2f") for col in CURRENCY_COLUMNS}
+    config.update({col: st.column_config.NumberColumn(col, format="%.2f%%") for col in PERCENT_COLUMNS})
+    config["Delta"] = st.column_config.NumberColumn("Delta", format="%.3f")
+    return config
+
+
+def results_page(df: pd.DataFrame, page: int, page_rows: int = RESULTS_PAGE_ROWS) -> pd.DataFrame:
+    """Rows of 1-based page (a view; nothing is copied or formatted)."""
+    start = (max(1, page) - 1) * page_rows
+    return df.iloc[start:start + page_rows]
+
+
+def results_to_frame(results: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Opportunity dicts -> numeric DataFrame in RESULT_COLUMNS order (empty input gives an empty frame)."""
+    return pd.DataFrame(results, columns=RESULT_COLUMNS)
+
+
+def filter_results_frame(
+    df: pd.DataFrame,
+    dte_min: int,
+    dte_max: int,
+    min_oi: int,
+    min_premium: float = 0.0,
+    min_annualized_roi: float = 0.0,
+) -> pd.DataFrame:
+    """Apply the sidebar thresholds to an already computed result frame.
+    Same bounds as compute_opportunities, so filtering a wide fetch here matches fetching with these values.
+    """
+    mask = (
+        df["DTE"].between(dte_min, dte_max)
+        & (df["Open Interest"] >= min_oi)
+        & (df["Premium"] >= min_premium)
+        & (df["Annualized ROI %"] >= min_annualized_roi)
+    )
+    return df[mask]
+
+
+def build_results_frame(results: Any, sort_choice: str, top_k: int = 0, per_ticker: int = 0) -> pd.DataFrame:
+    """Sorted numeric frame for a list of opportunity dicts or a result DataFrame, optionally limited to the
+    top_k rows / best per_ticker rows per underlying (see rank_results_frame).
+    """
+    df = results if isinstance(results, pd.DataFrame) else results_to_frame(results)
+    return rank_results_frame(df, sort_choice, top_k, per_ticker)
+
+
+SORT_METRICS = [
+    "Return if Assigned %", "Downside Protection %", "Annualized ROI %", "Expected Return %", "IV %",
+    "Prob. Assignment %",
+]
+
+
+def sort_column(sort_choice: str) -> str:
+    return sort_choice if sort_choice in SORT_METRICS else "Return if Assigned %"
+
+
+def sort_dataframe(df: pd.DataFrame, sort_choice: str) -> pd.DataFrame:
+    return df.sort_values(by=sort_column(sort_choice), ascending=False)
+
+
+def rank_results_frame(df: pd.DataFrame, sort_choice: str, top_k: int = 0, per_ticker: int = 0) -> pd.DataFrame:
+    """Frame counterpart of TopKRanker: keep each ticker's best per_ticker rows, then the best top_k rows
+    overall (0 = no limit), best first. nlargest is a partial sort, so its cost grows with top_k, not len(df).
+    """
+    col = sort_column(sort_choice)
+    if per_ticker:
+        df = df[df.groupby("Ticker", sort=False)[col].rank(method="first", ascending=False) <= per_ticker]
+    if top_k:
+        # nlargest skips NaN (e.g. unsolvable IV) only while top_k < len(df); drop them so every top_k agrees
+        return df.dropna(subset=[col]).nlargest(top_k, col)
+    return sort_dataframe(df, col)
+
+
+def best_per_ticker(rows: List[Dict[str, Any]], metric: str, n: int) -> List[Dict[str, Any]]:
+    """The n best rows by metric for each ticker in rows (input order kept); rows with a NaN metric are dropped."""
+    by_ticker: Dict[str, List[int]] = {}
+    for i, row in enumerate(rows):
+        if row[metric] == row[metric]:
+            by_ticker.setdefault(row["Ticker"], []).append(i)
+    keep: List[int] = []
+    for indices in by_ticker.values():
+        keep.extend(indices if len(indices) <= n else heapq.nlargest(n, indices, key=lambda i: rows[i][metric]))
+    return [rows[i] for i in sorted(keep)]
+
+
+class TopKRanker:
+    """Streaming top-K opportunity rows for each sort metric, fed as tickers complete.
+    Each metric keeps a bounded min-heap of (value, -sequence, row), so memory and ranking cost grow with k
+    rather than with the number of candidates seen; ties keep the earlier row, like rank_results_frame.
+    With per_ticker, only each ticker's best per_ticker rows compete: pass a ticker's complete rows in one
+    add() call, as a ScreenOutcome delivers them.
+    """
+
+    def __init__(self, k: int, per_ticker: int = 0, metrics: Any = tuple(SORT_METRICS)):
+        self.k = max(1, int(k))
+        self.per_ticker = max(0, int(per_ticker))
+        self.seen = 0  # candidate rows offered so far
+        self._heaps: Dict[str, List[tuple]] = {metric: [] for metric in metrics}
+        self._seq = 0
+
+    def add(self, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        self.seen += len(rows)
+        first = self._seq
+        self._seq += len(rows)
+        for metric, heap in self._heaps.items():
+            candidates = best_per_ticker(rows, metric, self.per_ticker) if self.per_ticker else rows
+            seq = {id(row): first + i for i, row in enumerate(rows)} if self.per_ticker else None
+            for i, row in enumerate(candidates):
+                value = row[metric]
+                if value != value:
+                    continue  # NaN (e.g. no implied volatility) never ranks, as with DataFrame.nlargest
+                if len(heap) >= self.k and value <= heap[0][0]:
+                    continue  # common case once the heap is full: cheaper than building the entry
+                entry = (value, -(seq[id(row)] if seq else first + i), row)
+                if len(heap) < self.k:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+
+    def top(self, metric: str) -> List[Dict[str, Any]]:
+        """Best rows for metric, best first."""
+        return [entry[2] for entry in sorted(self._heaps[sort_column(metric)], reverse=True)]
+
+
+# -----------------------------
+# Scenario Sweep
+# -----------------------------
+
+DEFAULT_DTE_WINDOW = (25, 45)  # the UI's default DTE range
+SWEEP_DTE_WINDOWS = "7-21, 21-45, 45-90, 90-180"
+SWEEP_MONEYNESS_BANDS = "0.95-1.0, 0.9-0.95, 0.8-0.9, 0-0.8"  # strike / stock price; upper bound exclusive
+SWEEP_MIN_OI = "0, 100, 1000"
+SWEEP_METRICS = [
+    "Contracts", "Tickers", "Median Annualized ROI %", "Best Annualized ROI %", "Median Downside Protection %",
+    "Median Return if Assigned %", "Median Prob. Assignment %",
+]
+SWEEP_MEDIAN_COLUMNS = {
+    "Median Annualized ROI %": "Annualized ROI %",
+    "Median Downside Protection %": "Downside Protection %",
+    "Median Return if Assigned %": "Return if Assigned %",
+    "Median Prob. Assignment %": "Prob. Assignment %",
+}
+SWEEP_CHUNK_CELLS = 4_000_000  # scenario x row mask cells evaluated per block (~4 MB of booleans)
+
+
+def widest_window(*windows: Optional[tuple]) -> tuple:
+    """Smallest (dte_min, dte_max) window containing every given one (None entries are skipped)."""
+    present = [w for w in windows if w is not None]
+    return (min(lo for lo, _ in present), max(hi for _, hi in present))
+
+
+def parse_ranges(text: str, cast: Callable[[str], Any] = float) -> List[tuple]:
+    """"7-21, 21-45" -> [(7, 21), (21, 45)]. Raises ValueError on malformed or reversed ranges."""
+    ranges = []
+    for part in re.split(r"[,\n]+", text):
+        part = part.strip()
+        if not part:
+            continue
+        m = re.fullmatch(r"([0-9.]+)\s*-\s*([0-9.]+)", part)
+        if not m:
+            raise ValueError(f"Expected a range like 21-45, got {part!r}")
+        lo, hi = cast(m.group(1)), cast(m.group(2))
+        if lo > hi:
+            raise ValueError(f"Range {part!r} is reversed")
+        ranges.append((lo, hi))
+    if not ranges:
+        raise ValueError("No ranges given")
+    return ranges
+
+
+def parse_dte_windows(text: str) -> List[tuple]:
+    return parse_ranges(text, int)
+
+
+def parse_values(text: str, cast: Callable[[str], Any] = int) -> List[Any]:
+    """"0, 100, 1000" -> [0, 100, 1000]."""
+    values = [cast(part.strip()) for part in re.split(r"[,\n]+", text) if part.strip()]
+    if not values:
+        raise ValueError("No values given")
+    return values
+
+
+def scenario_grid(dte_windows: List[tuple], moneyness_bands: List[tuple], min_ois: List[int]) -> pd.DataFrame:
+    """Every DTE window x moneyness band x minimum OI combination, one row per scenario with display labels."""
+    rows = [
+        {
+            "DTE Window": f"{dte_min}-{dte_max}",
+            "Moneyness": f"{m_lo:g}-{m_hi:g}",
+            "Min OI": min_oi,
+            "dte_min": dte_min,
+            "dte_max": dte_max,
+            "moneyness_min": m_lo,
+            "moneyness_max": m_hi,
+        }
+        for (dte_min, dte_max), (m_lo, m_hi), min_oi in itertools.product(dte_windows, moneyness_bands, min_ois)
+    ]
+    grid = pd.DataFrame(rows)
+    grid.insert(0, "Scenario", [
+        f"DTE {r['DTE Window']} | K/S {r['Moneyness']} | OI >= {r['Min OI']}" for r in rows
+    ])
+    return grid
+
+
+def _dimension_masks(values: np.ndarray, bounds: np.ndarray, upper_inclusive: bool = True) -> tuple:
+    """Row masks for each distinct (lower, upper) bound pair of one grid dimension, plus each scenario's pair."""
+    keys, inverse = np.unique(bounds, axis=0, return_inverse=True)
+    lower, upper = keys[:, :1], keys[:, 1:]
+    masks = (values >= lower) & ((values <= upper) if upper_inclusive else (values < upper))
+    return masks, inverse.reshape(-1)
+
+
+def scenario_masks(
+    df: pd.DataFrame,
+    grid: pd.DataFrame,
+    order: Optional[np.ndarray] = None,
+    chunk_cells: int = SWEEP_CHUNK_CELLS,
+) -> Iterator[tuple]:
+    """Yield (first scenario index, bool mask of shape scenarios x rows) blocks, with the rows taken in order
+    (default: frame order). Each distinct DTE window / moneyness band / OI floor is evaluated against the
+    rows once; a scenario's mask is then the AND of its three rows, so a block costs two passes over it.
+    """
+    dte = df["DTE"].to_numpy(float)
+    oi = df["Open Interest"].to_numpy(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        moneyness = df["Strike"].to_numpy(float) / df["Stock Price"].to_numpy(float)
+    if order is not None:
+        dte, oi, moneyness = dte[order], oi[order], moneyness[order]
+    dte_masks, dte_idx = _dimension_masks(dte, grid[["dte_min", "dte_max"]].to_numpy(float))
+    band_masks, band_idx = _dimension_masks(
+        moneyness, grid[["moneyness_min", "moneyness_max"]].to_numpy(float), upper_inclusive=False
+    )
+    oi_floor = grid["Min OI"].to_numpy(float)[:, None]
+    oi_masks, oi_idx = _dimension_masks(oi, np.hstack([oi_floor, np.full_like(oi_floor, np.inf)]))
+    step = max(1, chunk_cells // max(1, len(dte)))
+    for start in range(0, len(grid), step):
+        block = slice(start, start + step)
+        yield start, dte_masks[dte_idx[block]] & band_masks[band_idx[block]] & oi_masks[oi_idx[block]]
+
+
+def _masked_order_stats(mask: np.ndarray, sorted_values: np.ndarray) -> tuple:
+    """(median, maximum) of sorted_values under each mask row; the mask columns follow sorted_values, so the
+    k-th selected column of a row is its k-th smallest value and no per-scenario sort is needed.
+    """
+    rows, cols = np.nonzero(mask)
+    counts = np.bincount(rows, minlength=len(mask))
+    if not len(cols):
+        empty = np.full(len(mask), np.nan)
+        return empty, empty
+    first = np.cumsum(counts) - counts
+    has_rows = counts > 0
+
+    def nth(offset: np.ndarray) -> np.ndarray:
+        return np.where(has_rows, sorted_values[cols[np.where(has_rows, first + offset, 0)]], np.nan)
+
+    median = 0.5 * (nth((counts - 1) // 2) + nth(counts // 2))
+    return median, nth(counts - 1)
+
+
+def sweep_summary(df: pd.DataFrame, grid: pd.DataFrame) -> pd.DataFrame:
+    """Scenario-by-metric summary of one result frame (see SWEEP_METRICS) for every scenario in grid.
+    The rows are sorted once per metric and grouped by ticker once; each scenario block then only needs
+    vectorized mask reductions, so a grid of 100 scenarios costs a few passes over the rows, not 100 screens.
+    """
+    out = {name: np.zeros(len(grid)) for name in SWEEP_METRICS}
+    codes, _ = pd.factorize(df["Ticker"])
+    by_ticker = np.argsort(codes, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(codes[by_ticker]) != 0]) if len(df) else None
+    for start, mask in scenario_masks(df, grid, by_ticker):
+        stop = start + len(mask)
+        out["Contracts"][start:stop] = mask.sum(axis=1)
+        if starts is not None:
+            out["Tickers"][start:stop] = np.logical_or.reduceat(mask, starts, axis=1).sum(axis=1)
+    for name, col in SWEEP_MEDIAN_COLUMNS.items():
+        values = df[col].to_numpy(float)
+        order = np.argsort(values)
+        order = order[~np.isnan(values[order])]  # NaN (unsolvable IV) rows take no part in the median
+        for start, mask in scenario_masks(df, grid, order):
+            median, maximum = _masked_order_stats(mask, values[order])
+            out[name][start:start + len(mask)] = median
+            if col == "Annualized ROI %":
+                out["Best Annualized ROI %"][start:start + len(mask)] = maximum
+    summary = grid[["Scenario", "DTE Window", "Moneyness", "Min OI"]].copy()
+    for name in SWEEP_METRICS:
+        summary[name] = out[name].astype(int) if name in ("Contracts", "Tickers") else out[name]
+    return summary
+
+
+def scenario_rows(df: pd.DataFrame, grid: pd.DataFrame, index: int) -> pd.DataFrame:
+    """Drill-down: the result rows behind one scenario of grid."""
+    _, mask = next(scenario_masks(df, grid.iloc[[index]]))
+    return df[mask[0]]
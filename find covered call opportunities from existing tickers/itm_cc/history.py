@@ -0,0 +1,345 @@
+"""Snapshot history: the date-partitioned store screens append chain snapshots to."""
+
+from datetime import datetime, date, timedelta
+from typing import List, Dict, Any, Optional
+from pathlib import Path
+import itertools
+import threading
+import time
+import collections
+import json
+import os
+import shutil
+
+import streamlit as st
+import numpy as np
+
+from .client import APP_DIR, MARKET_TZ, per_run_resource
+
+
+# -----------------------------
+# Snapshot History
+# -----------------------------
+
+HISTORY_PATH = Path(os.environ.get("ITM_CC_HISTORY_DIR") or APP_DIR / ".itm_cc_history")
+HISTORY_ENABLED = os.environ.get("ITM_CC_HISTORY", "1") != "0"
+HISTORY_INTERVAL_SECONDS = float(os.environ.get("ITM_CC_HISTORY_INTERVAL", "3600"))  # min spacing per ticker
+# Dates older than this are deleted when a screen flushes (at most once per day per process); 0 keeps everything
+HISTORY_RETENTION_DAYS = int(os.environ.get("ITM_CC_HISTORY_RETENTION_DAYS", "730"))
+HISTORY_COMPACT_STALE_SECONDS = 3600  # a compaction lock this old was left by a crashed process
+HISTORY_FLUSH_ROWS = 250_000  # buffered contract rows written out before the run ends
+HISTORY_ROW_COLUMNS = {"strike": np.float64, "exp_ordinal": np.int32, "open_interest": np.int32, "bid": np.float64}
+
+
+def history_day(timestamp: float) -> date:
+    """Market date (America/New_York) a snapshot taken at timestamp belongs to."""
+    return datetime.fromtimestamp(timestamp, MARKET_TZ).date()
+
+
+def range_indices(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Concatenation of arange(start, start + count) for every pair, without a Python loop."""
+    counts = np.asarray(counts, dtype=np.int64)
+    shift = np.repeat(np.asarray(starts, dtype=np.int64) - (np.cumsum(counts) - counts), counts)
+    return shift + np.arange(int(counts.sum()), dtype=np.int64)
+
+
+def _snapshot_table(tickers: Any, prices: Any, times: Any, rows: Any) -> np.ndarray:
+    """A part's snapshot index: one record (ticker, price, time, contract rows) per snapshot."""
+    tickers = [str(tk) for tk in tickers]
+    width = max([len(tk) for tk in tickers] + [1])
+    table = np.zeros(len(tickers), dtype=[("ticker", f"U{width}"), ("price", "f8"), ("time", "f8"), ("rows", "i8")])
+    table["ticker"], table["price"], table["time"], table["rows"] = tickers, prices, times, rows
+    return table
+
+
+class HistoryStore:
+    """Append-only history of what screens saw, one directory per market date:
+
+        <root>/date=2026-10-16/<part>/snapshots.npy, strike.npy, exp_ordinal.npy, open_interest.npy, bid.npy
+
+    A snapshot is one ticker's price and quoted candidate contracts (the DTE / ITM selection of its screen) at
+    one moment. A part holds the snapshots of one flush ordered by (ticker, time) in snapshots.npy, and their
+    contract rows in the same order as one file per column. Parts are renamed into place once complete and
+    never modified, so readers memory-map them (read_part) while screens keep appending new parts.
+    The first flush of each market date starts maintain (drop the dates past retention_days, compact the closed
+    ones) on a background thread, so no screen waits for it.
+    """
+
+    def __init__(
+        self, root: Path, interval: float = HISTORY_INTERVAL_SECONDS, retention_days: int = HISTORY_RETENTION_DAYS
+    ):
+        self.root = Path(root)
+        self.interval = interval
+        self.retention_days = retention_days
+        self._maintained: Optional[date] = None
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = []  # (ticker, price, captured_at, {column: values})
+        self._pending_rows = 0
+        self._recorded_at: Dict[str, float] = {}
+        self._seen_days: set = set()
+        self._seq = itertools.count()
+
+    def record(
+        self,
+        ticker: str,
+        price: float,
+        columns: Dict[str, np.ndarray],
+        rows: np.ndarray,
+        captured_at: Optional[float] = None,
+    ) -> bool:
+        """Buffer a snapshot of columns[rows] (ChainQuotes.columns), keeping the quoted contracts with a bid,
+        unless ticker was recorded less than interval seconds ago (by any process writing to root). Returns
+        whether it was buffered.
+        """
+        captured_at = time.time() if captured_at is None else captured_at
+        tk = ticker.upper()
+        day = history_day(captured_at)
+        if day not in self._seen_days:
+            self._load_recorded(day)
+        with self._lock:
+            if captured_at - self._recorded_at.get(tk, float("-inf")) < self.interval:
+                return False
+            self._recorded_at[tk] = captured_at
+        keep = rows[columns["valid"][rows] & (columns["bid"][rows] > 0)]
+        snapshot = {name: columns[name][keep].astype(dtype) for name, dtype in HISTORY_ROW_COLUMNS.items()}
+        with self._lock:
+            self._pending.append((tk, float(price), captured_at, snapshot))
+            self._pending_rows += len(keep)
+            full = self._pending_rows >= HISTORY_FLUSH_ROWS
+        if full:
+            self.flush()
+        return True
+
+    def _load_recorded(self, day: date) -> None:
+        """Seed the per-ticker throttle with the snapshots other runs already wrote for day."""
+        latest: Dict[str, float] = {}
+        for _, parts in self.partitions(day, day):
+            for part in parts:
+                try:
+                    table = self.read_part(part, ("snapshots",))["snapshots"]
+                except (OSError, ValueError):
+                    continue  # removed by a concurrent compaction
+                for tk, at in zip(table["ticker"].tolist(), table["time"].tolist()):
+                    latest[tk] = max(at, latest.get(tk, at))
+        with self._lock:
+            self._seen_days.add(day)
+            for tk, at in latest.items():
+                self._recorded_at[tk] = max(at, self._recorded_at.get(tk, at))
+
+    def record_prices(self, day: date, prices: Dict[str, float], captured_at: float) -> Optional[Path]:
+        """Write price-only snapshots (e.g. closes used to settle expirations) as a part of day."""
+        if not prices:
+            return None
+        empty = {name: np.empty(0, dtype) for name, dtype in HISTORY_ROW_COLUMNS.items()}
+        return self._write_part(
+            day, self._part_arrays([(tk.upper(), float(p), captured_at, empty) for tk, p in prices.items()])
+        )
+
+    def flush(self) -> List[Path]:
+        """Write the buffered snapshots as one new part per market date; returns the parts written."""
+        with self._lock:
+            pending, self._pending, self._pending_rows = self._pending, [], 0
+        by_day: Dict[date, List[tuple]] = collections.defaultdict(list)
+        for snapshot in pending:
+            by_day[history_day(snapshot[2])].append(snapshot)
+        written = [self._write_part(day, self._part_arrays(snapshots)) for day, snapshots in sorted(by_day.items())]
+        if written:
+            self.maintain_in_background(history_day(time.time()))
+        return written
+
+    def maintain_in_background(self, today: date) -> None:
+        """Start maintain(today) on a daemon thread, at most once per market date for this store."""
+        with self._lock:
+            if self._maintained == today:
+                return
+            self._maintained = today
+        threading.Thread(target=self.maintain, args=(today,), name="history-maintenance", daemon=True).start()
+
+    def maintain(self, today: date) -> List[date]:
+        """Drop the dates past retention_days and compact the closed dates still in several parts; returns the
+        dates compacted. A date with a damaged part is left as it is (`history --compact` reports the error).
+        """
+        if self.retention_days > 0:
+            self.prune(today - timedelta(days=self.retention_days))
+        compacted = []
+        for day, parts in self.partitions(end=today - timedelta(days=1)):
+            if len(parts) < 2:
+                continue
+            try:
+                if self.compact(day):
+                    compacted.append(day)
+            except (OSError, ValueError):
+                continue
+        return compacted
+
+    def prune(self, before: date) -> List[date]:
+        """Delete every date older than before; returns the dates removed."""
+        removed = []
+        for path in sorted(self.root.glob("date=*")) if self.root.is_dir() else []:
+            try:
+                day = date.fromisoformat(path.name[len("date="):])
+            except ValueError:
+                continue
+            if day < before:
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(day)
+        return removed
+
+    @staticmethod
+    def _part_arrays(snapshots: List[tuple]) -> Dict[str, np.ndarray]:
+        snapshots = sorted(snapshots, key=lambda s: (s[0], s[2]))
+        arrays = {"snapshots": _snapshot_table(
+            [s[0] for s in snapshots], [s[1] for s in snapshots], [s[2] for s in snapshots],
+            [len(s[3]["strike"]) for s in snapshots],
+        )}
+        for name, dtype in HISTORY_ROW_COLUMNS.items():
+            arrays[name] = np.concatenate([s[3][name] for s in snapshots] + [np.empty(0, dtype)]).astype(dtype)
+        return arrays
+
+    def _write_part(self, day: date, arrays: Dict[str, np.ndarray], name: Optional[str] = None) -> Path:
+        partition = self.root / f"date={day.isoformat()}"
+        partition.mkdir(parents=True, exist_ok=True)
+        name = name or f"{time.time_ns()}-{os.getpid()}-{next(self._seq)}"
+        staging = partition / f".{name}"
+        staging.mkdir()
+        for column, values in arrays.items():
+            np.save(staging / f"{column}.npy", values)
+        os.replace(staging, partition / name)  # readers see all of a part or none of it
+        return partition / name
+
+    def partitions(self, start: Optional[date] = None, end: Optional[date] = None) -> List[tuple]:
+        """[(market date, [part directories])] for the dates within start..end (inclusive), oldest first."""
+        out = []
+        if not self.root.is_dir():
+            return out
+        for path in sorted(self.root.glob("date=*")):
+            try:
+                day = date.fromisoformat(path.name[len("date="):])
+            except ValueError:
+                continue
+            if (start is not None and day < start) or (end is not None and day > end):
+                continue
+            parts = sorted(p for p in path.iterdir() if p.is_dir() and not p.name.startswith("."))
+            if parts:
+                out.append((day, parts))
+        return out
+
+    @staticmethod
+    def read_part(part: Path, columns: Optional[tuple] = None) -> Dict[str, np.ndarray]:
+        """Memory-mapped columns of one part (all by default); pages are only read from disk when touched."""
+        names = columns or ("snapshots", *HISTORY_ROW_COLUMNS)
+        return {name: np.load(part / f"{name}.npy", mmap_mode="r") for name in names}
+
+    def _take_compaction_lock(self, partition: Path) -> Optional[Path]:
+        """Create partition's .compacting lock (holding a JSON journal: pid, start time, then the merged part
+        and the parts it replaces). A lock older than HISTORY_COMPACT_STALE_SECONDS was left by a crashed
+        compaction: it is finished from its journal (or its staging part dropped) and taken over. Returns None
+        while another process holds a live lock.
+        """
+        lock = partition / ".compacting"
+        for _ in range(2):
+            try:
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    if time.time() - lock.stat().st_mtime < HISTORY_COMPACT_STALE_SECONDS:
+                        return None
+                    journal = json.loads(lock.read_text(encoding="utf-8") or "{}")
+                except (OSError, ValueError):
+                    journal = {}
+                merged = journal.get("merged")
+                if merged and (partition / merged).is_dir():
+                    for name in journal.get("parts", []):  # crashed after the merged part went in
+                        shutil.rmtree(partition / name, ignore_errors=True)
+                elif merged:
+                    shutil.rmtree(partition / f".{merged}", ignore_errors=True)
+                lock.unlink(missing_ok=True)
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump({"pid": os.getpid(), "started": time.time()}, fh)
+            return lock
+        return None
+
+    def compact(self, day: date) -> Optional[Path]:
+        """Merge one date's parts into a single part, so a backtest opens a few files per date instead of a few
+        per screen. Meant for closed dates (maintain runs it after each market date); returns None when there
+        was nothing to merge or another process is compacting the same date.
+        """
+        partition = self.root / f"date={day.isoformat()}"
+        parts = next((p for _, p in self.partitions(day, day)), [])
+        if len(parts) < 2:
+            return None
+        lock = self._take_compaction_lock(partition)
+        if lock is None:
+            return None
+        try:
+            parts = next((p for _, p in self.partitions(day, day)), [])  # a crashed run's leftovers are gone now
+            if len(parts) < 2:
+                return None
+            loaded = [self.read_part(p) for p in parts]
+            tables = [data["snapshots"] for data in loaded]
+            tickers = np.concatenate([table["ticker"] for table in tables])
+            times = np.concatenate([table["time"] for table in tables])
+            counts = np.concatenate([table["rows"] for table in tables])
+            order = np.lexsort((times, tickers))
+            rows = range_indices((np.cumsum(counts) - counts)[order], counts[order])
+            arrays = {"snapshots": _snapshot_table(
+                tickers[order], np.concatenate([table["price"] for table in tables])[order], times[order],
+                counts[order],
+            )}
+            for name in HISTORY_ROW_COLUMNS:
+                arrays[name] = np.concatenate([data[name] for data in loaded])[rows]
+            del loaded, tables  # release the memory maps before the parts are removed
+            name = f"{time.time_ns()}-{os.getpid()}-{next(self._seq)}"
+            # Journal first, so a crash between placing the merged part and removing its inputs is finished
+            # by the next compaction instead of leaving every snapshot of the date twice
+            lock.write_text(json.dumps({
+                "pid": os.getpid(), "started": time.time(), "merged": name, "parts": [p.name for p in parts],
+            }), encoding="utf-8")
+            merged = self._write_part(day, arrays, name)
+            for part in parts:
+                shutil.rmtree(part, ignore_errors=True)
+            return merged
+        finally:
+            lock.unlink(missing_ok=True)
+
+    def summary(self, start: Optional[date] = None, end: Optional[date] = None) -> List[Dict[str, Any]]:
+        """One row per stored date: parts, snapshots, tickers, contract rows and bytes on disk."""
+        out = []
+        for day, parts in self.partitions(start, end):
+            tables = [self.read_part(part, ("snapshots",))["snapshots"] for part in parts]
+            out.append({
+                "date": day.isoformat(),
+                "parts": len(parts),
+                "snapshots": sum(len(table) for table in tables),
+                "tickers": len({tk for table in tables for tk in table["ticker"].tolist()}),
+                "contracts": sum(int(table["rows"].sum()) for table in tables),
+                "bytes": sum(f.stat().st_size for part in parts for f in part.iterdir()),
+            })
+        return out
+
+
+@per_run_resource
+@st.cache_resource(show_spinner=False)
+def get_history_store() -> Optional[HistoryStore]:
+    """Process-wide snapshot writer (None when ITM_CC_HISTORY=0)."""
+    return HistoryStore(HISTORY_PATH) if HISTORY_ENABLED else None
+
+
+def record_history(ticker: str, stock_price: float, columns: Dict[str, np.ndarray], rows: np.ndarray) -> None:
+    """Snapshot a screened ticker into the history store. Best effort: a screen never fails on it."""
+    store = get_history_store()
+    if store is not None:
+        try:
+            store.record(ticker, stock_price, columns, rows)
+        except (OSError, ValueError):  # ValueError: np.load of a damaged part
+            pass
+
+
+def flush_history() -> None:
+    store = get_history_store()
+    if store is not None:
+        try:
+            store.flush()
+        except (OSError, ValueError):
+            pass
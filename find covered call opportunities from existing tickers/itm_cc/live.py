@@ -0,0 +1,235 @@
+"""Live quote feed: streaming trades / quotes that keep a screen's marks fresh."""
+
+from typing import Dict, Any
+import threading
+import time
+import collections
+import json
+import os
+
+import streamlit as st
+import pandas as pd
+
+try:  # optional: fast whole-page decoding when ijson (with a C backend) is not available
+    import orjson
+except ImportError:
+    orjson = None
+try:  # optional: streaming trades / quotes for live mode
+    from websockets.sync.client import connect as ws_connect
+    from websockets.exceptions import WebSocketException
+except ImportError:
+    ws_connect = None
+    WebSocketException = OSError
+
+from .engine import ANALYTICS_COLUMNS, RISK_FREE_RATE, add_analytics_columns, covered_call_metrics
+
+
+# -----------------------------
+# Live Quote Feed
+# -----------------------------
+
+POLYGON_WS_BASE_URL = os.environ.get("POLYGON_WS_BASE_URL", "wss://socket.polygon.io").rstrip("/")
+# Cluster -> channel prefix: last trades for the underlyings, NBBO quotes (bid) for the option contracts
+LIVE_CHANNELS = {"stocks": "T.", "options": "Q."}
+LIVE_REFRESH_SECONDS = 1.0  # table redraws in live mode; updates in between are coalesced per symbol
+LIVE_MAX_CONTRACTS = 1000  # Polygon streams quotes for at most 1,000 option contracts per connection
+LIVE_IDLE_SECONDS = 30.0  # a session that stops polling is unsubscribed (e.g. its tab was closed)
+LIVE_SUBSCRIBE_CHUNK = 500  # symbols per subscribe / unsubscribe message
+LIVE_RECONNECT_MAX_SECONDS = 30.0
+LIVE_REFUSED_RETRY_SECONDS = 300.0  # after an auth_failed (plan without streaming) the cluster rests this long
+LIVE_POLL_SECONDS = 0.25  # recv timeout; subscription changes are sent between messages
+
+
+class LiveFeedAuthError(Exception):
+    pass
+
+
+class LiveQuoteFeed:
+    """Process-wide stream of underlying trades and option quotes for one API key (Polygon allows one
+    connection per cluster and key, so sessions share it). Each session subscribes the symbols it shows;
+    the feed keeps one connection per cluster for the union, reconnecting with backoff, and stops once
+    no session has polled for LIVE_IDLE_SECONDS.
+    Updates are kept as the latest value per symbol with a sequence number, so a session reading
+    updates_since(cursor) gets only what changed since its last read, however many messages arrived.
+    """
+
+    def __init__(self, api_key: str, base_url: str = POLYGON_WS_BASE_URL, idle_seconds: float = LIVE_IDLE_SECONDS):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sessions: Dict[str, tuple[float, frozenset, frozenset]] = {}
+        self._latest: "collections.OrderedDict[str, tuple[int, float]]" = collections.OrderedDict()
+        self._seq = 0
+        self._threads: Dict[str, threading.Thread] = {}
+        self._refused_until: Dict[str, float] = {}
+        self.status: Dict[str, str] = {cluster: "idle" for cluster in LIVE_CHANNELS}
+        self.counters = {"messages": 0, "updates": 0, "reconnects": 0}
+
+    def subscribe(self, session_id: str, underlyings: Any, contracts: Any) -> None:
+        """Replace what session_id watches (empty for both unsubscribes it) and start missing connections."""
+        underlyings, contracts = frozenset(underlyings), frozenset(list(contracts)[:LIVE_MAX_CONTRACTS])
+        with self._lock:
+            if underlyings or contracts:
+                self._sessions[session_id] = (time.monotonic(), underlyings, contracts)
+            else:
+                self._sessions.pop(session_id, None)
+            for cluster, symbols in (("stocks", underlyings), ("options", contracts)):
+                thread = self._threads.get(cluster)
+                if self._refused_until.get(cluster, 0.0) > time.monotonic():
+                    continue
+                if symbols and (thread is None or not thread.is_alive()):
+                    thread = threading.Thread(target=self._run, args=(cluster,), daemon=True, name=f"live-{cluster}")
+                    self._threads[cluster] = thread
+                    self.status[cluster] = "connecting"
+                    thread.start()
+
+    def updates_since(self, cursor: int) -> tuple[int, Dict[str, float], Dict[str, float]]:
+        """(new cursor, {underlying: last trade}, {contract: bid}) for symbols updated after cursor."""
+        prices: Dict[str, float] = {}
+        bids: Dict[str, float] = {}
+        with self._lock:
+            for symbol in reversed(self._latest):  # most recently updated first
+                seq, value = self._latest[symbol]
+                if seq <= cursor:
+                    break
+                (bids if symbol.startswith("O:") else prices)[symbol] = value
+            return self._seq, prices, bids
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.counters, **self.status, "sessions": len(self._sessions), "symbols": len(self._latest),
+            }
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _wanted(self, cluster: str) -> set:
+        """Channels the live sessions want on cluster (e.g. {"T.AAPL"}); drops idle sessions."""
+        now = time.monotonic()
+        prefix = LIVE_CHANNELS[cluster]
+        with self._lock:
+            for session_id, (seen, _, _) in list(self._sessions.items()):
+                if now - seen > self.idle_seconds:
+                    del self._sessions[session_id]
+            position = 1 if cluster == "stocks" else 2
+            return {prefix + symbol for entry in self._sessions.values() for symbol in entry[position]}
+
+    def _record(self, symbol: str, value: Any) -> None:
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return
+        if not value >= 0:
+            return
+        self._seq += 1
+        self._latest[symbol] = (self._seq, value)
+        self._latest.move_to_end(symbol)
+        self.counters["updates"] += 1
+
+    def _handle(self, raw: Any) -> bool:
+        """Apply one feed message (a JSON array of events); True once the connection is authenticated."""
+        authenticated = False
+        events = (orjson.loads if orjson is not None else json.loads)(raw)
+        with self._lock:
+            self.counters["messages"] += 1
+            for event in events if isinstance(events, list) else [events]:
+                kind = event.get("ev")
+                if kind == "T":
+                    self._record(str(event.get("sym")), event.get("p"))
+                elif kind == "Q":
+                    self._record(str(event.get("sym")), event.get("bp"))
+                elif kind == "status":
+                    if event.get("status") == "auth_failed":
+                        raise LiveFeedAuthError(event.get("message") or "authentication failed")
+                    authenticated = authenticated or event.get("status") == "auth_success"
+        return authenticated
+
+    def _send_channels(self, ws: Any, action: str, channels: set) -> None:
+        ordered = sorted(channels)
+        for i in range(0, len(ordered), LIVE_SUBSCRIBE_CHUNK):
+            ws.send(json.dumps({"action": action, "params": ",".join(ordered[i:i + LIVE_SUBSCRIBE_CHUNK])}))
+
+    def _run(self, cluster: str) -> None:
+        """Connection loop for one cluster: authenticate, keep the subscription equal to _wanted(cluster)
+        and record events, until nothing is wanted, the key is refused or stop() is called.
+        """
+        backoff = 1.0
+        while not self._stop.is_set() and self._wanted(cluster):
+            subscribed: set = set()
+            try:
+                with ws_connect(f"{self.base_url}/{cluster}", open_timeout=10, close_timeout=1) as ws:
+                    self.status[cluster] = "authenticating"
+                    ws.send(json.dumps({"action": "auth", "params": self.api_key}))
+                    authenticated = False
+                    while not self._stop.is_set():
+                        if authenticated:
+                            wanted = self._wanted(cluster)
+                            if not wanted:
+                                break
+                            if wanted != subscribed:
+                                self._send_channels(ws, "unsubscribe", subscribed - wanted)
+                                self._send_channels(ws, "subscribe", wanted - subscribed)
+                                self._forget(subscribed - wanted)
+                                subscribed = wanted
+                        try:
+                            raw = ws.recv(timeout=LIVE_POLL_SECONDS)
+                        except TimeoutError:
+                            continue
+                        if self._handle(raw) and not authenticated:
+                            authenticated = True
+                            backoff = 1.0
+                            self.status[cluster] = "live"
+            except LiveFeedAuthError as e:
+                with self._lock:
+                    self._refused_until[cluster] = time.monotonic() + LIVE_REFUSED_RETRY_SECONDS
+                self.status[cluster] = f"refused: {e}"
+                return
+            except (WebSocketException, OSError, ValueError) as e:
+                self.status[cluster] = f"reconnecting ({type(e).__name__})"
+                with self._lock:
+                    self.counters["reconnects"] += 1
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, LIVE_RECONNECT_MAX_SECONDS)
+            finally:
+                self._forget(subscribed)
+        self.status[cluster] = "idle"
+
+    def _forget(self, channels: set) -> None:
+        """Drop the latest values of channels nobody is subscribed to any more."""
+        with self._lock:
+            for channel in channels:
+                self._latest.pop(channel[2:], None)
+
+
+@st.cache_resource(show_spinner=False)
+def get_live_feed(api_key: str) -> LiveQuoteFeed:
+    return LiveQuoteFeed(api_key)
+
+
+def apply_live_quotes(
+    df: pd.DataFrame, prices: Dict[str, float], bids: Dict[str, float], rate: float = RISK_FREE_RATE
+) -> tuple[pd.DataFrame, int]:
+    """Reprice result rows from live updates: new underlying prices (by Ticker) and bids (by Contract) give
+    new Stock Price / Premium and the metrics derived from them; the analytics columns are re-solved for the
+    touched tickers only. Rows are never added or dropped (a re-screen picks up new contracts).
+    Returns (frame, rows repriced); the input frame is not modified.
+    """
+    touched = df["Ticker"].isin(prices.keys()) | df["Contract"].isin(bids.keys())
+    if not touched.any():
+        return df, 0
+    out = df.copy()
+    sub = out[touched]
+    stock_price = sub["Ticker"].map(prices).fillna(sub["Stock Price"]).astype(float)
+    premium = sub["Contract"].map(bids).fillna(sub["Premium"]).astype(float)
+    out.loc[touched, "Stock Price"] = stock_price
+    out.loc[touched, "Premium"] = premium
+    metrics = covered_call_metrics(stock_price, sub["Strike"].astype(float), premium, sub["DTE"].astype(float))
+    for col, values in metrics.items():
+        out.loc[touched, col] = values
+    # The expected-return reference vol is a per-ticker median, so whole tickers are re-solved
+    same_ticker = out["Ticker"].isin(sub["Ticker"].unique())
+    out.loc[same_ticker, ANALYTICS_COLUMNS] = add_analytics_columns(out[same_ticker], rate)[ANALYTICS_COLUMNS]
+    return out, int(touched.sum())
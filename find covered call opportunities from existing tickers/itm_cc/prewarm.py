@@ -0,0 +1,277 @@
+"""Background pre-warming of saved views."""
+
+from datetime import date
+from typing import List, Dict, Any, Optional, Callable
+from pathlib import Path
+import sqlite3
+import threading
+import time
+import json
+import os
+
+import streamlit as st
+import pandas as pd
+
+from .client import (
+    APP_DIR, CONFIG_PATH, MARKET_OPEN, get_disk_cache, get_polygon_client, in_market_session, market_now,
+    next_market_time, quote_ttl, track_run,
+)
+from .engine import (
+    AUTH_ABORT_MESSAGE, DEFAULT_DTE_WINDOW, DEFAULT_MAX_WORKERS, format_age, invalidate_ticker_data,
+    iter_screen_tickers, widest_window,
+)
+
+
+# -----------------------------
+# Background Pre-warming
+# -----------------------------
+
+VIEWS_PATH = APP_DIR / ".itm_cc_views.sqlite"
+PREWARM_INTERVAL_SECONDS = float(os.environ.get("ITM_CC_PREWARM_INTERVAL", "60"))
+PREWARM_DUE_FRACTION = 0.8  # refresh once data is this far into its freshness window, so clicks find it warm
+PREWARM_BUDGET_FRACTION = 0.5  # share of the requests-per-minute budget pre-warming may use
+PREWARM_REQUESTS_PER_TICKER = 3.0  # first guess (price, quotes, a listing page); learned from each cycle
+PREWARM_VIEW_WINDOW = 7 * 24 * 3600.0  # tickers screened within a week count as watched
+PREWARM_VIEW_BOOST = 3.0  # a ticker viewed just now is up to 4x as urgent as an unviewed one of the same age
+PREWARM_VIEW_HALF_LIFE = 3600.0
+PRICE_ENDPOINTS = ("last_price", "previous_close")
+QUOTE_ENDPOINTS = ("chain_quotes",)
+
+
+class ViewLog:
+    """When each ticker was last screened in the UI, in a small SQLite file shared by every session and the
+    pre-warm worker (WAL mode, one connection per process).
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS views (ticker TEXT PRIMARY KEY, viewed_at REAL NOT NULL)")
+
+    def record(self, tickers: List[str], at: Optional[float] = None) -> None:
+        at = time.time() if at is None else at
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO views (ticker, viewed_at) VALUES (?, ?)", [(tk.upper(), at) for tk in tickers]
+            )
+
+    def recent(self, since: float) -> Dict[str, float]:
+        """{ticker: last viewed (epoch seconds)} for tickers viewed after since, most recent first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ticker, viewed_at FROM views WHERE viewed_at > ? ORDER BY viewed_at DESC", (since,)
+            ).fetchall()
+        return dict(rows)
+
+
+@st.cache_resource(show_spinner=False)
+def get_view_log() -> Optional[ViewLog]:
+    """Process-wide view log, or None if the file cannot be opened (e.g. read-only directory)."""
+    try:
+        return ViewLog(VIEWS_PATH)
+    except sqlite3.Error:
+        return None
+
+
+def saved_watchlist(path: Path = CONFIG_PATH) -> List[str]:
+    """Tickers saved with "Remember API key & tickers" (empty without a readable config file)."""
+    try:
+        text = json.loads(path.read_text(encoding="utf-8")).get("tickers") or ""
+    except (OSError, ValueError, AttributeError):
+        return []
+    return [t.strip().upper() for t in text.splitlines() if t.strip()]
+
+
+def data_refreshed_at() -> Dict[str, float]:
+    """When each ticker's screen data was last fetched, from the disk cache: the older of its latest price
+    and latest quote fetch (epoch seconds). Tickers missing either are absent.
+    """
+    cache = get_disk_cache()
+    if cache is None:
+        return {}
+    try:
+        prices = cache.fetched_times(PRICE_ENDPOINTS)
+        quotes = cache.fetched_times(QUOTE_ENDPOINTS)
+    except sqlite3.Error:
+        return {}
+    return {tk: min(at, prices[tk]) for tk, at in quotes.items() if tk in prices}
+
+
+def prewarm_priorities(
+    tickers: List[str], refreshed_at: Dict[str, float], viewed_at: Dict[str, float], now: float, due_after: float
+) -> List[tuple[str, float]]:
+    """(ticker, urgency) for the tickers whose data is at least due_after seconds old, most urgent first.
+    Urgency is the data age in units of due_after (never fetched = inf), times up to 1 + PREWARM_VIEW_BOOST
+    for a ticker viewed just now (the boost halves every PREWARM_VIEW_HALF_LIFE). Ties keep the input order.
+    """
+    ranked = []
+    for tk in tickers:
+        age = now - refreshed_at[tk] if tk in refreshed_at else float("inf")
+        if age < due_after:
+            continue
+        boost = 1.0
+        if tk in viewed_at:
+            boost += PREWARM_VIEW_BOOST * 0.5 ** (max(0.0, now - viewed_at[tk]) / PREWARM_VIEW_HALF_LIFE)
+        # Never-fetched tickers all score inf; the boost still orders them
+        ranked.append((tk, age / max(due_after, 1.0) * boost, boost))
+    ranked.sort(key=lambda item: (-item[1], -item[2]))
+    return [(tk, urgency) for tk, urgency, _ in ranked]
+
+
+class PrewarmScheduler:
+    """Keeps watched tickers warm so a Find Opportunities click is served from the caches. Watched tickers are
+    the saved watchlist, tickers screened in the UI within PREWARM_VIEW_WINDOW and any extra tickers.
+    During market hours, every interval seconds it re-screens (over dte_window, bypassing the caches) the tickers whose prices / quotes are due, most urgent first (prewarm_priorities), as many as
+    PREWARM_BUDGET_FRACTION of the requests-per-minute budget allows; the rest wait for the next cycle.
+    Outside the session it sleeps until the next open. Runs on a daemon thread (start) or in the foreground
+    (run, for the prewarm command).
+    """
+
+    def __init__(
+        self,
+        interval: float = PREWARM_INTERVAL_SECONDS,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        outside_hours: bool = False,
+        extra_tickers: tuple = (),
+    ):
+        self.interval = interval
+        self.max_workers = max_workers
+        self.outside_hours = outside_hours
+        self.extra_tickers = tuple(extra_tickers)
+        self.api_key = ""
+        self.price_source_mode = "auto"
+        self.dte_window = DEFAULT_DTE_WINDOW  # widened to every window the UI fetched since (see watch_window)
+        self.requests_per_ticker = PREWARM_REQUESTS_PER_TICKER
+        self.status: Dict[str, Any] = {
+            "state": "stopped", "cycles": 0, "last_cycle_at": None, "next_run_at": None,
+            "due": 0, "refreshed": [], "errors": [], "requests": 0,
+        }
+        self._refreshed: Dict[str, float] = {}  # this process' own refreshes (when there is no disk cache)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def watched(self, viewed_at: Dict[str, float]) -> List[str]:
+        return list(dict.fromkeys([*self.extra_tickers, *saved_watchlist(), *viewed_at]))
+
+    def snapshot(self, now: Optional[float] = None) -> tuple[List[str], Dict[str, float], Dict[str, float]]:
+        """(watched tickers, last refresh per ticker, last view per ticker)."""
+        now = time.time() if now is None else now
+        view_log = get_view_log()
+        viewed_at = view_log.recent(now - PREWARM_VIEW_WINDOW) if view_log is not None else {}
+        refreshed_at = data_refreshed_at()
+        for tk, at in self._refreshed.items():
+            refreshed_at[tk] = max(at, refreshed_at.get(tk, 0.0))
+        return self.watched(viewed_at), refreshed_at, viewed_at
+
+    def ticker_budget(self) -> Optional[int]:
+        """Tickers one cycle may refresh under the shared rate limit (None = unlimited)."""
+        rate = get_polygon_client().limiter.rate_per_minute
+        if rate <= 0:
+            return None
+        return max(1, int(rate * PREWARM_BUDGET_FRACTION * self.interval / 60.0 / self.requests_per_ticker))
+
+    def run_cycle(self) -> List[str]:
+        """Refresh the most urgent due tickers within the budget; returns the tickers refreshed."""
+        now = time.time()
+        tickers, refreshed_at, viewed_at = self.snapshot(now)
+        due = prewarm_priorities(tickers, refreshed_at, viewed_at, now, quote_ttl() * PREWARM_DUE_FRACTION)
+        picks = [tk for tk, _ in due[:self.ticker_budget()]]
+        self.status.update(last_cycle_at=now, due=len(due), refreshed=[], errors=[], requests=0)
+        if not picks:
+            return []
+        invalidate_ticker_data(picks)
+        refreshed: List[str] = []
+        errors: List[str] = []
+        with track_run(f"prewarm {len(picks)} tickers") as stats:
+            for outcome in iter_screen_tickers(
+                picks, self.api_key, *self.dte_window, 0, date.today(),
+                price_source_mode=self.price_source_mode, max_workers=self.max_workers,
+            ):
+                if outcome.error:
+                    errors.append(outcome.error)
+                else:
+                    refreshed.append(outcome.ticker)
+                if outcome.aborted:
+                    errors.append(AUTH_ABORT_MESSAGE)
+                    self._stop.set()
+        done = time.time()
+        self._refreshed.update({tk: done for tk in refreshed})
+        requests_made = len(stats.requests)
+        # Learn the cost per ticker (listings are day-scoped, so most cycles only pay for prices and quotes)
+        self.requests_per_ticker = max(1.0, 0.5 * self.requests_per_ticker + 0.5 * requests_made / len(picks))
+        self.status.update(
+            cycles=self.status["cycles"] + 1, refreshed=refreshed, errors=errors, requests=requests_made
+        )
+        return refreshed
+
+    def run(self, on_cycle: Optional[Callable[[Dict[str, Any]], None]] = None) -> None:
+        """Cycle until stop(): every interval during market hours (or always with outside_hours), otherwise
+        sleep until the next open. on_cycle gets the status after each cycle.
+        """
+        self._stop.clear()
+        while not self._stop.is_set():
+            now = market_now()
+            if self.outside_hours or in_market_session(now):
+                self.status["state"] = "running"
+                try:
+                    self.run_cycle()
+                except Exception as e:  # keep the worker alive; the next cycle retries
+                    self.status["errors"] = [f"Pre-warm cycle failed: {e}"]
+                if on_cycle is not None:
+                    on_cycle(self.status)
+                wait = self.interval
+            else:
+                self.status["state"] = "waiting for the market open"
+                wait = (next_market_time(now, MARKET_OPEN) - now).total_seconds()
+            self.status["next_run_at"] = time.time() + wait
+            self._stop.wait(wait)
+        self.status.update(state="stopped", next_run_at=None)
+
+    def start(self, api_key: str, price_source_mode: str = "auto", max_workers: Optional[int] = None) -> None:
+        self.api_key = api_key
+        self.price_source_mode = price_source_mode
+        if max_workers is not None:
+            self.max_workers = max_workers
+        self._stop.clear()  # a thread stopped but still finishing its cycle just carries on
+        if not self.running:
+            self._thread = threading.Thread(target=self.run, daemon=True, name="prewarm")
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def watch_window(self, window: tuple) -> None:
+        """Also keep the expirations of a DTE window a session fetched warm."""
+        self.dte_window = widest_window(self.dte_window, window)
+
+
+@st.cache_resource(show_spinner=False)
+def get_prewarm_scheduler() -> PrewarmScheduler:
+    """The in-process scheduler, shared by every session on this server."""
+    return PrewarmScheduler()
+
+
+def prewarm_status_frame(scheduler: PrewarmScheduler) -> pd.DataFrame:
+    """Per watched ticker: data age, last view and when it is next refreshed, most urgent first."""
+    now = time.time()
+    tickers, refreshed_at, viewed_at = scheduler.snapshot(now)
+    due_after = quote_ttl() * PREWARM_DUE_FRACTION
+    urgency = dict(prewarm_priorities(tickers, refreshed_at, viewed_at, now, due_after))
+    rows = []
+    # Due tickers in refresh order, then the rest by how soon they come due
+    for tk in [tk for tk in urgency] + sorted(set(tickers) - set(urgency), key=lambda t: refreshed_at[t]):
+        refreshed = refreshed_at.get(tk)
+        rows.append({
+            "Ticker": tk,
+            "Last refresh": f"{format_age(now - refreshed)} ago" if refreshed else "never",
+            "Last viewed": f"{format_age(now - viewed_at[tk])} ago" if tk in viewed_at else "",
+            "Next refresh": "due" if tk in urgency else f"in {format_age(refreshed + due_after - now)}",
+        })
+    return pd.DataFrame(rows, columns=["Ticker", "Last refresh", "Last viewed", "Next refresh"])
@@ -0,0 +1,209 @@
+"""Multi-process universe runner over a SQLite work queue."""
+
+from datetime import date
+from typing import List, Dict, Any, Optional
+from pathlib import Path
+import sqlite3
+import threading
+import signal
+import time
+import json
+import os
+import zlib
+
+from .client import SharedTokenBucket, get_polygon_client
+from .engine import iter_screen_tickers, iter_with_analytics
+
+
+# -----------------------------
+# Universe Runner (multi-process)
+# -----------------------------
+
+class WorkQueue:
+    """SQLite-backed per-ticker work queue for universe runs, shared by the coordinating process and its
+    workers (one connection each, WAL mode). Tasks move pending -> running -> done / failed; failures go
+    back to pending until max_attempts is reached. Each finished task keeps its rows (zlib JSON) so the
+    output file can be rebuilt on resume, and a merged flag tracks what the coordinator has written.
+    Run settings and the abort / stop flags live in a small meta table.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), timeout=60, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tasks (
+                    ticker TEXT PRIMARY KEY,
+                    idx INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    error TEXT,
+                    rows BLOB,
+                    row_count INTEGER NOT NULL DEFAULT 0,
+                    merged INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_claim ON tasks(status, attempts, idx)")
+
+    def get_meta(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_meta(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value, sort_keys=True))
+            )
+
+    def stop_reason(self) -> Optional[str]:
+        """Why workers should stop claiming work (authentication abort or coordinator interrupt), else None."""
+        return self.get_meta("aborted") or self.get_meta("stop")
+
+    def add(self, tickers: List[str]) -> int:
+        """Queue tickers not already known (in order after the existing ones); returns how many were added."""
+        now = time.time()
+        with self._lock:
+            start = self._conn.execute("SELECT COALESCE(MAX(idx) + 1, 0) FROM tasks").fetchone()[0]
+            cur = self._conn.executemany(
+                "INSERT OR IGNORE INTO tasks (ticker, idx, updated_at) VALUES (?, ?, ?)",
+                [(tk, start + i, now) for i, tk in enumerate(tickers)],
+            )
+            return cur.rowcount
+
+    def recover(self) -> int:
+        """Requeue tasks left running by a crashed or interrupted run; returns how many."""
+        with self._lock:
+            cur = self._conn.execute("UPDATE tasks SET status = 'pending', worker = NULL WHERE status = 'running'")
+            return cur.rowcount
+
+    def claim(self, worker: str, limit: int) -> List[str]:
+        """Atomically move up to limit pending tickers (fewest attempts first, then queue order) to running."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                tickers = [row[0] for row in self._conn.execute(
+                    "SELECT ticker FROM tasks WHERE status = 'pending' ORDER BY attempts, idx LIMIT ?", (limit,)
+                )]
+                self._conn.executemany(
+                    "UPDATE tasks SET status = 'running', attempts = attempts + 1, worker = ?, updated_at = ? "
+                    "WHERE ticker = ?",
+                    [(worker, time.time(), tk) for tk in tickers],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return tickers
+
+    def complete(self, ticker: str, rows: List[Dict[str, Any]]) -> None:
+        payload = zlib.compress(json.dumps(rows, separators=(",", ":")).encode("utf-8"), 6)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE tasks SET status = 'done', error = NULL, rows = ?, row_count = ?, updated_at = ? "
+                "WHERE ticker = ?",
+                (payload, len(rows), time.time(), ticker),
+            )
+
+    def fail(self, ticker: str, error: str, max_attempts: int) -> None:
+        """Record a failed attempt: back to pending while attempts remain, else failed for good."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, "
+                "error = ?, worker = NULL, updated_at = ? WHERE ticker = ?",
+                (max_attempts, error, time.time(), ticker),
+            )
+
+    def release(self, worker: str) -> None:
+        """Return a worker's unfinished claims to pending without counting the attempt."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE tasks SET status = 'pending', attempts = attempts - 1, worker = NULL "
+                "WHERE status = 'running' AND worker = ?",
+                (worker,),
+            )
+
+    def take_finished(self, limit: int = 500) -> List[tuple]:
+        """Finished tasks the coordinator has not merged yet, as (ticker, status, rows, error); marks them merged."""
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT ticker, status, rows, error FROM tasks "
+                "WHERE merged = 0 AND status IN ('done', 'failed') ORDER BY idx LIMIT ?",
+                (limit,),
+            ).fetchall()
+            self._conn.executemany("UPDATE tasks SET merged = 1 WHERE ticker = ?", [(row[0],) for row in found])
+        return [
+            (ticker, status, json.loads(zlib.decompress(rows)) if rows else [], error)
+            for ticker, status, rows, error in found
+        ]
+
+    def reset_merged(self) -> None:
+        """Mark everything unmerged so a resumed run rewrites the full output from the queue."""
+        with self._lock:
+            self._conn.execute("UPDATE tasks SET merged = 0")
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        counts = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+        counts.update(dict(rows))
+        return counts
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def init_universe_worker(limiter: SharedTokenBucket) -> None:
+    """Process pool initializer: draw requests from the shared budget (importing the package already quieted
+    bare-mode Streamlit logging). Ctrl+C is left to the coordinator, which asks workers to stop through the queue.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    get_polygon_client().limiter = limiter
+
+
+def universe_worker(queue_path: str, api_key: str, settings: Dict[str, Any]) -> int:
+    """Worker process loop: claim batches of pending tickers, screen each batch on a thread pool
+    (iter_screen_tickers) and record every outcome in the queue until nothing is left to claim or the run
+    was aborted or interrupted. Returns the number of outcomes recorded.
+    """
+    queue = WorkQueue(Path(queue_path))
+    worker = f"pid-{os.getpid()}"
+    recorded = 0
+    try:
+        while not queue.stop_reason():
+            batch = queue.claim(worker, settings["batch_size"])
+            if not batch:
+                break
+            outcomes = iter_screen_tickers(
+                batch, api_key, settings["dte_min"], settings["dte_max"], settings["min_oi"],
+                date.fromisoformat(settings["today"]),
+                min_premium=settings["min_premium"],
+                min_annualized_roi=settings["min_roi"],
+                price_source_mode=settings["price_source"],
+                max_workers=settings["threads"],
+                chain_source=settings["chain_source"],
+            )
+            for outcome in iter_with_analytics(outcomes, settings["risk_free_rate"]):
+                if outcome.aborted:
+                    # Left running, so release() requeues it for the resumed run with a fixed key
+                    queue.set_meta("aborted", outcome.error)
+                    break
+                recorded += 1
+                if outcome.error:
+                    queue.fail(outcome.ticker, outcome.error, settings["max_attempts"])
+                else:
+                    queue.complete(outcome.ticker, outcome.opportunities)
+                if queue.stop_reason():
+                    break
+            queue.release(worker)  # tickers left unscreened by an abort / interrupt
+    finally:
+        queue.close()
+    return recorded